@@ -3,6 +3,7 @@ Note to self: https://stackoverflow.com/questions/18713086/virtualenv-wont-activ
               Set-ExecutionPolicy Unrestricted -Force -Scope CurrentUser
 """
 import logging
+import os
 from datetime import timedelta
 from tomllib import load as load_toml
 from typing import Any
@@ -11,8 +12,12 @@ from dotenv import dotenv_values
 from requests import Session
 
 from bronnen import Amsterdam, Bammens, Welvaarts
+from local.backup import WriteBehind
 from local.pull import pull_amsterdam, pull_bammens, pull_welvaarts
 from local.push import push_containers, push_gebieden, push_wegingen
+from local.push.gebieden import LOD_TOLERANTIES, lod_filename
+from local.push.jsontools import SHARED_STRINGS
+from local.push.publish import publish
 from local.push.tools import last_monday
 from local.storage import stored_pickle
 
@@ -38,28 +43,45 @@ def main() -> None:
 
     logger.info('Haal alle nieuwe data up uit bronsystemen...')
 
+    # Bestanden worden op de achtergrond geschreven terwijl de volgende bron
+    # opgehaald wordt. Bij het verlaten van de context is alles weggeschreven.
     with (stored_pickle(config['sessie']['amsterdam'], Session) as ses_a,
           stored_pickle(config['sessie']['bammens'], Session) as ses_b,
-          stored_pickle(config['sessie']['welvaarts'], Session) as ses_w):
+          stored_pickle(config['sessie']['welvaarts'], Session) as ses_w,
+          WriteBehind() as writer):
 
         amsterdam_api = Amsterdam(ses_a)
         bammens_api = Bammens(ses_b, auth=tokens['bammens'])
         welvaarts_api = Welvaarts(ses_w, auth=tokens['welvaarts'])
 
-        pull_amsterdam(amsterdam_api, config['data'], rate_limit=timedelta(days=2))
-        pull_bammens(bammens_api, config['data'], rate_limit=timedelta(hours=8))
-        pull_welvaarts(welvaarts_api, config['data'], rate_limit=timedelta(minutes=1))
+        pull_amsterdam(amsterdam_api, config['data'], rate_limit=timedelta(days=2),
+                       writer=writer)
+        pull_bammens(bammens_api, config['data'], rate_limit=timedelta(hours=8),
+                     writer=writer)
+        pull_welvaarts(welvaarts_api, config['data'], rate_limit=timedelta(minutes=1),
+                       writer=writer)
 
     logger.info('Combineer de gegevens en produceer output bestanden...')
 
-    push_gebieden(config['html']['gebieden'], config['data'])
-    push_containers(config['html']['containers'], config['data'])
+    gebieden = push_gebieden(config['html']['gebieden'], config['data'])
+    containers = push_containers(config['html']['containers'], config['data'],
+                                 cache_file=config['cache']['container-rijen'], tiles=True)
     push_wegingen(config['html']['wegingen'], config['html']['wegingen-updates'],
-                  config['data'], config['html'], after=last_monday(n_weeks_back=4))
+                  config['data'], config['html'], after=last_monday(n_weeks_back=4),
+                  cache_files=config['cache'], containers=containers, gebieden=gebieden,
+                  weekly=True)
+
+    html = config['html']
+    publish([
+        html['containers'],
+        html['gebieden'],
+        *(lod_filename(html['gebieden'], t) for t in LOD_TOLERANTIES),
+        html['wegingen-updates'],
+        os.path.join(os.path.dirname(html['wegingen']), SHARED_STRINGS),
+    ])
 
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
     # logging.getLogger('urllib3').setLevel(logging.WARN)
-    logging.getLogger('matplotlib').setLevel(logging.WARN)
     main()
@@ -200,8 +200,8 @@ export class App {
         this.kaart.setData({wegingen: state.wegingen.data})
     }
 
-    setContainers({data}) {
-        this.kaart.setData({containers: data})
+    setContainers(tiles) {
+        this.kaart.setData({containers: tiles})
     }
 
     setGebieden({stadsdelen, wijken}) {
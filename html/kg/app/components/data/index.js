@@ -0,0 +1,429 @@
+'use strict'
+
+/**
+ * Decoders voor CompressedJSON (zie local/push/jsontools.py).
+ */
+const cumulative = (values) => {
+    const [window, low] = values.slice(0, 2)
+    let a = 0
+    return values.slice(2).map((d) => (
+        d < window ? (a = ((a + d) % window + window) % window) + low : null
+    ))
+}
+
+const lookup = (values, reference) => values.map((i) => reference[i])
+
+const base64Bytes = (data) => {
+    if (Uint8Array.fromBase64) {
+        return Uint8Array.fromBase64(data)
+    }
+    const binary = atob(data)
+    const bytes = new Uint8Array(binary.length)
+    for (let i = 0; i < binary.length; i++) {
+        bytes[i] = binary.charCodeAt(i)
+    }
+    return bytes
+}
+
+/**
+ * 'breedte:aantal:base64' of 'v:aantal:base64' (varints), zie pack() in
+ * jsontools.py. Zigzag: 0, 1, 2, 3, ... -> 0, -1, 1, -2, ...
+ */
+const unpack = (values) => {
+    if (typeof values !== 'string') {
+        return values
+    }
+    const [kind, n, data] = values.split(':')
+    const bytes = base64Bytes(data)
+    const out = new Array(Number(n))
+    if (kind === 'v') {
+        // Tot 53 bits, dus met doubles in plaats van bit operaties.
+        let i = 0, z = 0, scale = 1
+        for (let p = 0; p < bytes.length; p++) {
+            const b = bytes[p]
+            if (b < 0x80) {
+                z += b * scale
+                out[i++] = z % 2 ? -(z + 1) / 2 : z / 2
+                z = 0
+                scale = 1
+            }
+            else {
+                z += (b & 0x7f) * scale
+                scale *= 128
+            }
+        }
+    }
+    else {
+        // Hooguit 24 bits, plus 7 in de buffer: past in 32 bits.
+        const width = Number(kind)
+        const mask = (1 << width) - 1
+        let acc = 0, bits = 0, p = 0
+        for (let i = 0; i < out.length; i++) {
+            while (bits < width) {
+                acc |= bytes[p++] << bits
+                bits += 8
+            }
+            const z = acc & mask
+            out[i] = (z >>> 1) ^ -(z & 1)
+            acc >>>= width
+            bits -= width
+        }
+    }
+    return out
+}
+
+const split = (values, symbol) => values === '' ? [] : values.split(symbol)
+
+const divide = (values, factor) => {
+    const invFactor = 1 / factor
+    return values.map((v) => v !== null ? v * invFactor : v)
+}
+
+const repeat = ([values, counts]) => values.flatMap((v, i) => Array(counts[i]).fill(v))
+
+const tear = ([sizes, values], position = 0) => sizes.map((size) => (
+    values.slice(position, position += size)
+))
+
+const separate = (rows, field) => {
+    const grouped = {}
+    if (field) {
+        rows.forEach(({[field]: key, ...row}) => {
+            grouped[key] = grouped[key] ?? []
+            grouped[key].push(row)
+        })
+    }
+    else {
+        grouped.data = rows
+    }
+    return grouped
+}
+
+const untranspose = (columns) => {
+    const n = Object.values(columns)[0]?.length ?? 0
+    const template = Object.fromEntries(Object.keys(columns).map((k) => [k, '']))
+    const rows = new Array(n).fill(0).map(() => ({...template}))
+    Object.entries(columns).forEach(([field, values]) => {
+        values.forEach((v, i) => {rows[i][field] = v})
+    })
+    return rows
+}
+
+const methods = {
+    'b': unpack, 'b>': unpack,
+    'd': cumulative, 'd>': cumulative,
+    'i': lookup,
+    'j': split, 'j>': split,
+    'm': divide, 'm>': divide,
+    'r': repeat, 'r>': repeat,
+    's': tear, 's>': tear,
+    'w': lookup,
+    'x': lookup, 'x>': lookup,
+}
+
+/**
+ * Decodeert de kolommen van één blok ({data, raw}). dictionaries zijn de
+ * gedeelde woordenboeken ('w'): {naam: strings}.
+ */
+const untransformColumns = ({data, raw}, transform, dictionaries) => {
+    const obj = {raw: {...raw}, data: {...data}}
+    const indexes = obj.raw
+
+    ;['raw', 'data'].forEach((channel) => {
+        const values = obj[channel]
+        for (const [field, transforms] of Object.entries(transform[channel])) {
+            // Kopie: transform wordt voor elk blok opnieuw gebruikt.
+            const reversed = [...transforms].reverse()
+            reversed.forEach((method, i) => {
+                const args = {
+                    'i': indexes[field],
+                    'j': reversed[i - 1], 'j>': reversed[i - 1],
+                    'm': reversed[i - 1], 'm>': reversed[i - 1],
+                    'w': dictionaries[reversed[i - 1]],
+                    'x': indexes[reversed[i - 1]], 'x>': indexes[reversed[i - 1]],
+                }
+                const fun = methods[method]
+                const arg = args[method]
+                if (!fun) {
+                    return
+                }
+                values[field] = method.endsWith('>')
+                    ? values[field].map((v) => fun(v, arg))
+                    : fun(values[field], arg)
+            })
+        }
+    })
+    return obj.data
+}
+
+/**
+ * Bestanden van CompressedJSON.append() hebben blokken die elk los
+ * gecodeerd zijn. De kolommen van de blokken worden achter elkaar gezet.
+ */
+const untransform = ({last_change, data, raw, blocks, transform, dictionaries: _, ...kwds},
+                     dictionaries = {}) => {
+    let columns
+    if (blocks) {
+        columns = {}
+        blocks.forEach((block) => {
+            const blockColumns = untransformColumns(block, transform, dictionaries)
+            Object.entries(blockColumns).forEach(([field, values]) => {
+                columns[field] = [...(columns[field] ?? []), ...values]
+            })
+        })
+    }
+    else {
+        columns = untransformColumns({data, raw}, transform, dictionaries)
+    }
+
+    const rows = untranspose(columns)
+    return {last_change, ...kwds, ...separate(rows, transform.group)}
+}
+
+
+export class DataStreams {
+    #abort = new AbortController()
+
+    constructor(rootNode, {sources}) {
+        this.rootNodeRef = new WeakRef(rootNode)
+        this.sources = {}
+        this.timers = {}
+        this.dictionaries = {}
+        Object.entries(sources).forEach(([key, source]) => this.addSource(key, source))
+    }
+
+    get rootNode() {return this.rootNodeRef.deref()}
+
+    _onDataChange(key, data) {
+        const source = this.sources[key]
+        this.rootNode.dispatchEvent(new CustomEvent('datachange', {
+            detail: {key, data, source},
+        }))
+    }
+
+    addSource(key, source) {
+        if (this.#abort.signal.aborted) {
+            return
+        }
+        this.sources[key] = source
+        this.fetchJson(key)
+    }
+
+    fetchJson = async (key) => {
+        const start = Date.now()
+        const source = this.sources[key]
+        clearTimeout(this.timers[key])
+
+        const signal = this.#abort.signal
+        const data = source.weeks
+            ? await this.fetchWeeks(source, signal)
+            : source.deltas
+            ? await this.fetchDeltas(source, signal)
+            : source.tiles
+            ? await this.fetchTiles(source, signal)
+            : await this.fetchFile(source, signal)
+        if (data) {
+            this._onDataChange(key, data)
+        }
+
+        if (source.interval > 0 && !signal.aborted) {
+            const wait = start + source.interval - Date.now()
+            this.timers[key] = setTimeout(this.fetchJson, wait, key)
+        }
+    }
+
+    /**
+     * Haalt source.url op (zie resolve()). Geeft de data, of undefined als er
+     * niets veranderd is.
+     */
+    fetchFile = async (source, signal) => {
+        const {url, files} = await this.resolve(source, signal)
+
+        // Een gehashte naam die we al hebben is niet veranderd.
+        if (files && url === source.published) {
+            return
+        }
+        source.published = files && url
+        const response = await fetch(url, {cache: files ? 'default' : 'no-cache', signal})
+        const json = await response.json()
+
+        if (source.last_change !== json.last_change) {
+            source.last_change = json.last_change
+            return this.decode(source, json, response.url, files)
+        }
+    }
+
+    /**
+     * Met source.weeks is source.url het manifest van push_weeks (zie
+     * local/push/wegingen.py), met een bestand per ISO week. Van de laatste
+     * source.weeks weken wordt een week alleen opgehaald als zijn url (met de
+     * hash van de inhoud) veranderd is: afgesloten weken komen dus uit de
+     * cache van de browser, tot er late wegingen bij komen. De rijen van de
+     * weken komen samen in één resultaat.
+     */
+    fetchWeeks = async (source, signal) => {
+        const response = await fetch(source.url, {cache: 'no-cache', signal})
+        const {last_change, weken = []} = await response.json()
+        if (source.last_change === last_change) {
+            return
+        }
+        source.last_change = last_change
+
+        const loaded = source.loaded ?? {}
+        source.loaded = {}
+        for (const week of weken.slice(-source.weeks)) {
+            const url = new URL(week.url, response.url).href
+            if (loaded[week.week]?.url !== url) {
+                const weekResponse = await fetch(url, {signal})
+                const json = await weekResponse.json()
+                loaded[week.week] = {url, ...await this.decode(source, json, weekResponse.url)}
+            }
+            source.loaded[week.week] = loaded[week.week]
+        }
+        return {
+            last_change,
+            data: Object.values(source.loaded).flatMap((week) => week.data),
+        }
+    }
+
+    /**
+     * Met source.deltas is source.url de index van de keten van deltas (zie
+     * push_deltas in local/push/wegingen.py). Na versie N worden de deltas
+     * N+1..head opgehaald, de eerste keer alleen de laatste. Geeft de rijen
+     * van die deltas samen, met de last_delta van de eerste: sluit die niet
+     * aan (de keten is ingekort), dan moet alles opnieuw opgehaald worden.
+     */
+    fetchDeltas = async (source, signal) => {
+        const response = await fetch(source.url, {cache: 'no-cache', signal})
+        const {last_change, head, deltas = []} = await response.json()
+        if (source.last_change === last_change) {
+            return
+        }
+        source.last_change = last_change
+
+        const after = source.version ?? head - 1
+        source.version = head
+        const missing = deltas.filter(({version}) => version > after)
+        if (!missing.length) {
+            return
+        }
+
+        const data = []
+        for (const delta of missing) {
+            const url = new URL(delta.file, response.url)
+            url.searchParams.set('v', delta.last_change)
+            const deltaResponse = await fetch(url, {signal})
+            const json = await deltaResponse.json()
+            const decoded = await this.decode(source, json, deltaResponse.url)
+            data.push(...decoded.data)
+        }
+        return {
+            last_change,
+            last_delta: missing[0].last_delta,
+            version: head,
+            data,
+        }
+    }
+
+    /**
+     * Met source.tiles is source.url de index van de tegels (zie
+     * local/push/tiles.py). Geeft {last_change, minZoom, maxZoom, getTileData}
+     * voor een deck.gl TileLayer: getTileData haalt een tegel op en decodeert
+     * hem, en geeft [] voor een tegel die niet in de index staat. De hash van
+     * de tegel staat in de url, dus een tegel die niet veranderd is komt uit
+     * de cache van de browser.
+     */
+    fetchTiles = async (source, signal) => {
+        const response = await fetch(source.url, {cache: 'no-cache', signal})
+        const {last_change, min_zoom, max_zoom, tiles = {}} = await response.json()
+        if (source.last_change === last_change) {
+            return
+        }
+        source.last_change = last_change
+
+        const getTileData = async ({index: {x, y, z}, signal: tileSignal}) => {
+            const tile = `${z}/${x}/${y}`
+            if (!tiles[tile]) {
+                return []
+            }
+            const url = new URL(`${tile}.min.json`, response.url)
+            url.searchParams.set('v', tiles[tile])
+            const tileResponse = await fetch(url, {signal: tileSignal ?? signal})
+            const json = await tileResponse.json()
+            const {data} = await this.decode(source, json, tileResponse.url)
+            return data
+        }
+        return {last_change, minZoom: min_zoom, maxZoom: max_zoom, getTileData}
+    }
+
+    /**
+     * Meer (of minder) weken voor een bron met weeks. Weken die er al zijn
+     * worden niet opnieuw opgehaald.
+     */
+    setWeeks(key, weeks) {
+        const source = this.sources[key]
+        source.weeks = weeks
+        source.last_change = undefined
+        this.fetchJson(key)
+    }
+
+    /**
+     * Decodeert json (als source.compressed), met de woordenboeken die het
+     * nodig heeft. Die staan naast het bestand (base), of in files.
+     */
+    decode = async (source, json, base, files) => {
+        const dictionaries = {}
+        for (const [name, version] of Object.entries(json.dictionaries ?? {})) {
+            const url = new URL(files?.[name] ?? name, base).href
+            dictionaries[name] = await this.fetchDictionary(url, version)
+        }
+        return source.compressed ? untransform(json, dictionaries) : json
+    }
+
+    /**
+     * Met source.manifest (zie local/push/publish.py) komt de url uit het
+     * manifest: een naam met de hash van de inhoud, die de browser mag
+     * cachen. Geeft {url, files}. Zonder manifest, of als het bestand er
+     * niet in staat, is files undefined en is url gewoon source.url.
+     */
+    resolve = async (source, signal) => {
+        if (source.manifest) {
+            const response = await fetch(source.manifest, {cache: 'no-cache', signal})
+            if (response.ok) {
+                const {files = {}} = await response.json()
+                const published = files[source.url.split('/').pop()]
+                if (published) {
+                    return {url: new URL(published, response.url).href, files}
+                }
+            }
+        }
+        return {url: source.url}
+    }
+
+    /**
+     * Een gedeeld woordenboek wordt één keer opgehaald (ook als meerdere
+     * bronnen er tegelijk om vragen), en opnieuw als een bestand een hogere
+     * versie nodig heeft. Ids blijven gelijk, dus een nieuwere versie is goed.
+     */
+    fetchDictionary = async (url, version) => {
+        const pending = this.dictionaries[url]
+        let dictionary = pending && await pending
+        if (!dictionary || dictionary.version < version) {
+            if (this.dictionaries[url] === pending) {
+                const signal = this.#abort.signal
+                this.dictionaries[url] = fetch(url, {cache: 'no-cache', signal})
+                    .then((response) => response.json())
+            }
+            dictionary = await this.dictionaries[url]
+        }
+        return dictionary.strings
+    }
+
+    stop() {
+        this.#abort.abort()
+        Object.values(this.timers).forEach((tid) => clearTimeout(tid))
+        this.timers = {}
+        this.sources = {}
+        this.dictionaries = {}
+    }
+}
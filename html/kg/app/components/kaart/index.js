@@ -64,9 +64,12 @@ export class Kaart {
                 onClick: this._onClick,
             },
             containers: {
+                // Tegels, zie setData().
+                renderSubLayers: (props) => new ScatterplotLayer(props),
+                getTileData: () => [],
                 ...layerProps.containers,
                 id: 'containers',
-                data: data.containers ?? [],
+                data: null,
                 pickable: true,
                 onClick: this._onClick,
             },
@@ -174,7 +177,7 @@ export class Kaart {
                 new PathLayer(layerProps.stadsdelen),
                 new PolygonLayer(layerProps.wijken),
                 new ScatterplotLayer(layerProps.wegingen),
-                new ScatterplotLayer(layerProps.containers),
+                new TileLayer(layerProps.containers),
                 new ScatterplotLayer(layerProps.highlight),
             ],
         })
@@ -193,7 +196,15 @@ export class Kaart {
             layerProps.wijken.data = wijken
         }
         if (containers) {
-            layerProps.containers.data = containers
+            // Van DataStreams.fetchTiles(). Een nieuwe last_change laadt de
+            // tegels opnieuw.
+            const {last_change, minZoom, maxZoom, getTileData} = containers
+            Object.assign(layerProps.containers, {
+                minZoom,
+                maxZoom,
+                getTileData,
+                updateTriggers: {getTileData: last_change},
+            })
         }
         if (wegingen) {
             layerProps.wegingen.data = wegingen
@@ -1,23 +1,39 @@
 'use strict'
 
 /**
- * Data URL's
+ * Data URL's. Het manifest wijst per bestand een versie met de hash van de
+ * inhoud in de naam aan (zie local/push/publish.py). Zonder manifest, of als
+ * het bestand er niet in staat, wordt url zelf opgehaald.
+ *
+ * De wegingen staan per ISO week in een eigen bestand. url is dan het
+ * manifest van de weken, en weeks het aantal weken dat geladen wordt.
+ *
+ * De updates zijn een keten van deltas met volgnummers. url is dan de index
+ * van de keten.
+ *
+ * De containers staan in tegels. url is de index van de tegels.
  */
+const manifest = './data/manifest.json'
+
 export const bronnen = {
     containers: {
-        url: './data/containers.min.json',
+        url: './data/containers/tiles.json',
+        tiles: true,
         compressed: true,
     },
     gebieden: {
-        url: './data/gebieden.min.json',
+        url: './data/gebieden.5m.min.json',
+        manifest,
         compressed: true,
     },
     wegingen: {
-        url: './data/wegingen.min.json',
+        url: './data/wegingen.weken.json',
+        weeks: 5,
         compressed: true,
     },
     wegingenDelta: {
-        url: './data/wegingen.3min.json',
+        url: './data/wegingen.3min.index.json',
+        deltas: true,
         interval: 2 * 60 * 1000,
         compressed: true,
     }
@@ -147,14 +163,15 @@ export const wijkenLayerProps = {
 }
 
 /**
- * Containerlocaties met afvalfractie.
+ * Containerlocaties met afvalfractie, in tegels. Onder maxZoom zijn de
+ * containers samengevat: een punt per cluster of per cel, met het aantal.
  */
 export const containersLayerProps = {
     filled: true,
     getFillColor: ({fractie}) => fractieKleur[fractie] ?? [80, 80, 80],
     stroked: false,
     getLineColor: ({fractie}) => fractieKleur[fractie] ?? [80, 80, 80],
-    getRadius: 1,
+    getRadius: ({aantal = 1}) => Math.sqrt(aantal),
     radiusScale: 1,
     radiusMinPixels: 0,
     radiusMaxPixels: 100,
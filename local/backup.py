@@ -17,8 +17,12 @@ last_change is het timestamp van het meest recente item in data. Dit timestamp
     als last_sync. Ook kan de klok verschillen dus de twee tijden zijn niet
     vergelijkbaar.
 """
+import os
 from collections.abc import Callable, Hashable
 from itertools import chain
+from queue import Queue
+from tempfile import NamedTemporaryFile
+from threading import Thread
 from typing import Any
 
 from orjson import dumps, loads
@@ -39,8 +43,86 @@ def load(filename: str) -> JSON:
 
 
 def save(filename: str, obj: JSON) -> None:
-    with open(filename, 'wb') as f:
-        f.write(dumps(obj))
+    """Schrijft obj atomair weg naar filename (zie save_bytes)."""
+    save_bytes(filename, dumps(obj))
+
+
+def save_bytes(filename: str, data: bytes) -> None:
+    """Schrijft data atomair weg naar filename.
+
+    Eerst naar een tijdelijk bestand in dezelfde map, daarna een rename. Een
+    half geschreven bestand vervangt dus nooit een goed bestand.
+    """
+    directory = os.path.dirname(filename) or '.'
+    with NamedTemporaryFile('wb', dir=directory, prefix='.tmp-', delete=False) as f:
+        try:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+            # NamedTemporaryFile is alleen voor de eigenaar leesbaar. Output
+            # moet ook door de webserver gelezen kunnen worden.
+            os.fchmod(f.fileno(), 0o644)
+        except BaseException:
+            f.close()
+            os.unlink(f.name)
+            raise
+    os.replace(f.name, filename)
+
+
+class WriteBehind:
+    """Schrijft datasets op de achtergrond weg terwijl de volgende fetch loopt.
+
+    Gebruik als contextmanager. Bij het verlaten van de context wordt gewacht
+    tot alles geschreven is (flush), zodat de push fase de nieuwe bestanden
+    ziet. Een fout in de schrijfthread komt bij flush() alsnog naar boven.
+
+    NB. Het object dat aan save() gegeven wordt mag daarna niet meer aangepast
+    worden. Serialisatie gebeurt pas later, op de achtergrond.
+    """
+    def __init__(self) -> None:
+        self._queue: Queue[tuple[str, JSON] | None] = Queue()
+        self._errors: list[BaseException] = []
+        self._thread = Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+
+    def __enter__(self) -> 'WriteBehind':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _run(self) -> None:
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                try:
+                    save(*job)
+                except BaseException as err:
+                    self._errors.append(err)
+            finally:
+                self._queue.task_done()
+
+    def save(self, filename: str, obj: JSON) -> None:
+        """Zet obj in de wachtrij om naar filename geschreven te worden.
+        """
+        self._queue.put((filename, obj))
+
+    def flush(self) -> None:
+        """Wacht tot alle bestanden in de wachtrij geschreven zijn.
+        """
+        self._queue.join()
+        if self._errors:
+            err, *_ = self._errors
+            self._errors.clear()
+            raise err
+
+    def close(self) -> None:
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self.flush()
 
 
 def merge(local: JSON, update: JSON, *, key: Callable[[JSON], Hashable]) -> JSON:
@@ -4,7 +4,7 @@ from logging import getLogger
 from typing import Any
 
 from bronnen import Amsterdam
-from local.backup import load, merge, save
+from local.backup import WriteBehind, load, merge, save
 
 logger = getLogger(__name__)
 
@@ -51,9 +51,11 @@ def source_update(local: JSON, fetch: Callable[..., Iterable[JSON]],
 
 
 def pull(amsterdam: Amsterdam, filenames: dict[str, str],
-         rate_limit: timedelta = timedelta()) -> None:
+         rate_limit: timedelta = timedelta(),
+         writer: WriteBehind = None) -> None:
     start_time = datetime.now(tz=timezone.utc)
     ref_time = start_time - rate_limit
+    store = writer.save if writer else save
     
     updates = {
         'buurten': amsterdam.buurten,
@@ -68,7 +70,7 @@ def pull(amsterdam: Amsterdam, filenames: dict[str, str],
         if not items['last_sync'] or datetime.fromisoformat(items['last_sync']) < ref_time:
             update = source_update(items, fetch, start_time)
             items = merge(items, update, key=gebied_id)
-            save(filename, items)
+            store(filename, items)
         else:
             logger.debug(f' - skip. Recent nog bijgewerkt.')
 
@@ -4,7 +4,7 @@ from logging import getLogger
 from operator import itemgetter
 from typing import Any
 
-from local.backup import load, merge, save
+from local.backup import WriteBehind, load, merge, save
 from bronnen import Bammens
 
 logger = getLogger(__name__)
@@ -72,7 +72,8 @@ def tracked_update(local: JSON, fetch: Callable[..., Iterable[JSON]],
 
 
 def pull(bammens: Bammens, filenames: dict[str, str],
-         rate_limit: timedelta = timedelta()) -> None:
+         rate_limit: timedelta = timedelta(),
+         writer: WriteBehind = None) -> None:
     """Werkt alle lokale bestanden bij met gegevens van Bammens.
 
     bammens is een bron interface voor Bammens (bammensservice.nl).
@@ -81,6 +82,7 @@ def pull(bammens: Bammens, filenames: dict[str, str],
     """
     start_time = datetime.now(tz=timezone.utc)
     ref_time = start_time - rate_limit
+    store = writer.save if writer else save
 
     updates = {
         'fracties': (untracked_update, bammens.fracties),
@@ -97,7 +99,7 @@ def pull(bammens: Bammens, filenames: dict[str, str],
         if not items['last_sync'] or datetime.fromisoformat(items['last_sync']) < ref_time:
             update = update_func(items, fetch, start_time)
             items = merge(items, update, key=itemgetter('id'))
-            save(filename, items)
+            store(filename, items)
         else:
             logger.debug(f' - skip. Recent nog bijgewerkt.')
 
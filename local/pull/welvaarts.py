@@ -7,7 +7,7 @@ from operator import itemgetter
 from typing import Any, TypeVar
 
 from bronnen import Welvaarts
-from local.backup import load, merge, save
+from local.backup import WriteBehind, load, merge, save
 
 logger = logging.getLogger(__name__)
 
@@ -112,7 +112,8 @@ def wegingen_update(welvaarts: Welvaarts, local: JSON, wagens: JSON,
 
 
 def pull(welvaarts: Welvaarts, filenames: dict[str, str],
-         rate_limit: timedelta = timedelta()) -> None:
+         rate_limit: timedelta = timedelta(),
+         writer: WriteBehind = None) -> None:
     """Werkt alle lokale bestanden bij met gegevens van Welvaarts.
 
     welvaarts is een bron interface voor Welvaarts (kilogram.nl).
@@ -120,6 +121,7 @@ def pull(welvaarts: Welvaarts, filenames: dict[str, str],
     """
     start_time = datetime.now(tz=timezone.utc)
     ref_time = start_time - rate_limit
+    store = writer.save if writer else save
     
     logger.debug('wagens...')
     filename = filenames['wagens']          # './data/welvaarts-wagens.json'
@@ -127,7 +129,7 @@ def pull(welvaarts: Welvaarts, filenames: dict[str, str],
     if not wagens['last_sync'] or datetime.fromisoformat(wagens['last_sync']) < ref_time:
         update = wagens_update(welvaarts, wagens)
         wagens = merge(wagens, update, key=itemgetter('SystemId'))
-        save(filename, wagens)
+        store(filename, wagens)
     else:
         logger.debug(' - skip. Recent nog bijgewerkt.')
         return
@@ -138,7 +140,7 @@ def pull(welvaarts: Welvaarts, filenames: dict[str, str],
         wegingen = load(filename)
         update = wegingen_update(welvaarts, wegingen, update)
         wegingen = merge(wegingen, update, key=itemgetter('SystemId', 'Seq'))
-        save(filename, wegingen)
+        store(filename, wegingen)
     else:
         logger.debug(' - skip. Geen wagens met nieuwe data.')
 
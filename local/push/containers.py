@@ -19,11 +19,15 @@
 }
 """
 import logging
+from collections.abc import Sequence
 from operator import itemgetter
 from typing import Any
 
 from local.backup import load, save
-from .jsontools import CompressedJSON, DataJSON, IndexOrder
+from local.storage import load_pickle, save_pickle
+from .jsontools import SHARED_STRINGS, CompressedJSON, DataJSON, IndexOrder
+from .jsontuning import tuned
+from .tiles import push_tiles, tiles_index
 
 logger = logging.getLogger(__name__)
 
@@ -46,8 +50,8 @@ class ContainersJSON(CompressedJSON):
             'lon': ['m', 1_000_000, 'd'],
         },
         'raw': {
-            'adres': ['j', '@'],
-            'cluster': ['j', '@'],
+            'adres': ['w', SHARED_STRINGS, 'd'],
+            'cluster': ['w', SHARED_STRINGS, 'd'],
         },
     }
     index_order = {
@@ -60,64 +64,55 @@ class ContainersJSON(CompressedJSON):
     }
 
 
-def push(file_out: str, filenames: dict[str, str]) -> None:
-    logger.debug('containers...')
-
-    clusters = load(filenames['clusters'])
-    container_types = load(filenames['container_types'])
-    containers = load(filenames['containers'])
-    fracties = load(filenames['fracties'])
-    putten = load(filenames['putten'])
-
-    # NB. fracties hebben geen datum.
-    last_change = max(map(itemgetter('last_change'),
-        (clusters, container_types, containers, putten)))
-
-    if load(file_out)['last_change'] == last_change:
-        logger.debug(' - skip. Geen veranderingen sinds laatste keer.')
-        return
+def container_rows(containers: Sequence[JSON], clusters: Sequence[JSON],
+                   container_types: Sequence[JSON], fracties: Sequence[JSON],
+                   putten: Sequence[JSON]) -> dict[int, JSON]:
+    """Geeft de output rij voor elke actieve container, op container id.
 
+    De andere lijsten hoeven alleen de items te bevatten waar de containers
+    naar verwijzen. Zo kan ook een deel van de containers berekend worden.
+    """
     # Voor de gebruiker is het logischer om op de kaart het adres van het cluster
     # te lezen dan het adres van de put. Op die manier komen de adressen van de
     # wegingen overeen met de adressen van de containers op het cluster.
     clusteradres = {
         w: o['location']['address']
-        for o in clusters['data']
+        for o in clusters
         for w in o['wells']
     }
     cluster = {
         w: o['name']
-        for o in clusters['data']
+        for o in clusters
         for w in o['wells']
     }
     cluster_id = {
         w: o['id']
-        for o in clusters['data']
+        for o in clusters
         for w in o['wells']
     }
     fractie = {
         f'/fractions/{o["id"]}': o['name']
-        for o in fracties['data']
+        for o in fracties
     }
     locatie = {
         f'/wells/{o["id"]}': o['location']['geometry']['coordinates']
-        for o in putten['data']
+        for o in putten
     }
     persend = {
         f'/container_types/{o["id"]}': o['compressionContainer'] or 'pers' in o['name'].lower()
-        for o in container_types['data']
+        for o in container_types
     }
     typetype = {
         f'/container_types/{o["id"]}': o['containerType']
-        for o in container_types['data']
+        for o in container_types
     }
     volume = {
         f'/container_types/{o["id"]}': o['volume']
-        for o in container_types['data']
+        for o in container_types
     }
 
-    rows = [
-        {
+    return {
+        c['id']: {
             'code': c['idNumber'],
             'fractie': fractie.get(c['fraction'], ''),
             'type': typetype.get(c['containerType'], ''),
@@ -129,9 +124,108 @@ def push(file_out: str, filenames: dict[str, str]) -> None:
             'lon': locatie.get(c['well'], (None, None))[0],
             'lat': locatie.get(c['well'], (None, None))[1],
         }
-        for c in containers['data']
+        for c in containers
         if c['active'] == 1
+    }
+
+
+def changed_since(items: JSON, since: str | None) -> list[JSON]:
+    """Geeft de items die op of na since (modifiedAt) veranderd zijn.
+    Items zonder modifiedAt tellen altijd als veranderd.
+
+    Op since zelf telt ook: tracked_update() haalt vanaf last_change op, dus
+    een latere sync kan nog items met modifiedAt == since toevoegen.
+    """
+    if since is None:
+        return items['data']
+    return [o for o in items['data'] if not o['modifiedAt'] or o['modifiedAt'] >= since]
+
+
+def push(file_out: str, filenames: dict[str, str], cache_file: str = None,
+         tune: bool = False, tiles: bool = False) -> JSON | None:
+    """Schrijft de actieve containers naar file_out.
+
+    Geeft de containers terug zoals ContainersJSON.load(file_out) ze zou geven,
+    zodat push_wegingen ze niet opnieuw hoeft te decoderen. Als er niets
+    veranderd is wordt niets geschreven en is het resultaat None.
+
+    cache_file bewaart de rijen van de vorige keer, met de last_change van elke
+    bron. Dan worden alleen de rijen van containers herberekend waarvan de
+    container, put, het cluster of het containertype sindsdien veranderd is.
+
+    Met tune worden de codecs eerst op deze data getuned (zie jsontuning). Met
+    tiles komen de containers ook in tegels (zie local/push/tiles.py), ook als
+    alleen de tegels niet bij zijn.
+    """
+    logger.debug('containers...')
+
+    clusters = load(filenames['clusters'])
+    container_types = load(filenames['container_types'])
+    containers = load(filenames['containers'])
+    fracties = load(filenames['fracties'])
+    putten = load(filenames['putten'])
+
+    # NB. fracties hebben geen datum.
+    last_change = max(map(itemgetter('last_change'),
+        (clusters, container_types, containers, putten)))
+
+    previous_change = load(file_out)['last_change']
+    if previous_change == last_change:
+        logger.debug(' - skip. Geen veranderingen sinds laatste keer.')
+        if tiles and load(tiles_index(file_out))['last_change'] != last_change:
+            push_tiles(ContainersJSON, file_out, ContainersJSON.load(file_out),
+                       total='volume', cluster='cluster_id')
+        return None
+
+    sources = {
+        'clusters': clusters,
+        'container_types': container_types,
+        'containers': containers,
+        'putten': putten,
+    }
+    fractie_namen = {o['id']: o['name'] for o in fracties['data']}
+
+    state = load_pickle(cache_file, lambda: None) if cache_file else None
+    if (state is None
+            or state['last_change'] != previous_change
+            or state['fracties'] != fractie_namen):
+        state = {
+            'sources': dict.fromkeys(sources),
+            'cluster_wells': {},
+            'rows': {},
+        }
+
+    since = state['sources']
+    changed = {name: changed_since(items, since[name]) for name, items in sources.items()}
+
+    # Alle putten waarvan het cluster veranderd is, vóór en na de verandering.
+    wells = {f'/wells/{o["id"]}' for o in changed['putten']}
+    for o in changed['clusters']:
+        wells.update(o['wells'])
+        wells.update(state['cluster_wells'].get(o['id'], ()))
+    types = {f'/container_types/{o["id"]}' for o in changed['container_types']}
+    ids = {o['id'] for o in changed['containers']}
+
+    todo = [
+        c
+        for c in containers['data']
+        if c['id'] in ids or c['well'] in wells or c['containerType'] in types
     ]
+    needed_wells = {c['well'] for c in todo}
+    needed_types = {c['containerType'] for c in todo}
+    logger.debug(f' - {len(todo)} containers bijwerken.')
+
+    rows = state['rows']
+    for c in todo:
+        rows.pop(c['id'], None)
+    rows.update(container_rows(
+        todo,
+        [o for o in clusters['data'] if not needed_wells.isdisjoint(o['wells'])],
+        [o for o in container_types['data']
+         if f'/container_types/{o["id"]}' in needed_types],
+        fracties['data'],
+        [o for o in putten['data'] if f'/wells/{o["id"]}' in needed_wells],
+    ))
 
     # Compress the data.
     #  - transpose: 2.583 mB -> 1.400 mB (-45%)
@@ -142,8 +236,21 @@ def push(file_out: str, filenames: dict[str, str]) -> None:
     #  - separate lat, lon with factor and delta: 703 kB -> 613 kB (-13%)
     # ---> reduced to 24% of original size = factor 4.2 compression.
 
-    ContainersJSON.save(file_out, {
+    output = {
         'last_change': last_change,
-        'data': rows
-    })
+        'data': [rows[k] for k in sorted(rows)],
+    }
+    json_class = tuned(ContainersJSON, output) if tune else ContainersJSON
+    json_class.save(file_out, output)
+    if tiles:
+        push_tiles(ContainersJSON, file_out, output, total='volume', cluster='cluster_id')
+
+    if cache_file:
+        state['cluster_wells'].update((o['id'], o['wells']) for o in changed['clusters'])
+        state['sources'] = {name: items['last_change'] for name, items in sources.items()}
+        state['last_change'] = last_change
+        state['fracties'] = fractie_namen
+        save_pickle(cache_file, state)
+
     logger.debug(' - done.')
+    return ContainersJSON.normalise(output)
@@ -31,16 +31,24 @@
 }
 """
 import logging
+import os
 from operator import itemgetter
 from typing import Any
 
 from local.backup import load
-from .jsontools import CompressedJSON, IndexOrder
+from .geotools import simplify_rings
+from .jsontools import SHARED_STRINGS, CompressedJSON, IndexOrder, save_files
 
 logger = logging.getLogger(__name__)
 
 JSON = dict[str, Any]
 
+# Toleranties in meters van de vereenvoudigde versies (levels of detail) voor
+# de kaart. Het volledige bestand blijft de bron voor de buurt labels.
+LOD_TOLERANTIES = (1, 5, 25)
+
+GEBIEDEN = ('buurten', 'wijken', 'stadsdelen')
+
 
 class GebiedenJSON(CompressedJSON):
     sort_order = ('gebied', 'ligt_in')
@@ -55,7 +63,7 @@ class GebiedenJSON(CompressedJSON):
             'lon': ['m>', 1_000_000, 's', 'd>'],
         },
         'raw': {
-            'naam': ['j', '@'],
+            'naam': ['w', SHARED_STRINGS, 'd'],
         },
     }
     index_order = {
@@ -64,7 +72,35 @@ class GebiedenJSON(CompressedJSON):
     }
 
 
-def push(file_out: str, filenames: dict[str, str]) -> None:
+def lod_filename(file_out: str, tolerance: int) -> str:
+    """gebieden.min.json -> gebieden.5m.min.json"""
+    head, tail = os.path.split(file_out)
+    name, _, ext = tail.partition('.')
+    return os.path.join(head, f'{name}.{tolerance}m.{ext}')
+
+
+def simplify(gebieden: JSON, tolerance: float) -> JSON:
+    """Geeft de gebieden met vereenvoudigde grenzen. Alle niveaus worden
+    samen vereenvoudigd, zodat gedeelde grenzen gelijk blijven.
+    """
+    gebieden = {k: [dict(g) for g in v] if k in GEBIEDEN else v
+                for k, v in gebieden.items()}
+    todo = [g for k in GEBIEDEN for g in gebieden[k] if len(g['lon']) > 2]
+    rings = simplify_rings([(g['lon'], g['lat']) for g in todo], tolerance)
+    for g, (lon, lat) in zip(todo, rings):
+        g['lon'], g['lat'] = lon, lat
+    return gebieden
+
+
+def push(file_out: str, filenames: dict[str, str], processes: int = None) -> JSON | None:
+    """Schrijft de stadsdelen, wijken en buurten naar file_out, en vereenvoudigd
+    per tolerantie in LOD_TOLERANTIES naar lod_filename(file_out, tolerantie).
+    De bestanden worden met processes processen tegelijk geschreven (zie
+    save_files).
+
+    Geeft de gebieden terug zoals GebiedenJSON.load(file_out) ze zou geven, of
+    None als er niets veranderd is.
+    """
     logger.debug('gebieden...')
 
     buurten = load(filenames['buurten'])
@@ -77,7 +113,7 @@ def push(file_out: str, filenames: dict[str, str]) -> None:
 
     if load(file_out)['last_change'] == last_change:
         logger.debug(' - skip. Geen veranderingen sinds laatste keer.')
-        return
+        return None
 
     stadsdelen = {
         g['properties']['identificatie']: {
@@ -124,5 +160,12 @@ def push(file_out: str, filenames: dict[str, str]) -> None:
         'stadsdelen': list(stadsdelen.values()),
     }
 
-    GebiedenJSON.save(file_out, gebieden)
+    files = [(GebiedenJSON, file_out, gebieden)]
+    punten = lambda g: sum(len(gebied['lon']) for k in GEBIEDEN for gebied in g[k])
+    for tolerance in LOD_TOLERANTIES:
+        lod = simplify(gebieden, tolerance)
+        files.append((GebiedenJSON, lod_filename(file_out, tolerance), lod))
+        logger.debug(f' - {tolerance}m: {punten(lod)} van {punten(gebieden)} punten.')
+    save_files(files, processes=processes)
     logger.debug(' - done.')
+    return GebiedenJSON.normalise(gebieden)
@@ -0,0 +1,458 @@
+import logging
+from collections.abc import Hashable, Sequence
+from operator import itemgetter
+from typing import Any
+
+import numpy as np
+from sklearn.neighbors import BallTree
+
+from local.storage import load_pickle, save_pickle
+from .tools import group_by
+
+logger = logging.getLogger(__name__)
+
+JSON = dict[str, Any]
+
+# The Earth radius at sea level in Amsterdam, in metres.
+# See: https://rechneronline.de/earth-radius/
+EARTH_RADIUS = 6_364_763
+
+
+def lat_lon_rad(items: Sequence[JSON]) -> np.ndarray:
+    """Geeft een (n, 2) array met [lat, lon] in radialen. None wordt NaN.
+    """
+    lat_lon = map(itemgetter('lat', 'lon'), items)
+    return np.deg2rad(np.array(list(lat_lon), dtype=float, ndmin=2))
+
+
+class ContainerIndex:
+    """Per fractie een BallTree (haversine) over de containers met coordinaten.
+
+    De index verwijst naar containers met hun positie in de lijst waarmee hij
+    gebouwd is. Hij is dus alleen geldig voor precies die lijst. Daarom heeft
+    de index een key (bijv. de last_change van de containers) waarmee een
+    opgeslagen index herkend kan worden.
+    """
+    def __init__(self, containers: Sequence[JSON], key: Hashable = None) -> None:
+        fractie = itemgetter('fractie')
+        has_lat = itemgetter('lat')
+
+        self.key = key
+        self.size = len(containers)
+
+        rows = [i for i, c in enumerate(containers) if has_lat(c)]
+        self.rows = {
+            f: np.array(ix, dtype=np.intp)
+            for f, ix in group_by(lambda i: fractie(containers[i]), rows).items()
+        }
+        self.trees = {
+            f: BallTree(lat_lon_rad([containers[i] for i in ix]), metric='haversine')
+            for f, ix in self.rows.items()
+        }
+
+    @classmethod
+    def cached(cls, filename: str | None, key: Hashable,
+               containers: Sequence[JSON]) -> 'ContainerIndex':
+        """Laadt de index uit filename als die bij key en containers hoort.
+        Anders wordt de index opnieuw gebouwd en opgeslagen.
+        """
+        if filename:
+            index = load_pickle(filename, lambda: None)
+            if (isinstance(index, cls) and index.key == key
+                    and index.size == len(containers)):
+                logger.debug(' - container index uit cache.')
+                return index
+
+        index = cls(containers, key)
+        if filename:
+            save_pickle(filename, index)
+        return index
+
+    def query(self, fracties: np.ndarray, points: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Zoekt per punt de dichtstbijzijnde container van dezelfde fractie.
+
+        fracties is een array met de fractie van elk punt.
+        points is een (n, 2) array met [lat, lon] in radialen.
+
+        Geeft de afstand in meters (NaN als er geen container gevonden kan
+        worden) en de positie van de container (-1 als er geen is).
+        """
+        n = len(points)
+        afstand = np.full(n, np.nan)
+        positie = np.full(n, -1, dtype=np.intp)
+
+        if n == 0:
+            return afstand, positie
+
+        has_point = ~np.isnan(points).any(axis=1)
+
+        for f, tree in self.trees.items():
+            rows = np.flatnonzero((fracties == f) & has_point)
+            if len(rows) == 0:
+                continue
+
+            d, ix = tree.query(points[rows], k=1, sort_results=False)
+            afstand[rows] = d[:, 0] * EARTH_RADIUS
+            positie[rows] = self.rows[f][ix[:, 0]]
+
+        return afstand, positie
+
+
+# Meters per graad breedte, en per graad lengte op de evenaar.
+METER_PER_GRAAD = np.pi * EARTH_RADIUS / 180
+
+
+def project(lon: np.ndarray, lat: np.ndarray, lat0: float) -> tuple[np.ndarray, np.ndarray]:
+    """Lokale projectie naar meters (equirectangular rond breedte lat0).
+    """
+    x = np.asarray(lon, dtype=float) * (METER_PER_GRAAD * np.cos(np.deg2rad(lat0)))
+    y = np.asarray(lat, dtype=float) * METER_PER_GRAAD
+    return x, y
+
+
+def segment_distance(px: np.ndarray, py: np.ndarray, segments: np.ndarray) -> np.ndarray:
+    """Geeft voor elk punt de kortste afstand tot een van de lijnstukken.
+
+    segments is een (m, 4) array met per lijnstuk [x1, y1, x2, y2].
+    """
+    x1, y1, x2, y2 = segments.T
+    dx, dy = x2 - x1, y2 - y1
+    length2 = dx * dx + dy * dy
+    scale = np.divide(1, length2, out=np.zeros_like(length2), where=length2 > 0)
+    ex = px[:, None] - x1
+    ey = py[:, None] - y1
+    t = (ex * dx + ey * dy) * scale
+    np.clip(t, 0, 1, out=t)
+    ex -= t * dx
+    ey -= t * dy
+    ex *= ex
+    ey *= ey
+    ex += ey
+    return np.sqrt(ex.min(axis=1))
+
+
+def douglas_peucker(x: np.ndarray, y: np.ndarray, tolerance: float) -> np.ndarray:
+    """Geeft een mask met de punten die overblijven na Douglas-Peucker.
+    Het eerste en laatste punt blijven altijd staan.
+    """
+    n = len(x)
+    tolerance2 = tolerance * tolerance
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, n - 1)]
+
+    while stack:
+        a, b = stack.pop()
+        if b - a < 2:
+            continue
+        dx, dy = x[b] - x[a], y[b] - y[a]
+        px, py = x[a + 1:b] - x[a], y[a + 1:b] - y[a]
+        length2 = dx * dx + dy * dy
+        if length2 > 0:
+            t = np.minimum(np.maximum((px * dx + py * dy) / length2, 0), 1)
+            px, py = px - t * dx, py - t * dy
+        d2 = px * px + py * py
+        i = int(np.argmax(d2))
+        if d2[i] > tolerance2:
+            keep[a + 1 + i] = True
+            stack.extend(((a, a + 1 + i), (a + 1 + i, b)))
+
+    return keep
+
+
+def simplify_rings(rings: Sequence[tuple[Sequence[float], Sequence[float]]],
+                   tolerance: float) -> list[tuple[list[float], list[float]]]:
+    """Vereenvoudigt de ringen [lon], [lat] met een tolerantie in meters.
+
+    Gedeelde grenzen blijven gelijk. Elke ring wordt opgeknipt in bogen op de
+    hoekpunten waar de verzameling ringen die het punt delen verandert. Elke
+    boog wordt in één vaste richting vereenvoudigd (Douglas-Peucker), en
+    buurringen krijgen precies dezelfde vereenvoudigde boog. Er ontstaan dus
+    geen gaten of overlap tussen buren, ook niet tussen niveaus (stadsdeel,
+    wijk, buurt).
+    """
+    opened = []
+    for lon, lat in rings:
+        points = list(zip(lon, lat))
+        if len(points) > 1 and points[0] == points[-1]:
+            points.pop()
+        opened.append(points)
+
+    owners: dict[tuple[float, float], set[int]] = {}
+    for r, points in enumerate(opened):
+        for p in points:
+            owners.setdefault(p, set()).add(r)
+
+    junctions = set()
+    for points in opened:
+        n = len(points)
+        for i, p in enumerate(points):
+            if owners[p] != owners[points[i - 1]] or owners[p] != owners[points[(i + 1) % n]]:
+                junctions.add(p)
+
+    lat0 = float(np.mean([p[1] for p in owners])) if owners else 0.0
+    arcs: dict[tuple, list[tuple[float, float]]] = {}
+
+    def simplify_arc(arc: list[tuple[float, float]]) -> list[tuple[float, float]]:
+        reverse = arc[::-1]
+        key = tuple(min(arc, reverse))
+        if key not in arcs:
+            x, y = project(*zip(*key), lat0)
+            keep = douglas_peucker(x, y, tolerance)
+            arcs[key] = [p for p, k in zip(key, keep) if k]
+        simplified = arcs[key]
+        return simplified if list(key) == arc else simplified[::-1]
+
+    simplified_rings = []
+    for points in opened:
+        n = len(points)
+        cuts = [i for i, p in enumerate(points) if p in junctions]
+        if not cuts and n:
+            # Geen buren. Knip op het kleinste punt en het punt het verst daarvan.
+            start = points.index(min(points))
+            x, y = project(*zip(*points), lat0)
+            far = int(np.argmax((x - x[start]) ** 2 + (y - y[start]) ** 2))
+            cuts = sorted({start, far})
+
+        simplified = []
+        for a, b in zip(cuts, cuts[1:] + cuts[:1]):
+            arc = points[a:b + 1] if a < b else points[a:] + points[:b + 1]
+            simplified.extend(simplify_arc(arc)[:-1])
+
+        if len(set(simplified)) < 3:
+            simplified = points
+        simplified = simplified + simplified[:1]
+        simplified_rings.append(([p[0] for p in simplified], [p[1] for p in simplified]))
+
+    return simplified_rings
+
+
+def ray_cast(lon: np.ndarray, lat: np.ndarray, ring: np.ndarray) -> np.ndarray:
+    """Geeft voor elk punt (lon[i], lat[i]) aan of het in de ring ligt.
+
+    ring is een (m, 4) array met per zijde [x1, y1, y2, dx/dy]. Zie
+    Polylabel.edges(). Het aantal snijpunten van een horizontale straal naar
+    links met de zijden is oneven als het punt binnen ligt.
+    """
+    x1, y1, y2, slope = ring.T
+    py = lat[:, None]
+    crosses = (y1 > py) != (y2 > py)
+    # Een horizontale zijde (dx/dy oneindig) snijdt nooit, maar geeft 0 * inf.
+    with np.errstate(invalid='ignore'):
+        x = x1 + np.where(crosses, (py - y1) * slope, 0)
+    return np.count_nonzero(crosses & (lon[:, None] < x), axis=1) % 2 == 1
+
+
+class Polylabel:
+    """Ruimtelijke index over de buurten voor point-in-polygon labels.
+
+    Van elke buurt wordt de bounding box bijgehouden en op welke cellen van een
+    uniform grid die valt. Een punt wordt alleen getest tegen de buurten in
+    zijn cel, eerst op bounding box en dan pas met ray casting. Het werk per
+    punt hangt zo af van het aantal buurten in de buurt, niet van het totaal.
+    """
+    # Celgrootte van het grid in graden (~ 350 x 550 meter in Amsterdam).
+    cell_size = 0.005
+
+    # Maximaal aantal punt-zijde combinaties per ray_cast aanroep.
+    chunk_size = 1 << 21
+
+    # Tolerantie in meters van de vereenvoudigde ringen voor de snelle
+    # voortest. Alleen punten dichter dan dat bij de grens worden exact getest.
+    tolerance = 5
+
+    def __init__(self, gebieden: JSON) -> None:
+        self.key = gebieden.get('last_change')
+
+        # Topologie op naam: wijk -> stadsdeel.
+        stadsdeel = {w['naam']: w['ligt_in'] for w in gebieden['wijken']}
+
+        self.buurten = [
+            {**b, 'ligt_in_stadsdeel': stadsdeel.get(b['ligt_in'], '')}
+            for b in gebieden['buurten']
+            if len(b['lon']) > 2
+        ]
+        self.rings = [self.edges(b['lon'], b['lat']) for b in self.buurten]
+        self.lat0 = float(np.mean([b['lat'][0] for b in self.buurten])) if self.buurten else 0.0
+        self.coarse = [
+            self.coarse_ring(ring, lon, lat)
+            for ring, (lon, lat) in zip(self.rings, simplify_rings(
+                [(b['lon'], b['lat']) for b in self.buurten], self.tolerance))
+        ]
+        self.bbox = np.array([
+            (min(b['lon']), min(b['lat']), max(b['lon']), max(b['lat']))
+            for b in self.buurten
+        ], dtype=float, ndmin=2).reshape(-1, 4)
+
+        if len(self.buurten):
+            self.origin = self.bbox[:, :2].min(axis=0)
+            self.shape = (self.cell(self.bbox[:, 2:].max(axis=0)) + 1).astype(int)
+        else:
+            self.origin = np.zeros(2)
+            self.shape = np.zeros(2, dtype=int)
+
+        grid: dict[int, list[int]] = {}
+        for b, (lo, hi) in enumerate(zip(self.cell(self.bbox[:, :2]),
+                                         self.cell(self.bbox[:, 2:]))):
+            for i in range(lo[0], hi[0] + 1):
+                for j in range(lo[1], hi[1] + 1):
+                    grid.setdefault(i * self.shape[1] + j, []).append(b)
+        self.grid = {k: np.array(v, dtype=np.intp) for k, v in grid.items()}
+
+    @classmethod
+    def cached(cls, filename: str | None, gebieden: JSON) -> 'Polylabel':
+        """Laadt de index uit filename als die bij de last_change van gebieden
+        hoort. Anders wordt de index opnieuw gebouwd en opgeslagen.
+        """
+        if filename:
+            polylabel = load_pickle(filename, lambda: None)
+            if (isinstance(polylabel, cls) and polylabel.key == gebieden['last_change']
+                    and polylabel.tolerance == cls.tolerance):
+                logger.debug(' - polylabel uit cache.')
+                return polylabel
+
+        polylabel = cls(gebieden)
+        if filename:
+            save_pickle(filename, polylabel)
+        return polylabel
+
+    def cell(self, lon_lat: np.ndarray) -> np.ndarray:
+        return np.floor((lon_lat - self.origin) / self.cell_size).astype(int)
+
+    @staticmethod
+    def edges(lon: Sequence[float], lat: Sequence[float]) -> np.ndarray:
+        x1 = np.asarray(lon, dtype=float)
+        y1 = np.asarray(lat, dtype=float)
+        x2 = np.roll(x1, -1)
+        y2 = np.roll(y1, -1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slope = (x2 - x1) / (y2 - y1)
+        return np.column_stack((x1, y1, y2, slope))
+
+    def label(self, lon_lat: np.ndarray) -> np.ndarray:
+        """Geeft voor elk punt [lon, lat] de positie van de buurt in
+        self.buurten, of -1 als het punt in geen enkele buurt ligt.
+        """
+        n = len(lon_lat)
+        labels = np.full(n, -1, dtype=np.intp)
+        if n == 0 or not len(self.buurten):
+            return labels
+
+        rows = np.flatnonzero(~np.isnan(lon_lat).any(axis=1))
+        cells = self.cell(lon_lat[rows])
+        inside_grid = (cells >= 0).all(axis=1) & (cells < self.shape).all(axis=1)
+        rows, cells = rows[inside_grid], cells[inside_grid]
+        keys = cells[:, 0] * self.shape[1] + cells[:, 1]
+
+        order = np.argsort(keys, kind='stable')
+        rows, keys = rows[order], keys[order]
+        starts = np.flatnonzero(np.diff(keys, prepend=-1))
+
+        for key, todo in zip(keys[starts].tolist(), np.split(rows, starts[1:])):
+            for b in self.grid.get(key, ()):
+                lon, lat = lon_lat[todo, 0], lon_lat[todo, 1]
+                x0, y0, x1, y1 = self.bbox[b]
+                in_box = np.flatnonzero((lon >= x0) & (lon <= x1) & (lat >= y0) & (lat <= y1))
+                if len(in_box) == 0:
+                    continue
+                hits = in_box[self.contains(b, lon[in_box], lat[in_box])]
+                labels[todo[hits]] = b
+                todo = np.delete(todo, hits)
+                if len(todo) == 0:
+                    break
+
+        return labels
+
+    def coarse_ring(self, ring: np.ndarray, lon: Sequence[float],
+                    lat: Sequence[float]) -> tuple[np.ndarray, np.ndarray] | None:
+        """Geeft de zijden van de vereenvoudigde ring, voor ray_cast en in
+        meters voor segment_distance. None als dat niet scheelt.
+        """
+        if 4 * len(lon) > len(ring):
+            return None
+        x, y = project(lon, lat, self.lat0)
+        segments = np.column_stack((x[:-1], y[:-1], x[1:], y[1:]))
+        return self.edges(lon[:-1], lat[:-1]), segments
+
+    def contains(self, b: int, lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+        """Geeft aan welke punten in buurt b liggen.
+
+        Eerst tegen de vereenvoudigde ring. Die wijkt nergens meer dan
+        self.tolerance af van de echte, dus alleen punten dichter bij de grens
+        worden nog tegen de volledige ring getest.
+        """
+        if self.coarse[b] is None:
+            return self.chunked(ray_cast, lon, lat, self.rings[b])
+
+        ring, segments = self.coarse[b]
+        inside = self.chunked(ray_cast, lon, lat, ring)
+        x, y = project(lon, lat, self.lat0)
+        near = np.flatnonzero(self.chunked(segment_distance, x, y, segments)
+                              <= 2 * self.tolerance)
+        if len(near):
+            inside[near] = self.chunked(ray_cast, lon[near], lat[near], self.rings[b])
+        return inside
+
+    def chunked(self, f, x: np.ndarray, y: np.ndarray, edges: np.ndarray) -> np.ndarray:
+        step = max(1, self.chunk_size // len(edges))
+        if len(x) <= step:
+            return f(x, y, edges)
+        return np.concatenate([
+            f(x[i:i + step], y[i:i + step], edges)
+            for i in range(0, len(x), step)
+        ])
+
+    def label_containers(self, containers: Sequence[JSON]) -> list[JSON]:
+        """Geeft voor elke container het kleinste omsluitende gebied (buurt).
+        De buurt heeft velden 'naam', 'ligt_in' (wijk) en 'ligt_in_stadsdeel'.
+        Containers buiten alle buurten krijgen een leeg dict.
+        """
+        lon_lat = np.array(list(map(itemgetter('lon', 'lat'), containers)),
+                           dtype=float, ndmin=2).reshape(-1, 2)
+        return [self.buurten[b] if b >= 0 else {}
+                for b in self.label(lon_lat).tolist()]
+
+
+class Memo(dict):
+    """Een dict dat als pickle bewaard wordt en geldig is zolang de key gelijk is.
+
+    De key is bijv. de last_change van de bestanden waar de waardes naar
+    verwijzen. Bij een andere key begint de memo weer leeg.
+    """
+    def __init__(self, key: Hashable = None) -> None:
+        super().__init__()
+        self.key = key
+
+    @classmethod
+    def cached(cls, filename: str | None, key: Hashable) -> 'Memo':
+        """Laadt de memo uit filename, of begint een lege als de key anders is.
+        """
+        memo = load_pickle(filename, lambda: None) if filename else None
+        if isinstance(memo, cls) and memo.key == key:
+            logger.debug(f' - {cls.__name__} uit cache ({len(memo)} items).')
+            return memo
+        return cls(key)
+
+    def save(self, filename: str | None) -> None:
+        if filename:
+            save_pickle(filename, self)
+
+
+class LocatieMemo(Memo):
+    """Onthoudt per (fractie, lat, lon) het resultaat van de koppeling.
+
+    Lat en lon worden afgerond op 1e-5 graad (~ 1 meter). Wagens wegen steeds
+    op dezelfde plekken, dus de meeste wegingen zijn zo een dict lookup.
+    """
+    resolution = 100_000
+
+    def quantise(self, fracties: Sequence[Hashable], lat_lon: np.ndarray) -> list[tuple | None]:
+        """Geeft de memo key voor elk punt, of None als het geen coordinaten heeft.
+        """
+        valid = ~np.isnan(lat_lon).any(axis=1)
+        q = np.zeros(lat_lon.shape, dtype=np.int64)
+        q[valid] = np.round(lat_lon[valid] * self.resolution)
+        return [
+            (f, lat, lon) if v else None
+            for f, (lat, lon), v in zip(fracties, q.tolist(), valid.tolist())
+        ]
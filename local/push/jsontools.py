@@ -1,14 +1,25 @@
 import logging
+import os
+from base64 import b64decode, b64encode
 from collections import Counter, defaultdict
-from collections.abc import Hashable, Iterable, Sequence
+from collections.abc import Hashable, Iterable, Iterator, Mapping, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from enum import Enum
+from functools import lru_cache, wraps
 from itertools import accumulate, chain, count, pairwise
+from multiprocessing import get_all_start_methods, get_context
 from operator import itemgetter
-from typing import Any, TypeVar
+from time import perf_counter
+from typing import Any, Callable, TypeVar
 
-from orjson import dumps, loads
+import numpy as np
+from orjson import OPT_SERIALIZE_NUMPY, dumps, loads
 
+from local.backup import save, save_bytes
+from local.push.publish import content_hash
 from local.push.tools import group_by
+from local.storage import load_pickle, save_pickle
 
 logger = logging.getLogger(__name__)
 
@@ -46,8 +57,486 @@ class DataJSON:
     
     @classmethod
     def save(cls, filename: str, obj: JSON) -> None:
-        with open(filename, 'wb') as f:
-            f.write(dumps(obj))
+        save_bytes(filename, dumps(obj))
+
+
+# Het woordenboek dat containers, gebieden en wegingen delen.
+SHARED_STRINGS = 'strings.min.json'
+
+
+class StringDictionary:
+    """Strings die meerdere bestanden delen ('w' in een transforms spec).
+
+    {
+        "version": 3,
+        "strings": ["", "Damrak 1", ...]
+    }
+
+    Een string houdt altijd hetzelfde id: nieuwe strings komen achteraan en
+    elke save() met nieuwe strings verhoogt de versie. Een bestand met 'w'
+    bewaart per woordenboek de versie die het nodig heeft ('dictionaries'),
+    dus de browser haalt het woordenboek maar één keer op, en alleen opnieuw
+    als een bestand een hogere versie nodig heeft.
+
+    Het argument van 'w' is de bestandsnaam, relatief aan het bestand dat het
+    gebruikt (zie beside()). Per pad is er één StringDictionary (open()).
+    """
+    directory = '.'
+    opened: dict[str, 'StringDictionary'] = {}
+
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        self.reload()
+
+    @classmethod
+    @contextmanager
+    def beside(cls, filename: str) -> Iterator[None]:
+        """Namen van woordenboeken zijn relatief aan de map van filename."""
+        previous = cls.directory
+        cls.directory = os.path.dirname(filename) or '.'
+        try:
+            yield
+        finally:
+            cls.directory = previous
+
+    @classmethod
+    def open(cls, name: str) -> 'StringDictionary':
+        path = os.path.normpath(os.path.join(cls.directory, name))
+        if path not in cls.opened:
+            cls.opened[path] = cls(path)
+        return cls.opened[path]
+
+    def reload(self) -> None:
+        obj = DataJSON.load(self.filename)
+        self.version = obj.get('version', 0)
+        self.strings = obj.get('strings', [])
+        self.ids = {v: i for i, v in enumerate(self.strings)}
+        self.saved = len(self.strings)
+
+    def require(self, version: int) -> None:
+        if self.version < version:
+            self.reload()
+        if self.version < version:
+            raise ValueError(f'{self.filename}: versie {self.version}, maar {version} nodig.')
+
+    def save(self) -> int:
+        """Schrijft nieuwe strings weg (atomair). Geeft de versie."""
+        if len(self.strings) > self.saved:
+            self.version += 1
+            save(self.filename, {'version': self.version, 'strings': self.strings})
+            self.saved = len(self.strings)
+        return self.version
+
+    def encode(self, values: Sequence[str]) -> list[int]:
+        """ ['b', 'a', 'b'] -> [7, 3, 7] (nieuwe strings krijgen een nieuw id) """
+        ids = self.ids
+        for v in values:
+            if v not in ids:
+                if not isinstance(v, str):
+                    raise TypeError(f'{self.filename}: alleen strings, niet {v!r}.')
+                ids[v] = len(self.strings)
+                self.strings.append(v)
+        return list(map(ids.__getitem__, values))
+
+    def decode(self, values: Sequence[int]) -> list[str]:
+        return lookup(values, self.strings)
+
+
+# Methodes in een transforms spec. De methodes in ARGUMENT_METHODS hebben een
+# argument: het volgende element van de spec. 'b' maakt een string en moet
+# dus de laatste zijn.
+ARGUMENT_METHODS = ('j', 'j>', 'm', 'm>', 'w', 'x', 'x>')
+METHODS = ('b', 'b>', 'd', 'd>', 'i', 'r', 'r>', 's', 's>') + ARGUMENT_METHODS
+
+# Een transform of untransform die langer duurt dan dit (in seconden) logt de
+# traagste kolommen.
+STATS_MIN_SECONDS = 0.05
+
+# Meet de plans ook de grootte van elke kolom in JSON bytes, voor en na? Dat
+# zijn twee extra dumps() per kolom, dus alleen aan om codecs te vergelijken,
+# los van het log level.
+STATS_SIZES = False
+
+# Vanaf dit aantal rijen worden de kolommen in meerdere processen gecodeerd
+# (zie run_plans). Stappen per element ('>') gaan in stukken van PARALLEL_CHUNK.
+PARALLEL_MIN = 1 << 16
+PARALLEL_CHUNK = 1 << 15
+
+Step = Callable[[Any, JSON], Any]
+
+
+class Plan:
+    """De gecompileerde transformatie van één veld, in één richting.
+
+    spec is de geparste spec [(methode, argument), ...] en steps zijn de
+    bijbehorende functies (values, indexes) -> values, in de volgorde waarin
+    ze uitgevoerd worden. stats houdt over alle aanroepen de tijd per methode
+    bij en, met STATS_SIZES, de grootte van de kolom in JSON bytes voor en
+    na. last is (tijd, voor, na) van de laatste aanroep.
+
+    needs zijn de indexen die het plan gebruikt en gives de indexen die het
+    maakt of vervangt (zie waves()). head en tail zijn het aantal stappen per
+    element ('>') aan het begin en het eind (na 'r' of 's' niet): die kunnen
+    in stukken.
+    """
+    def __init__(self, channel: str, field: str, spec: list[tuple[str, Any]],
+                 steps: list[tuple[str, Step]], needs: set[str] = frozenset(),
+                 gives: set[str] = frozenset()) -> None:
+        self.channel = channel
+        self.field = field
+        self.spec = spec
+        self.steps = steps
+        self.refs = {arg for method, arg in spec if method in ('x', 'x>')}
+        self.needs = set(needs)
+        self.gives = set(gives)
+        self.stats = {'calls': 0, 'time': Counter(), 'before': 0, 'after': 0}
+        self.last = (0.0, 0, 0)
+
+        methods = [method for method, _ in steps]
+        per_element = [method.endswith('>') for method in methods]
+        self.head = per_element.index(False) if False in per_element else len(steps)
+        self.tail = per_element[::-1].index(False) if self.head < len(steps) else 0
+        # Na 'r' of 's' is de lengte van de kolom niet meer die van de input.
+        if any(method.rstrip('>') in ('r', 's') for method in methods[:len(steps) - self.tail]):
+            self.tail = 0
+        # Een raw kolom is klein en nodig voor de rest, en 'w' voegt strings
+        # toe aan het woordenboek van dit proces.
+        self.local = channel == 'raw' or 'w' in methods
+
+    def __call__(self, values: Any, indexes: JSON, steps: slice = slice(None)) -> Any:
+        measure = STATS_SIZES
+        before = len(dumps(values, option=OPT_SERIALIZE_NUMPY)) if measure else 0
+
+        start = perf_counter()
+        for method, step in self.steps[steps]:
+            t = perf_counter()
+            values = step(values, indexes)
+            self.stats['time'][method] += perf_counter() - t
+        seconds = perf_counter() - start
+
+        after = len(dumps(values, option=OPT_SERIALIZE_NUMPY)) if measure else 0
+        self.stats['calls'] += 1
+        self.stats['before'] += before
+        self.stats['after'] += after
+        self.last = seconds, before, after
+        return values
+
+
+def parse_spec(field: str, spec: Sequence) -> list[tuple[str, Any]]:
+    """ ['m', 10, 'd'] -> [('m', 10), ('d', None)] """
+    parsed = []
+    tokens = iter(spec)
+    for method in tokens:
+        if method not in METHODS:
+            raise ValueError(f'{field}: onbekende methode {method!r} in {spec}.')
+        arg = None
+        if method in ARGUMENT_METHODS:
+            arg = next(tokens, None)
+            if method in ('j', 'j>') and not isinstance(arg, str):
+                raise ValueError(f'{field}: {method!r} heeft een scheidingsteken nodig.')
+            if method == 'w' and not isinstance(arg, str):
+                raise ValueError(f"{field}: 'w' heeft de naam van een woordenboek nodig.")
+            if method in ('m', 'm>') and (isinstance(arg, bool) or not isinstance(arg, int | float)):
+                raise ValueError(f'{field}: {method!r} heeft een factor nodig.')
+        parsed.append((method, arg))
+    return parsed
+
+
+def encode_step(channel: str, field: str, method: str, arg: Any,
+                index_order: dict[str, IndexOrder]) -> Step:
+    base = method.rstrip('>')
+    if base == 'b':
+        def step(values, indexes): return pack(values)
+    elif base == 'd':
+        def step(values, indexes): return delta(values)
+    elif base == 'i':
+        order = index_order[field]
+
+        def step(values, indexes):
+            values, indexes[field] = index(values, order)
+            return values
+    elif base == 'j':
+        fun = join_index if channel == 'raw' else join
+        def step(values, indexes): return fun(values, arg)
+    elif base == 'm':
+        def step(values, indexes): return multiply(values, arg)
+    elif base == 'r':
+        def step(values, indexes): return unrepeat(values)
+    elif base == 's':
+        def step(values, indexes): return stack(values)
+    elif base == 'w':
+        def step(values, indexes): return StringDictionary.open(arg).encode(values)
+    else:   # 'x'
+        def step(values, indexes): return crossindex(values, indexes[arg])
+    return per_element(step) if method.endswith('>') else step
+
+
+def decode_step(field: str, method: str, arg: Any) -> Step:
+    base = method.rstrip('>')
+    if method == 'j>':
+        # Vaak de traagste stap (bijv. 'containers'). Zie split().
+        def step(values, indexes): return [v.split(arg) if v else [] for v in values]
+        return step
+    elif base == 'b':
+        def step(values, indexes): return unpack(values)
+    elif base == 'd':
+        def step(values, indexes): return cumulative(values)
+    elif base == 'i':
+        def step(values, indexes): return lookup(values, indexes[field])
+    elif base == 'j':
+        def step(values, indexes): return split(values, arg)
+    elif base == 'm':
+        def step(values, indexes): return divide(values, arg)
+    elif base == 'r':
+        def step(values, indexes): return repeat(values)
+    elif base == 's':
+        def step(values, indexes): return tear(values)
+    elif base == 'w':
+        def step(values, indexes): return StringDictionary.open(arg).decode(values)
+    else:   # 'x'
+        def step(values, indexes): return lookup(values, indexes[arg])
+    return per_element(step) if method.endswith('>') else step
+
+
+def per_element(step: Step) -> Step:
+    def each(values, indexes):
+        return [step(v, indexes) for v in values]
+    return each
+
+
+def compile_plans(transforms: JSON, index_order: dict[str, IndexOrder],
+                  ) -> tuple[list[Plan], list[Plan]]:
+    """Parst en controleert een transforms spec. Geeft de encode plans en de
+    decode plans, elk in de volgorde waarin ze uitgevoerd worden.
+
+    Geeft een ValueError bij een onbekende methode, een ontbrekend argument,
+    'b' die niet de laatste methode is, 'i' zonder index_order, 'x' naar een
+    veld zonder (eerdere) index en een 'raw' veld zonder index.
+    """
+    group = transforms.get('group', None)
+    if group is not None and not isinstance(group, str):
+        raise ValueError(f"'group' moet een veldnaam zijn, niet {group!r}.")
+
+    encode = []
+    indexed = set()
+    for channel in ('data', 'raw'):
+        for field, spec in transforms.get(channel, {}).items():
+            parsed = parse_spec(field, spec)
+            if any(method in ('b', 'b>') for method, _ in parsed[:-1]):
+                raise ValueError(f"{field}: 'b' moet de laatste methode zijn.")
+            for method, arg in parsed:
+                if method == 'i' and channel != 'data':
+                    raise ValueError(f"{field}: 'i' kan alleen in 'data'.")
+                if method == 'i' and not isinstance(index_order.get(field), IndexOrder):
+                    raise ValueError(f"{field}: 'i' zonder index_order.")
+                if method in ('x', 'x>') and arg not in indexed:
+                    raise ValueError(f"{field}: {method!r} naar {arg!r}, dat (nog) geen index heeft.")
+            if channel == 'data' and ('i', None) in parsed:
+                indexed.add(field)
+            if channel == 'raw' and field not in indexed:
+                raise ValueError(f"raw {field}: geen 'i' in 'data'.")
+
+            steps = [(method, encode_step(channel, field, method, arg, index_order))
+                     for method, arg in parsed]
+            # Een raw plan vervangt de index van zijn veld door de gecodeerde.
+            if channel == 'raw':
+                needs = gives = {field}
+            else:
+                needs = {arg for method, arg in parsed if method in ('x', 'x>')}
+                gives = {field} if ('i', None) in parsed else set()
+            encode.append(Plan(channel, field, parsed, steps, needs, gives))
+
+    decode = []
+    for plan in reversed(encode):
+        steps = [(method, decode_step(plan.field, method, arg))
+                 for method, arg in reversed(plan.spec)]
+        if plan.channel == 'raw':
+            needs, gives = set(), {plan.field}
+        else:
+            needs, gives = plan.needs | plan.gives, set()
+        decode.append(Plan(plan.channel, plan.field, plan.spec, steps, needs, gives))
+    decode.sort(key=lambda plan: plan.channel != 'raw')
+
+    return encode, decode
+
+
+@lru_cache(maxsize=32)
+def file_decode_plans(spec: bytes) -> list[Plan]:
+    """Decode plans voor een transforms spec (als JSON) uit een bestand. Voor
+    decoderen maakt de index_order niet uit.
+    """
+    transforms = loads(spec)
+    order = dict.fromkeys(transforms.get('data', {}), IndexOrder.UNSORTED)
+    return compile_plans(transforms, order)[1]
+
+
+def waves(plans: Sequence[Plan]) -> list[list[Plan]]:
+    """Verdeelt plans in groepen die na elkaar uitgevoerd worden. Binnen een
+    groep hangen de plans niet van elkaar af: een plan komt na de plans die een
+    index maken die het nodig heeft ('x', 'i' bij decoderen, een raw index), en
+    een plan dat een index vervangt komt na de plans die hem gebruiken.
+    """
+    levels = []
+    for k, plan in enumerate(plans):
+        levels.append(1 + max((
+            levels[j]
+            for j, other in enumerate(plans[:k])
+            if other.gives & (plan.needs | plan.gives) or other.needs & plan.gives
+        ), default=-1))
+    grouped = [[] for _ in range(max(levels, default=-1) + 1)]
+    for level, plan in zip(levels, plans):
+        grouped[level].append(plan)
+    return grouped
+
+
+_plan_context: tuple[Sequence[Plan], JSON] = None
+
+
+def _run_plan(position: int, steps: slice, bounds: tuple[int, int] | None,
+              values: Any, indexes: JSON) -> tuple[Any, JSON, tuple]:
+    """Worker van run_plans(). Zonder values komt de kolom (of het stuk
+    bounds) uit de context van het proces dat de pool maakte.
+    """
+    plans, source = _plan_context
+    plan = plans[position]
+    if values is None:
+        values = source[plan.channel][plan.field]
+        if bounds:
+            values = values[bounds[0]:bounds[1]]
+    values = plan(values, indexes, steps)
+    return values, {k: indexes[k] for k in plan.gives if k in indexes}, plan.last
+
+
+def run_plans(plans: Sequence[Plan], source: JSON, out: JSON, indexes: JSON,
+              processes: int = None) -> None:
+    """out[channel][field] = plan(source[channel][field], indexes) voor elk
+    plan, eventueel verdeeld over meerdere processen.
+
+    De plans gaan per groep van waves() naar een process pool. Een kolom met
+    stappen per element ('>') aan het begin of eind gaat daarvoor in stukken
+    van PARALLEL_CHUNK, zoals 'containers' ('j>'). Plans met plan.local
+    gebeuren in dit proces, net als de rest van een plan in stukken. Indexen
+    uit de workers komen in indexes terecht.
+
+    Dit werkt alleen met fork (dus niet op Windows). Anders, met processes
+    gelijk aan 1, of met minder dan PARALLEL_MIN rijen, gebeurt alles in dit
+    proces. De stats van de plans tellen dan alleen wat hier gebeurde.
+    """
+    global _plan_context
+
+    # Gecodeerd is dit niet precies het aantal rijen, maar wel de orde.
+    rows = max((len(values) for values in source['data'].values()), default=0)
+    if processes is None:
+        processes = os.cpu_count() if rows >= PARALLEL_MIN else 1
+
+    if processes <= 1 or 'fork' not in get_all_start_methods():
+        for plan in plans:
+            out[plan.channel][plan.field] = plan(source[plan.channel][plan.field], indexes)
+        return
+
+    def chunks(n: int) -> list[tuple[int, int]]:
+        bounds = list(range(0, n, PARALLEL_CHUNK)) + [n]
+        return list(pairwise(bounds))
+
+    def gather(futures: Sequence) -> tuple[Any, tuple]:
+        results = [future.result() for future in futures]
+        for _, produced, _ in results:
+            indexes.update(produced)
+        lasts = [last for _, _, last in results]
+        if len(results) == 1:
+            return results[0][0], lasts[0]
+        return list(chain.from_iterable(v for v, _, _ in results)), tuple(map(sum, zip(*lasts)))
+
+    logger.debug(f' - {len(plans)} kolommen ({rows} rijen) met {processes} processen.')
+    position = {id(plan): k for k, plan in enumerate(plans)}
+    for plan in plans:
+        if plan.channel == 'data':
+            out['data'].setdefault(plan.field, None)
+
+    _plan_context = plans, source
+    try:
+        with ProcessPoolExecutor(processes, mp_context=get_context('fork')) as pool:
+            for wave in waves(plans):
+                pending = []
+                for plan in wave:
+                    if plan.local:
+                        continue
+                    k = position[id(plan)]
+                    pre = None
+                    needed = {name: indexes[name] for name in plan.needs}
+                    n = len(source[plan.channel][plan.field])
+                    if plan.head and n >= 2 * PARALLEL_CHUNK:
+                        steps = slice(0, plan.head)
+                        futures = [pool.submit(_run_plan, k, steps, bounds, None, needed)
+                                   for bounds in chunks(n)]
+                    elif not plan.tail or n < 2 * PARALLEL_CHUNK:
+                        futures = [pool.submit(_run_plan, k, slice(None), None, None, needed)]
+                    else:
+                        steps = slice(len(plan.steps) - plan.tail, None)
+                        values = plan(source[plan.channel][plan.field], indexes,
+                                      slice(0, steps.start))
+                        pre = plan.last
+                        futures = [pool.submit(_run_plan, k, steps, None, values[a:b], needed)
+                                   for a, b in chunks(len(values))]
+                    pending.append((plan, futures, pre))
+
+                for plan in wave:
+                    if plan.local:
+                        out[plan.channel][plan.field] = plan(
+                            source[plan.channel][plan.field], indexes)
+
+                for plan, futures, pre in pending:
+                    values, last = gather(futures)
+                    if pre:
+                        last = (pre[0] + last[0], pre[1], last[2])
+                    elif len(futures) > 1:
+                        values = plan(values, indexes, slice(plan.head, None))
+                        last = (last[0] + plan.last[0], last[1], plan.last[2])
+                    plan.last = last
+                    out[plan.channel][plan.field] = values
+    finally:
+        _plan_context = None
+
+
+class LazyColumns(Mapping):
+    """De kolommen van een CompressedJSON bestand, als dict {veld: lijst}.
+    Een kolom wordt pas gedecodeerd als hij voor het eerst opgevraagd wordt.
+
+    decode(fields) geeft de gedecodeerde kolommen voor fields. rows() geeft
+    alles als lijst met rijen, voor wie echt dicts nodig heeft.
+    """
+    def __init__(self, decode: Callable[[Sequence[str]], JSON],
+                 fields: Sequence[str]) -> None:
+        self._decode = decode
+        self._fields = list(fields)
+        self._columns = {}
+
+    def __getitem__(self, field: str) -> list:
+        if field not in self._columns:
+            if field not in self._fields:
+                raise KeyError(field)
+            self._columns.update(self._decode([field]))
+        return self._columns[field]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._fields)
+
+    def __len__(self) -> int:
+        return len(self._fields)
+
+    def __repr__(self) -> str:
+        decoded = ', '.join(f for f in self._fields if f in self._columns)
+        return f'<LazyColumns {self._fields} (gedecodeerd: {decoded or "-"})>'
+
+    def decode_all(self) -> JSON:
+        """Decodeert de overige kolommen in één keer. Geeft alle kolommen."""
+        missing = [f for f in self._fields if f not in self._columns]
+        if missing:
+            self._columns.update(self._decode(missing))
+        return {f: self._columns[f] for f in self._fields}
+
+    def rows(self) -> list[JSON]:
+        return untranspose(self.decode_all())
 
 
 class CompressedJSON(DataJSON):
@@ -75,132 +564,761 @@ class CompressedJSON(DataJSON):
     }
     index_order: dict[str, IndexOrder]
 
+    # Voor append(): het veld waarvan elk blok zijn bereik [min, max] bewaart,
+    # en het aantal rijen waarboven blokken niet meer samengevoegd worden.
+    block_range: str = None
+    block_size: int = 1 << 15
+
+    # De gecompileerde transforms (zie compile_plans). Per subclass, bij het
+    # aanmaken van de class. Een ongeldige spec geeft dus al bij de import
+    # een fout.
+    encode_plans: list[Plan] = []
+    decode_plans: list[Plan] = []
+
+    def __init_subclass__(cls, **kwds) -> None:
+        super().__init_subclass__(**kwds)
+        try:
+            cls.encode_plans, cls.decode_plans = compile_plans(
+                cls.transforms, getattr(cls, 'index_order', {}))
+        except ValueError as err:
+            raise TypeError(f'{cls.__name__}.transforms: {err}') from err
+
     @classmethod
-    def load(cls, filename: str) -> JSON:
+    def log_stats(cls, plans: Sequence[Plan], name: str, top: int = 3) -> None:
+        """Logt de traagste kolommen van de laatste (un)transform, als die
+        samen langer dan STATS_MIN_SECONDS duurden.
+        """
+        total = sum(plan.last[0] for plan in plans)
+        if total < STATS_MIN_SECONDS or not logger.isEnabledFor(logging.DEBUG):
+            return
+        def size(plan: Plan) -> str:
+            return f' ({plan.last[1]} -> {plan.last[2]} bytes)' if STATS_SIZES else ''
+
+        slowest = sorted(plans, key=lambda plan: plan.last[0], reverse=True)[:top]
+        logger.debug(f' - {cls.__name__}.{name} {total:.2f}s: ' + ', '.join(
+            f'{plan.field} {plan.last[0]:.2f}s{size(plan)}' for plan in slowest))
+
+    @classmethod
+    def plans_for(cls, spec: JSON) -> list[Plan]:
+        """De decode plans voor de 'transform' van een bestand. Meestal is dat
+        cls.transforms, maar het kan een oudere spec zijn of een die met
+        jsontuning.tuned() gemaakt is.
+        """
+        if spec == cls.transforms:
+            return cls.decode_plans
+        return file_decode_plans(dumps(spec))
+
+    @classmethod
+    def load(cls, filename: str, processes: int = None) -> JSON:
+        """Laadt filename. Zonder 'group' is 'data' een LazyColumns: elke kolom
+        wordt pas gedecodeerd als hij gebruikt wordt, en data.rows() geeft
+        de rijen. Met 'group' worden meteen alle rijen gedecodeerd.
+        processes is zoals bij transform().
+        """
         try:
             with open(filename, 'rb') as f:
                 transformed = loads(f.read())
         except FileNotFoundError:
             return {
                 'last_change': None,
-                'data': [],
+                'data': [] if cls.transforms.get('group') else LazyColumns(lambda fields: {}, ()),
             }
+
+        spec = transformed.get('transform') or cls.transforms
+        if spec.get('group'):
+            with StringDictionary.beside(filename):
+                return cls.untransform(transformed, processes=processes)
+
+        def decode(fields: Sequence[str]) -> JSON:
+            with StringDictionary.beside(filename):
+                return cls.untransform(transformed, columns=True, fields=fields,
+                                       processes=processes)['data']
+
+        # Een bestand van append() zonder rijen heeft 'blocks': [].
+        blocks = transformed.get('blocks')
+        if blocks is None:
+            present = transformed['data']
         else:
-            return cls.untransform(transformed)
+            present = blocks[0]['data'] if blocks else {}
+        obj = {
+            k: v
+            for k, v in transformed.items()
+            if k not in ('raw', 'data', 'blocks', 'transform', 'dictionaries')
+        }
+        obj['data'] = LazyColumns(decode, [f for f in spec['data'] if f in present])
+        return obj
+
+    @classmethod
+    def load_cached(cls, filename: str, cache_file: str = None) -> JSON:
+        """Zoals load(), maar altijd met rijen, en het resultaat wordt als
+        pickle in cache_file bewaard. Zolang filename niet verandert (grootte
+        en mtime) komt het daar vandaan en hoeft niets gedecodeerd te worden.
+        """
+        def load_rows() -> JSON:
+            obj = cls.load(filename)
+            if isinstance(obj.get('data'), LazyColumns):
+                obj['data'] = obj['data'].rows()
+            return obj
+
+        if not cache_file:
+            return load_rows()
+        try:
+            stat = os.stat(filename)
+        except FileNotFoundError:
+            return load_rows()
+
+        key = filename, stat.st_size, stat.st_mtime_ns
+        cached_key, obj = load_pickle(cache_file, lambda: (None, None))
+        if cached_key != key:
+            obj = load_rows()
+            save_pickle(cache_file, (key, obj))
+        return obj
 
     @classmethod
-    def save(cls, filename: str, obj: JSON, **kwds) -> None:
-        transformed = cls.transform(obj)
+    def normalise(cls, obj: JSON) -> JSON:
+        """Geeft obj zoals load() het na save() terug zou geven.
+
+        Dus in dezelfde volgorde en met dezelfde afronding ('m'), maar zonder
+        alle codecs te doorlopen. Zo kan het resultaat van een push direct aan
+        de volgende stap gegeven worden.
+        """
+        group = cls.transforms.get('group', None)
+        data = combine(obj, field=group)
+        if cls.sort_order:
+            data = sorted(data, key=itemgetter(*cls.sort_order))
+        data = transpose(data)
+
+        for plan in cls.encode_plans:
+            field = plan.field
+            if plan.channel != 'data' or field not in data:
+                continue
+            for method, factor in plan.spec:
+                if method in ('m', 'm>'):
+                    def roundtrip(values: Sequence[float]) -> list[float]:
+                        return divide(multiply(values, factor), factor)
+
+                    if method.endswith('>'):
+                        data[field] = [roundtrip(v) for v in data[field]]
+                    else:
+                        data[field] = roundtrip(data[field])
+
+        normalised = {
+            k: v
+            for k, v in obj.items()
+            if k == 'last_change' or (not group and k != 'data')
+        }
+        normalised.update(separate(untranspose(data), field=group))
+        return normalised
+
+    @classmethod
+    def save(cls, filename: str, obj: JSON, processes: int = None,
+             previous: str = None, **kwds) -> str:
+        """Schrijft obj getransformeerd naar filename. Geeft de hash van de
+        inhoud zonder last_change en de versies van de woordenboeken (zie
+        content_digest()). Is die gelijk aan previous en bestaat filename al,
+        dan wordt er niets geschreven: ids in een woordenboek veranderen niet,
+        dus de oudere versie in het bestand is nog goed.
+        """
+        with StringDictionary.beside(filename):
+            transformed = cls.transform(obj, processes)
+            dictionaries = cls.save_dictionaries()
+        if dictionaries:
+            kwds['dictionaries'] = dictionaries
         kwds.update(transformed)
-        with open(filename, 'wb') as f:
-            f.write(dumps(kwds))
+        digest = content_digest(kwds)
+        if digest != previous or not os.path.exists(filename):
+            save_bytes(filename, dumps(kwds, option=OPT_SERIALIZE_NUMPY))
+        return digest
     
     @classmethod
-    def transform(cls, obj: JSON) -> JSON:
+    def save_dictionaries(cls) -> dict[str, int]:
+        """Schrijft de woordenboeken van 'w' weg, vóór het bestand dat ze
+        gebruikt. Geeft per woordenboek de versie.
+        """
+        names = {arg for plan in cls.encode_plans for method, arg in plan.spec if method == 'w'}
+        return {name: StringDictionary.open(name).save() for name in sorted(names)}
+
+    @classmethod
+    def reserve_strings(cls, obj: JSON) -> None:
+        """Geeft de strings die transform(obj) aan de woordenboeken ('w') zou
+        toevoegen nu al hun id, in dezelfde volgorde. Voor een 'w' op een raw
+        veld wordt alleen het data plan tot en met zijn 'i' uitgevoerd.
+        """
+        plans = [plan for plan in cls.encode_plans if any(m == 'w' for m, _ in plan.spec)]
+        if not plans:
+            return
+        columns = cls.columns(obj)
+        data_plans = {plan.field: plan for plan in cls.encode_plans if plan.channel == 'data'}
+        for plan in plans:
+            indexes = {}
+            values = columns.get(plan.field, [])
+            if plan.channel == 'raw':
+                data_plan = data_plans[plan.field]
+                data_plan(values, indexes, slice(0, data_plan.spec.index(('i', None)) + 1))
+                values = indexes[plan.field]
+            for (method, arg), (_, step) in zip(plan.spec, plan.steps):
+                if method == 'w':
+                    StringDictionary.open(arg).encode(values)
+                    break
+                values = step(values, indexes)
+
+    @classmethod
+    def columns(cls, obj: JSON) -> JSON:
+        """De kolommen (lijsten) van obj, gesorteerd op sort_order. Zoals
+        transform() ze codeert.
+        """
+        group = cls.transforms.get('group', None)
+        if not group and isinstance(obj['data'], LazyColumns):
+            data = obj['data'].decode_all()
+        elif not group and isinstance(obj['data'], dict):
+            data = obj['data']
+        else:
+            data = transpose(combine(obj, field=group))
+
+        if cls.sort_order and data:
+            order = argsort(data, cls.sort_order)
+            return {k: take(v, order) for k, v in data.items()}
+        return {k: tolist(v) for k, v in data.items()}
+
+    @classmethod
+    def transform(cls, obj: JSON, processes: int = None) -> JSON:
         """Transformeert het data object obj naar een compacter formaat.
 
-        obj is het JSON object met velden 'data' en 'last_change'.
+        obj is het JSON object met velden 'data' en 'last_change'. 'data' is
+        een lijst met rijen, of (zonder 'group') een dict met per veld een
+        kolom (lijst of numpy array, of een LazyColumns). Kolommen worden niet
+        eerst naar rijen omgezet.
 
         Het resultaat is een dict met velden 'last_change' (zelfde waarde als
         de input), 'data' (getransformeerde data), 'raw' (indexen) en
         'transform' (de definitie van de toegepaste transformatie).
-        """
-        data = combine(obj, field=cls.transforms.get('group', None))
-        if cls.sort_order:
-            data = sorted(data, key=itemgetter(*cls.sort_order))
-        data = transpose(data)
 
+        processes is het aantal processen voor de kolommen (zie run_plans).
+        """
         transformed = {
             'last_change': obj['last_change'],
-            'data': data,
+            'data': cls.columns(obj),
             'raw': {},
             'transform': cls.transforms,
         }
         indexes = transformed['raw']
 
-        for channel in ('data', 'raw'):
-            for field, transforms in cls.transforms[channel].items():
-                data = transformed[channel][field]
+        run_plans(cls.encode_plans, transformed, transformed, indexes, processes)
 
-                for i, method in enumerate(transforms):
-                    if method in ('d', 'd>'):
-                        fun, args = delta, ()
-                    elif method == 'i':
-                        data, indexes[field] = index(data, cls.index_order[field])
-                        continue
-                    elif method in ('j', 'j>'):
-                        fun, args = join, (transforms[i + 1],)
-                    elif method in ('m', 'm>'):
-                        fun, args = multiply, (transforms[i + 1],)
-                    elif method in ('r', 'r>'):
-                        fun, args = unrepeat, ()
-                    elif method in ('s', 's>'):
-                        fun, args = stack, ()
-                    elif method in ('x', 'x>'):
-                        fun, args = crossindex, (indexes[transforms[i + 1]],)
-                    else:
-                        continue
-
-                    if method.endswith('>'):
-                        data = [fun(v, *args) for v in data]
-                    else:
-                        data = fun(data, *args)
-            
-                transformed[channel][field] = data
+        cls.log_stats(cls.encode_plans, 'transform')
         return transformed
     
     @classmethod
-    def untransform(cls, transformed: JSON) -> JSON:
+    def untransform(cls, transformed: JSON, columns: bool = False,
+                    fields: Sequence[str] = None, processes: int = None) -> JSON:
         """Omgekeerde transformatie. Geeft het originele object.
+
+        Met columns=True (alleen zonder 'group') is 'data' een dict met per
+        veld een lijst en worden er geen rijen gemaakt. Met fields worden
+        alleen die velden gedecodeerd. Bestanden van append() worden per blok
+        gedecodeerd en weer achter elkaar gezet.
+
+        De 'transform' in het bestand bepaalt hoe er gedecodeerd wordt, niet
+        cls.transforms. processes is zoals bij transform().
         """
+        spec = transformed.get('transform') or cls.transforms
+        for name, version in transformed.get('dictionaries', {}).items():
+            StringDictionary.open(name).require(version)
+        if 'blocks' in transformed:
+            data = concatenate([cls.decode_block(b, fields, spec, processes)
+                                for b in transformed['blocks']])
+            kwds = {
+                k: v
+                for k, v in transformed.items()
+                if k not in ('blocks', 'transform', 'dictionaries')
+            }
+            kwds['data'] = data if columns else untranspose(data)
+            return kwds
+
+        decode_plans = cls.plans_for(spec)
+        wanted = {
+            'data': set(fields if fields is not None else spec['data']),
+            'raw': set(fields if fields is not None else spec.get('raw', {})),
+        }
+        for plan in decode_plans:
+            if plan.channel == 'data' and plan.field in wanted['data']:
+                wanted['raw'].update(plan.refs)
+
         obj = {
             'data': {},
             'raw': transformed['raw'].copy(),
         }
         indexes = obj['raw']
+        source = {'data': transformed['data'], 'raw': indexes}
 
-        for channel in ('raw', 'data'):
-            for field, transforms in reversed(cls.transforms[channel].items()):
-                data = transformed[channel][field]
-                transforms = transforms[::-1]
-
-                for i, method in enumerate(transforms):
-                    if method in ('d', 'd>'):
-                        fun, args = cumulative, ()
-                    elif method == 'i':
-                        fun, args = lookup, (indexes[field],)
-                    elif method in ('j', 'j>'):
-                        fun, args = split, (transforms[i - 1],)
-                    elif method in ('m', 'm>'):
-                        fun, args = divide, (transforms[i - 1],)
-                    elif method in ('r', 'r>'):
-                        fun, args = repeat, ()
-                    elif method in ('s', 's>'):
-                        fun, args = tear, ()
-                    elif method in ('x', 'x>'):
-                        fun, args = lookup, (indexes[transforms[i - 1]],)
-                    else:
-                        continue
+        plans = [plan for plan in decode_plans if plan.field in wanted[plan.channel]]
+        run_plans(plans, source, obj, indexes, processes)
 
-                    if method.endswith('>'):
-                        data = [fun(v, *args) for v in data]
-                    else:
-                        data = fun(data, *args)
-            
-                obj[channel][field] = data
+        cls.log_stats(plans, 'untransform')
 
-        data = untranspose(obj['data'])
-        data = separate(data, field=cls.transforms.get('group', None))
+        if columns:
+            data = {'data': obj['data']}
+        else:
+            data = untranspose(obj['data'])
+            data = separate(data, field=spec.get('group', None))
 
         kwds = {
             k: v
             for k, v in transformed.items()
-            if k not in ('raw', 'data', 'transform')
+            if k not in ('raw', 'data', 'transform', 'dictionaries')
         }
         kwds.update(data)
         return kwds
 
 
+    @classmethod
+    def append(cls, filename: str, obj: JSON, after: Any = None) -> None:
+        """Voegt de rijen in obj (kolommen) als nieuw blok toe aan filename,
+        zonder de bestaande blokken te decoderen.
+
+        Elk blok is los getransformeerd, met zijn eigen indexen, delta basis
+        en herhalingen, en bewaart het aantal rijen ('size') en het bereik
+        van het veld block_range ('range'). Met after worden rijen met
+        block_range <= after verwijderd: hele blokken op basis van 'range',
+        alleen een blok dat over after heen valt wordt opnieuw gecodeerd.
+
+        Daarna worden de laatste blokken samengevoegd zolang het voorlaatste
+        blok niet groter is dan het laatste (en samen niet groter dan
+        block_size). Het aantal blokken groeit zo logaritmisch en elke rij
+        wordt maar een paar keer opnieuw gecodeerd. Een bestand in het oude
+        formaat (zonder blokken) wordt als één blok overgenomen, en blokken
+        met een andere 'transform' dan cls.transforms worden opnieuw gecodeerd.
+        """
+        with StringDictionary.beside(filename):
+            try:
+                with open(filename, 'rb') as f:
+                    transformed = loads(f.read())
+            except FileNotFoundError:
+                blocks = []
+            else:
+                for name, version in transformed.get('dictionaries', {}).items():
+                    StringDictionary.open(name).require(version)
+                blocks = transformed.get('blocks')
+                if blocks is None:
+                    blocks = [cls.as_block(transformed)]
+                spec = transformed.get('transform') or cls.transforms
+                if spec != cls.transforms:
+                    blocks = [cls.encode_block(cls.decode_block(b, spec=spec))
+                              for b in blocks if b['size']]
+
+            blocks.append(cls.encode_block(obj['data']))
+            blocks = [b for b in blocks if b['size']]
+            if after is not None:
+                blocks = [b for b in (cls.trim_block(b, after) for b in blocks) if b['size']]
+
+            while (len(blocks) > 1 and blocks[-2]['size'] <= blocks[-1]['size']
+                   and blocks[-2]['size'] + blocks[-1]['size'] <= cls.block_size):
+                merged = concatenate([cls.decode_block(b) for b in blocks[-2:]])
+                blocks[-2:] = [cls.encode_block(merged)]
+
+            dictionaries = cls.save_dictionaries()
+
+        appended = {
+            'last_change': obj['last_change'],
+            'blocks': blocks,
+            'transform': cls.transforms,
+        }
+        if dictionaries:
+            appended['dictionaries'] = dictionaries
+        save_bytes(filename, dumps(appended, option=OPT_SERIALIZE_NUMPY))
+
+    @classmethod
+    def as_block(cls, transformed: JSON) -> JSON:
+        block = {'data': transformed['data'], 'raw': transformed['raw']}
+        spec = transformed.get('transform')
+        values = cls.decode_block(block, (cls.block_range,), spec).get(cls.block_range, [])
+        block.update(cls.block_info(values))
+        return block
+
+    @classmethod
+    def block_info(cls, values: Sequence) -> JSON:
+        values = tolist(values)
+        known = [v for v in values if v is not None]
+        return {
+            'size': len(values),
+            'range': [min(known), max(known)] if known else [None, None],
+        }
+
+    @classmethod
+    def decode_block(cls, block: JSON, fields: Sequence[str] = None,
+                     spec: JSON = None, processes: int = None) -> JSON:
+        if spec:
+            block = dict(block, transform=spec)
+        return cls.untransform(block, columns=True, fields=fields, processes=processes)['data']
+
+    @classmethod
+    def encode_block(cls, columns: JSON) -> JSON:
+        block = cls.block_info(columns.get(cls.block_range, []))
+        if block['size']:
+            transformed = cls.transform({'last_change': None, 'data': columns})
+            block.update(data=transformed['data'], raw=transformed['raw'])
+        return block
+
+    @classmethod
+    def trim_block(cls, block: JSON, after: Any) -> JSON:
+        low, high = block['range']
+        if high <= after:
+            return {'size': 0}
+        elif low > after:
+            return block
+        columns = cls.decode_block(block)
+        return cls.encode_block(
+            select(columns, np.asarray(columns[cls.block_range]) > after))
+
+
+def content_digest(obj: JSON) -> str:
+    """De hash (zie publish.content_hash) van een bestand zoals save() het
+    schrijft, zonder last_change en dictionaries: bestanden met dezelfde data
+    hebben dezelfde hash.
+    """
+    return content_hash(dumps(
+        {k: v for k, v in obj.items() if k not in ('last_change', 'dictionaries')},
+        option=OPT_SERIALIZE_NUMPY))
+
+
+_save_context: tuple[Sequence[tuple[type[CompressedJSON], str, JSON]],
+                     Sequence[str | None]] = None
+
+
+def _save_file(position: int) -> str:
+    files, previous = _save_context
+    cls, filename, obj = files[position]
+    return cls.save(filename, obj, processes=1, previous=previous[position])
+
+
+def save_files(files: Sequence[tuple[type[CompressedJSON], str, JSON]],
+               processes: int = None, previous: Sequence[str | None] = None) -> list[str]:
+    """Schrijft meerdere bestanden (cls, filename, obj), zoals cls.save(), elk
+    in een eigen proces. previous is per bestand de hash van de vorige keer
+    (of None), zie save(). Geeft per bestand de hash.
+
+    Eerst krijgen alle nieuwe strings voor de woordenboeken ('w') in dit proces
+    hun id (reserve_strings()) en worden de woordenboeken weggeschreven. De
+    workers voegen dan niets meer toe, dus hun ids zijn dezelfde.
+
+    Dit werkt alleen met fork (dus niet op Windows). Anders, of met processes
+    gelijk aan 1, gebeurt alles na elkaar in dit proces.
+    """
+    global _save_context
+
+    if processes is None:
+        processes = min(len(files), os.cpu_count())
+    if previous is None:
+        previous = [None] * len(files)
+
+    if processes <= 1 or 'fork' not in get_all_start_methods():
+        return [cls.save(filename, obj, previous=digest)
+                for (cls, filename, obj), digest in zip(files, previous)]
+
+    for cls, filename, obj in files:
+        with StringDictionary.beside(filename):
+            cls.reserve_strings(obj)
+            cls.save_dictionaries()
+
+    logger.debug(f' - {len(files)} bestanden met {processes} processen.')
+    _save_context = files, previous
+    try:
+        with ProcessPoolExecutor(processes, mp_context=get_context('fork')) as pool:
+            return list(pool.map(_save_file, range(len(files))))
+    finally:
+        _save_context = None
+
+
+# Vanaf dit aantal waarden gebruiken de codecs hun NumPy versie.
+NUMPY_MIN = 1 << 10
+
+# pack(): de browser rekent met doubles, dus geen getallen van meer dan 53
+# bits. Een vaste breedte pakt de browser uit met 32 bits integers, met tot 7
+# bits extra in de buffer. Bredere getallen worden varints.
+PACK_MAX_BITS = 53
+PACK_FIXED_MAX_BITS = 24
+
+
+def vectorised(np_fun: Callable, size: Callable[[Any], int] = len,
+               lists: bool = True) -> Callable:
+    """Decorator. Voor inputs vanaf NUMPY_MIN waarden wordt np_fun gebruikt.
+
+    np_fun geeft exact dezelfde output als de Python versie, of None als de
+    input niet in een numpy array past (bijv. gemengde types of hele grote
+    getallen). Dan doet de Python versie het alsnog.
+
+    Met lists=False alleen als de input al een numpy array is. Voor die
+    codecs kost het omzetten van een lijst meer dan NumPy wint (de Python
+    versie is dan één dict lookup of index per waarde).
+    """
+    def decorate(fun: Callable) -> Callable:
+        @wraps(fun)
+        def wrapper(values, *args):
+            if ((lists or isinstance(values, np.ndarray))
+                    and size(values) >= NUMPY_MIN):
+                result = np_fun(values, *args)
+                if result is not None:
+                    return result
+            return fun(values, *args)
+        wrapper.python = fun
+        return wrapper
+    return decorate
+
+
+def masked(values: Sequence, kinds: str = 'biufU') -> tuple[np.ndarray, np.ndarray] | None:
+    """Geeft de waarden zonder None als array, en een mask met de None
+    posities. Of None als de overige waarden geen array van een van de
+    dtype kinds opleveren, of niet allemaal van één Python type zijn: NumPy
+    zou ze omzetten (1 en '1' worden strings, 1 en 1.5 floats, True en 1
+    ints) en dan is de output niet meer die van de Python versie.
+    """
+    if not isinstance(values, np.ndarray) or values.dtype == object:
+        types = set(map(type, values))
+        types.discard(type(None))
+        if len(types) > 1:
+            return None
+    try:
+        array = np.asarray(values)
+        none = np.zeros(len(array), dtype=bool)
+        if array.dtype == object and array.ndim == 1:
+            none = np.equal(array, None)
+            array = np.array(array[~none].tolist())
+    except ValueError:      # Lijsten van verschillende lengte.
+        return None
+    if array.ndim != 1 or array.dtype.kind not in kinds:
+        return None
+    return array, none
+
+
+def objects(values: Sequence[T]) -> np.ndarray:
+    """Object array met precies de objecten in values (ook als dat lijsten zijn)."""
+    return np.fromiter(values, dtype=object, count=len(values))
+
+
+def np_crossindex(values: Sequence[H], reference: Sequence[H]) -> list[int] | None:
+    both = masked(values), masked(reference)
+    if any(m is None or m[1].any() for m in both):
+        return None
+    (array, _), (ref, _) = both
+    if (array.dtype.kind == 'U') != (ref.dtype.kind == 'U'):
+        return None
+
+    # Bij dubbele waarden in reference wint de laatste, zoals in een dict.
+    sorter = np.argsort(ref, kind='stable')
+    found = np.searchsorted(ref, array, side='right', sorter=sorter) - 1
+    found = sorter[np.maximum(found, 0)]
+    missing = np.flatnonzero(ref[found] != array)
+    if len(missing):
+        raise KeyError(values[missing[0]])
+    return found.tolist()
+
+
+def np_cumulative(values: Sequence[int]) -> list[int | None] | None:
+    window, low = values[:2]
+    d = np.asarray(values[2:])
+    if d.dtype.kind not in 'iu' or window * len(d) >= 1 << 62:
+        return None
+
+    valid = d < window
+    a = np.cumsum(np.where(valid, d, 0)) % window + low
+    out = a.astype(object)
+    out[~valid] = None
+    return out.tolist()
+
+
+def np_delta(values: Sequence[int | None]) -> list[int] | None:
+    m = masked(values, 'iu')
+    if m is None or len(m[0]) == 0:
+        return None
+    array, none = m
+    low, high = int(array.min()), int(array.max())
+    window = high + 1 - low
+    if window >= 1 << 58:
+        return None
+
+    array = array.astype(np.int64)
+    a = np.concatenate(([low], array[:-1]))
+    d1 = (array - a) % window
+    d2 = d1 - window
+    out = np.full(len(none), window, dtype=np.int64)
+    out[~none] = np.where(-10 * d2 < d1, d2, d1)
+    return [window, low] + out.tolist()
+
+
+def np_divide(values: Sequence[int | None], factor: int) -> list[float | None] | None:
+    m = masked(values, 'iuf')
+    if m is None:
+        return None
+    array, none = m
+    result = (array.astype(float) * (1.0 / factor)).tolist()
+    if not none.any():
+        return result
+    out = np.full(len(none), None, dtype=object)
+    out[~none] = result
+    return out.tolist()
+
+
+def np_index(values: Sequence[H], order: IndexOrder = IndexOrder.UNSORTED,
+             ) -> tuple[list[int], list[H]] | None:
+    m = masked(values)
+    if m is None:
+        return None
+    array, none = m
+    if (array.dtype.kind == 'f' and np.isnan(array).any()
+            or order == IndexOrder.ASCENDING and none.any()):
+        return None
+
+    _, first, inverse, counts = np.unique(array, return_index=True,
+                                          return_inverse=True, return_counts=True)
+    first = np.flatnonzero(~none)[first]
+    codes = np.full(len(none), len(first), dtype=np.intp)
+    codes[~none] = inverse.ravel()
+    if none.any():
+        first = np.append(first, np.argmax(none))
+        counts = np.append(counts, np.count_nonzero(none))
+
+    if order == IndexOrder.FREQUENCY:
+        ranked = np.lexsort((first, -counts))
+    elif order == IndexOrder.ASCENDING:
+        ranked = np.arange(len(first))
+    else:
+        ranked = np.argsort(first)
+
+    rank = np.empty(len(ranked), dtype=np.intp)
+    rank[ranked] = np.arange(len(ranked))
+    unique = list(map(values.__getitem__, first[ranked].tolist()))
+    return rank[codes].tolist(), unique
+
+
+def np_lookup(values: Sequence[int], reference: Sequence[T]) -> list[T] | None:
+    positions = np.asarray(values)
+    if positions.ndim != 1 or positions.dtype.kind not in 'iu':
+        return None
+    return objects(reference)[positions].tolist()
+
+
+def np_multiply(values: Sequence[float | None], factor: int) -> list[int | None] | None:
+    m = masked(values, 'iuf')
+    if m is None:
+        return None
+    array, none = m
+    if array.dtype.kind in 'iu' and isinstance(factor, int):
+        if np.abs(array).max(initial=0) * abs(factor) >= 1 << 62:
+            return None
+        result = array.astype(np.int64) * factor
+    else:
+        result = array.astype(float) * factor
+        # round() geeft een fout bij NaN en inf. Laat de Python versie die geven.
+        if not np.isfinite(result).all() or np.abs(result).max(initial=0) >= 1 << 62:
+            return None
+        result = np.rint(result).astype(np.int64)
+    out = np.full(len(none), None, dtype=object)
+    out[~none] = result.tolist()
+    return out.tolist()
+
+
+def np_pack(values: Sequence[int]) -> str | None:
+    m = masked(values, 'iu')
+    if m is None or m[1].any():
+        return None
+    array = m[0].astype(np.int64)
+    limit = 1 << (PACK_MAX_BITS - 1)
+    if len(array) and (array.min() < -limit or array.max() >= limit):
+        return None
+
+    z = np.where(array < 0, -2 * array - 1, 2 * array).astype(np.uint64)
+    # z < 2**53 past exact in een float, dus frexp geeft de bit_length.
+    bit_length = np.frexp(z.astype(float))[1]
+    width = int(bit_length.max(initial=0))
+    varint_bytes = np.maximum(1, (bit_length + 6) // 7)
+
+    if width <= PACK_FIXED_MAX_BITS and (len(z) * width + 7) // 8 <= varint_bytes.sum():
+        bits = (z[:, None] >> np.arange(width, dtype=np.uint64)) & np.uint64(1)
+        data = np.packbits(bits.astype(np.uint8).ravel(), bitorder='little')
+        kind = str(width)
+    else:
+        k = np.arange(int(varint_bytes.max()))
+        parts = ((z[:, None] >> (7 * k).astype(np.uint64)) & np.uint64(0x7f)).astype(np.uint8)
+        parts[k < varint_bytes[:, None] - 1] |= 0x80
+        data = parts[k < varint_bytes[:, None]]
+        kind = 'v'
+    return f'{kind}:{len(z)}:{b64encode(data.tobytes()).decode()}'
+
+
+def np_repeat(values: tuple[Sequence[T], Sequence[int]]) -> list[T] | None:
+    tokens, counts = values
+    counts = np.asarray(counts)
+    if counts.dtype.kind not in 'iu' or (counts < 0).any():
+        return None
+    return np.repeat(objects(tokens), counts).tolist()
+
+
+def np_unpack(values: str) -> list[int] | None:
+    if not isinstance(values, str):
+        return None
+    kind, n, data = values.split(':')
+    n = int(n)
+    raw = np.frombuffer(b64decode(data), dtype=np.uint8)
+    if n == 0:
+        return []
+
+    if kind == 'v':
+        end = raw < 0x80
+        starts = np.concatenate(([0], np.flatnonzero(end)[:-1] + 1))
+        k = np.arange(len(raw)) - starts[np.cumsum(end) - end]
+        parts = (raw & 0x7f).astype(np.uint64) << (7 * k).astype(np.uint64)
+        z = np.add.reduceat(parts, starts)
+    else:
+        width = int(kind)
+        bits = np.unpackbits(raw, count=n * width, bitorder='little').reshape(n, width)
+        z = (bits.astype(np.uint64) << np.arange(width, dtype=np.uint64)).sum(axis=1)
+
+    z = z.astype(np.int64)
+    return ((z >> 1) ^ -(z & 1)).tolist()
+
+
+def np_unrepeat(values: Sequence[T]) -> tuple[list[T], list[int]] | None:
+    m = masked(values)
+    if m is not None and not m[1].any():
+        array = m[0]
+    else:
+        array = objects(values)
+    change = np.flatnonzero(array[1:] != array[:-1]) + 1
+    starts = np.concatenate(([0], change))
+    counts = np.diff(np.append(starts, len(array)))
+    return list(map(values.__getitem__, starts.tolist())), counts.tolist()
+
+
+def argsort(columns: JSON, keys: Sequence[str]) -> np.ndarray:
+    """Stabiele sorteervolgorde van de rijen in columns op de velden keys.
+    Zelfde volgorde als sorted(rows, key=itemgetter(*keys)).
+    """
+    def rank(values: Sequence) -> np.ndarray:
+        array = np.asarray(values)
+        if array.dtype != object:
+            return array
+        # Bijv. None, of gemengde types: sorteer zoals Python dat doet.
+        mapping = {v: i for i, v in enumerate(sorted(set(values)))}
+        return np.fromiter(map(mapping.__getitem__, values), dtype=np.intp, count=len(values))
+
+    # np.lexsort sorteert op de laatste key eerst.
+    return np.lexsort([rank(columns[k]) for k in reversed(keys)])
+
+
+def concatenate(parts: Sequence[JSON]) -> JSON:
+    """Plakt kolommen (lijsten en/of numpy arrays) per veld achter elkaar.
+    """
+    def concat(values: Sequence) -> list | np.ndarray:
+        if all(isinstance(v, np.ndarray) for v in values):
+            return np.concatenate(values)
+        return list(chain.from_iterable(map(tolist, values)))
+
+    parts = [p for p in parts if p]
+    if not parts:
+        return {}
+    return {k: concat([p[k] for p in parts]) for k in parts[0]}
+
+
 def combine(obj: JSON, field: str = None) -> list[JSON]:
     if field:
         return [
@@ -213,14 +1331,20 @@ def combine(obj: JSON, field: str = None) -> list[JSON]:
         return obj['data']
 
 
+@vectorised(np_crossindex, lists=False)
 def crossindex(values: Sequence[H], reference: Sequence[H]) -> list[int]:
     """ [a, c, c, d, b], [a, b, c, d] -> [0, 2, 2, 3, 1] """
     index = {r: i for i, r in enumerate(reference)}
     return list(map(index.__getitem__, values))
 
 
+@vectorised(np_cumulative)
 def cumulative(values: Sequence[int]) -> list[int | None]:
-    """ [4, 0, 2, 1, 2, 1, 2, 4, 3, 0] -> [2, 3, 1, 2, 0, None, 3, 3] """
+    """ [4, 0, 2, 1, 2, 1, 2, 4, 3, 0] -> [2, 3, 1, 2, 0, None, 3, 3]
+    [] -> []
+    """
+    if len(values) == 0:
+        return []
     window, low = values[:2]
     a = 0
     return [
@@ -230,18 +1354,18 @@ def cumulative(values: Sequence[int]) -> list[int | None]:
     ]
 
 
+@vectorised(np_delta)
 def delta(values: Sequence[int | None]) -> list[int]:
     """ [2, 3, 1, 2, 0, None, 3, 3] -> [4, 0, 2, 1, 2, 1, 2, 4, 3, 0]
+    [None, None] -> [1, 0, 1, 1]
     [] -> []
     """
-    try:
-        low = min(v for v in values if v is not None)
-        high = max(v for v in values if v is not None)
-        window = high + 1 - low
-    except ValueError as err:
-        if len(values) == 0:
-            return []
-        raise err
+    if len(values) == 0:
+        return []
+    known = [v for v in values if v is not None]
+    low = min(known, default=0)
+    high = max(known, default=0)
+    window = high + 1 - low
 
     out = [window, low]
     a = low
@@ -259,6 +1383,7 @@ def delta(values: Sequence[int | None]) -> list[int]:
     return out
 
 
+@vectorised(np_divide)
 def divide(values: list[int], factor: int) -> list[float]:
     """ [123, 7, 900] -> [12.3, 0.7, 90] """
     def f(v: int) -> float:
@@ -270,6 +1395,7 @@ def divide(values: list[int], factor: int) -> list[float]:
     return list(map(f, values))
 
 
+@vectorised(np_index, lists=False)
 def index(values: Sequence[H], order: IndexOrder = IndexOrder.UNSORTED) -> tuple[list[int], list[H]]:
     """ [a, c, a, d, b] -> [0, 1, 0, 2, 3], [a, c, d, b, None] """
     if order == IndexOrder.FREQUENCY:
@@ -296,11 +1422,23 @@ def join(values: Sequence[str], symbol: str) -> str:
     return v
 
 
+def join_index(values: Sequence[str], symbol: str) -> str:
+    """Zoals join(), maar voor een index. [''] wordt ['', ''], anders komt
+    het na split() terug als []. De extra waarde wordt nooit opgezocht.
+    ([''] komt voor in kleine blokken, bijv. als geen weging een cluster heeft.)
+    """
+    if len(values) == 1 and values[0] == '':
+        values = ['', '']
+    return join(values, symbol)
+
+
+@vectorised(np_lookup, lists=False)
 def lookup(values: Iterable[int], reference: Sequence[T]) -> list[T]:
     """ [0, 1, 0, 2, 3], [a, c, d, b] -> [a, c, a, d, b] """
     return [reference[i] for i in values]
 
 
+@vectorised(np_multiply)
 def multiply(values: Sequence[float], factor: int) -> list[int]:
     """ [12.345, 0.678, 90] -> [123, 7, 900] """
     def f(v: float) -> int:
@@ -311,6 +1449,47 @@ def multiply(values: Sequence[float], factor: int) -> list[int]:
     return list(map(f, values))
 
 
+@vectorised(np_pack)
+def pack(values: Sequence[int]) -> str:
+    """ [0, -1, 1, -2, 2, 3] -> '3:6:iEYD' (breedte:aantal:base64)
+
+    Gehele getallen (zigzag: 0, -1, 1, -2, ... -> 0, 1, 2, 3, ...) met een
+    vaste breedte van zoveel bits als het grootste getal nodig heeft, LSB
+    eerst. Of als varints (7 bits per byte, 'v:aantal:base64') als dat
+    korter is, bijvoorbeeld na 'd' met een grote window en basis vooraan.
+    """
+    zs = [v * 2 if v >= 0 else -2 * v - 1 for v in values]
+    if not all(isinstance(z, int) for z in zs):
+        raise TypeError('pack: alleen gehele getallen.')
+    width = max(zs, default=0).bit_length()
+    if width > PACK_MAX_BITS:
+        raise ValueError(f'pack: {max(zs)} past niet in {PACK_MAX_BITS} bits.')
+    varint_bytes = sum(max(1, (z.bit_length() + 6) // 7) for z in zs)
+
+    out = bytearray()
+    if width <= PACK_FIXED_MAX_BITS and (len(zs) * width + 7) // 8 <= varint_bytes:
+        acc = bits = 0
+        for z in zs:
+            acc |= z << bits
+            bits += width
+            while bits >= 8:
+                out.append(acc & 0xff)
+                acc >>= 8
+                bits -= 8
+        if bits:
+            out.append(acc)
+        kind = str(width)
+    else:
+        for z in zs:
+            while z >= 0x80:
+                out.append(z & 0x7f | 0x80)
+                z >>= 7
+            out.append(z)
+        kind = 'v'
+    return f'{kind}:{len(zs)}:{b64encode(out).decode()}'
+
+
+@vectorised(np_repeat, size=lambda v: len(v[0]))
 def repeat(values: tuple[Sequence[T], Sequence[int]]) -> list[T]:
     """ ([a, b, c, a], [2, 5, 1, 1]) -> [a, a, b, b, b, b, b, c, a]
     """
@@ -318,6 +1497,12 @@ def repeat(values: tuple[Sequence[T], Sequence[int]]) -> list[T]:
     return list(tokens)
 
 
+def select(columns: JSON, mask: np.ndarray) -> JSON:
+    """Geeft de rijen in columns waar mask True is."""
+    positions = np.flatnonzero(mask)
+    return {k: take(v, positions) for k, v in columns.items()}
+
+
 def separate(rows: Iterable[JSON], field: str = None) -> JSON:
     def strip_field(row: JSON) -> None:
         del row[field]
@@ -343,10 +1528,17 @@ def stack(values: Sequence[Iterable[T]]) -> tuple[list[int], list[T]]:
     """ [[a, b, c], [d, e]] -> [[3, 2], [a, b, c, d, e]] """
     return (
         list(map(len, values)),
-        list(chain(*values)),
+        list(chain.from_iterable(values)),
     )
 
 
+def take(values: Sequence[T] | np.ndarray, positions: np.ndarray) -> list[T]:
+    """ [a, b, c, d], [2, 0, 3] -> [c, a, d] """
+    if isinstance(values, np.ndarray):
+        return values[positions].tolist()
+    return [values[i] for i in positions.tolist()]
+
+
 def tear(stacked: Sequence[Sequence[int], Sequence[T]]) -> list[T]:
     """ [[3, 2], [a, b, c, d, e]] -> [[a, b, c], [d, e]] """
     sizes, values = stacked
@@ -359,6 +1551,10 @@ def tokenise(values: Sequence[Sequence], symbol: str) -> list[str]:
     return list(map(symbol.join, (map(str, v) for v in values)))
 
 
+def tolist(values: Sequence[T] | np.ndarray) -> list[T]:
+    return values.tolist() if isinstance(values, np.ndarray) else list(values)
+
+
 def transpose(data: Sequence[JSON]) -> JSON:
     """ [{a: x, b: y}, {a: u, b: v}] -> {a: [x, u], b: [y, v]} """
     try:
@@ -383,6 +1579,36 @@ def unique(values: Sequence[H], order: IndexOrder) -> list[H]:
         return list(set(values))
 
 
+@vectorised(np_unpack)
+def unpack(values: str) -> list[int]:
+    """ '3:6:iEYD' -> [0, -1, 1, -2, 2, 3]
+
+    Een lijst (uit een bestand van voor 'b') komt ongewijzigd terug.
+    """
+    if not isinstance(values, str):
+        return values
+    kind, n, data = values.split(':')
+    raw = b64decode(data)
+
+    if kind == 'v':
+        zs = []
+        z = shift = 0
+        for b in raw:
+            z |= (b & 0x7f) << shift
+            if b & 0x80:
+                shift += 7
+            else:
+                zs.append(z)
+                z = shift = 0
+    else:
+        width = int(kind)
+        mask = (1 << width) - 1
+        packed = int.from_bytes(raw, 'little')
+        zs = [(packed >> (i * width)) & mask for i in range(int(n))]
+    return [(z >> 1) ^ -(z & 1) for z in zs]
+
+
+@vectorised(np_unrepeat, lists=False)
 def unrepeat(values: list[T]) -> tuple[list[T], list[int]]:
     """ [a, a, b, b, b, b, b, c, a] -> ([a, b, c, a], [2, 5, 1, 1]) """
     try:
@@ -0,0 +1,296 @@
+"""
+Zoekt per kolom de codecs voor een CompressedJSON class: de transforms en
+index_order waarmee een representatieve dataset het kleinst wordt, met de tijd
+voor coderen en decoderen meegewogen.
+
+    from local.push.containers import ContainersJSON
+    from local.push.jsontuning import report, tune
+
+    obj = ContainersJSON.load('./html/kg/data/containers.min.json')
+    print(report(tune(ContainersJSON, obj)))
+
+Het begin van een spec dat de waarden zelf verandert ('m' met zijn factor,
+'j>') blijft staan: dat is een keuze over precisie, niet over grootte. Velden
+met 's' of 'x', velden waar een 'x' naar verwijst en velden met een gedeeld
+woordenboek ('w', ook in de raw spec) blijven zoals ze zijn.
+Een kandidaat telt alleen als hij precies dezelfde waarden teruggeeft als de
+huidige spec.
+"""
+import gzip
+import logging
+from collections.abc import Sequence
+from itertools import product
+from time import perf_counter
+from typing import Any
+
+from orjson import OPT_SERIALIZE_NUMPY, dumps
+
+from .jsontools import CompressedJSON, IndexOrder, parse_spec
+
+logger = logging.getLogger(__name__)
+
+JSON = dict[str, Any]
+
+# Methodes die de waarden veranderen. Die blijven vooraan in de spec staan.
+PREFIX_METHODS = ('m', 'm>', 'j>')
+
+# Velden met deze methodes (in de data of raw spec) worden niet getuned. 'w'
+# deelt strings met andere bestanden, dat is geen keuze over grootte.
+FIXED_METHODS = ('s', 's>', 'w', 'x', 'x>')
+
+# Kandidaten voor de rest van de spec. Een 'i' wordt met elke IndexOrder
+# geprobeerd, en met en zonder ['j', '@'] voor de index in 'raw'.
+TAILS = (
+    [], ['b'], ['d'], ['d', 'b'], ['r'], ['r', 'b>'], ['d', 'r'], ['d', 'r', 'b>'],
+    ['i'], ['i', 'b'], ['i', 'd'], ['i', 'd', 'b'], ['i', 'r'], ['i', 'r', 'b>'],
+    ['i', 'd', 'r'], ['i', 'd', 'r', 'b>'], ['j', '@'],
+)
+RAW_SPECS = (None, ['j', '@'])
+
+# Een seconde decoderen weegt even zwaar als zoveel bytes (een verbinding van
+# 80 Mbit/s): in de browser wacht je op allebei. Coderen gebeurt op de server
+# en telt niet mee.
+BYTES_PER_SECOND = 10_000_000
+
+
+def tune(cls: type[CompressedJSON], obj: JSON, size: str = 'json',
+         bytes_per_second: float = BYTES_PER_SECOND, repeat: int = 3) -> JSON:
+    """Meet per veld van cls de huidige spec en alle kandidaten op obj (zoals
+    voor cls.save()).
+
+    size is 'json' (bytes) of 'gzip' (bytes na gzip van alleen deze kolom;
+    gzip van het hele bestand doet het vaak beter). Tijden zijn de snelste van
+    repeat keer. Geeft per veld {'current': ..., 'best': ..., 'candidates':
+    [...]}, met voor elke kandidaat de spec, raw spec, index_order, bytes,
+    tijden en cost (bytes + decode tijd * bytes_per_second).
+    """
+    columns = cls.columns(obj)
+    data_specs = cls.transforms['data']
+    raw_specs = cls.transforms.get('raw', {})
+    index_order = getattr(cls, 'index_order', {})
+
+    fixed = set()
+    for field, spec in data_specs.items():
+        for method, arg in parse_spec(field, spec):
+            if method in FIXED_METHODS:
+                fixed.add(field)
+            if method in ('x', 'x>'):
+                fixed.add(arg)
+    for field, spec in raw_specs.items():
+        if any(method in FIXED_METHODS for method, _ in parse_spec(field, spec)):
+            fixed.add(field)
+
+    def measure(field: str, spec: list, raw_spec: list | None,
+                order: IndexOrder | None) -> JSON | None:
+        # Een 'x' heeft de index van het andere veld nodig.
+        refs = [arg for method, arg in parse_spec(field, spec) if method in ('x', 'x>')]
+        transforms = {
+            'data': {ref: data_specs[ref] for ref in refs},
+            'raw': {ref: raw_specs[ref] for ref in refs if ref in raw_specs},
+        }
+        transforms['data'][field] = spec
+        if raw_spec:
+            transforms['raw'][field] = raw_spec
+        orders = {ref: index_order[ref] for ref in refs}
+        if order:
+            orders[field] = order
+        try:
+            probe = type(f'{cls.__name__}Probe', (CompressedJSON,), {
+                'sort_order': (),
+                'transforms': transforms,
+                'index_order': orders,
+            })
+        except TypeError:       # Ongeldige spec.
+            return None
+
+        column = {
+            'last_change': None,
+            'data': {f: columns[f] for f in transforms['data']},
+        }
+        encode = decode = float('inf')
+        try:
+            for _ in range(repeat):
+                start = perf_counter()
+                transformed = probe.transform(column)
+                encode = min(encode, perf_counter() - start)
+                start = perf_counter()
+                values = probe.untransform(transformed, columns=True)['data'][field]
+                decode = min(decode, perf_counter() - start)
+        except (AssertionError, KeyError, TypeError, ValueError):
+            return None
+
+        encoded = dumps([transformed['data'][field], transformed['raw'].get(field)],
+                        option=OPT_SERIALIZE_NUMPY)
+        n_bytes = len(gzip.compress(encoded, compresslevel=6) if size == 'gzip' else encoded)
+        return {
+            'spec': spec,
+            'raw': raw_spec,
+            'order': order,
+            'bytes': n_bytes,
+            'encode': encode,
+            'decode': decode,
+            'cost': n_bytes + bytes_per_second * decode,
+            'values': values,
+        }
+
+    results = {}
+    for field, spec in data_specs.items():
+        if field not in columns:
+            continue
+        current = measure(field, list(spec), raw_specs.get(field), index_order.get(field))
+        if current is None:
+            raise ValueError(f'{cls.__name__}.{field}: de huidige spec werkt niet op deze data.')
+        candidates = [current]
+
+        if field not in fixed:
+            prefix = []
+            for method, arg in parse_spec(field, spec):
+                if method not in PREFIX_METHODS:
+                    break
+                prefix += [method, arg]
+
+            for tail in TAILS:
+                if 'i' in tail:
+                    options = product(IndexOrder, RAW_SPECS)
+                else:
+                    options = [(None, None)]
+                for order, raw_spec in options:
+                    if prefix + tail == spec and order == current['order'] and raw_spec == current['raw']:
+                        continue
+                    candidate = measure(field, prefix + tail, raw_spec, order)
+                    if candidate is not None and candidate['values'] == current['values']:
+                        candidates.append(candidate)
+
+        for candidate in candidates:
+            del candidate['values']
+        results[field] = {
+            'current': current,
+            'best': min(candidates, key=lambda c: c['cost']),
+            'candidates': sorted(candidates, key=lambda c: c['cost']),
+        }
+        logger.debug(f' - {cls.__name__}.{field}: {len(candidates)} kandidaten.')
+
+    return {'class': cls, 'size': size, 'fields': results}
+
+
+def recommended(tuning: JSON) -> tuple[JSON, dict[str, IndexOrder]]:
+    """De transforms en index_order met de beste kandidaat voor elk veld. Velden
+    die niet getuned zijn (niet in de data) houden hun spec.
+    """
+    cls = tuning['class']
+    results = tuning['fields']
+    transforms = {
+        k: v
+        for k, v in cls.transforms.items()
+        if k not in ('data', 'raw')
+    }
+    transforms['data'] = {}
+    transforms['raw'] = {}
+    index_order = {}
+
+    for field, spec in cls.transforms['data'].items():
+        if field not in results:
+            transforms['data'][field] = spec
+            if field in cls.transforms.get('raw', {}):
+                transforms['raw'][field] = cls.transforms['raw'][field]
+            if field in getattr(cls, 'index_order', {}):
+                index_order[field] = cls.index_order[field]
+            continue
+        best = results[field]['best']
+        transforms['data'][field] = best['spec']
+        if best['raw']:
+            transforms['raw'][field] = best['raw']
+        if best['order']:
+            index_order[field] = best['order']
+
+    return transforms, index_order
+
+
+def tuned(cls: type[CompressedJSON], obj: JSON, **kwds) -> type[CompressedJSON]:
+    """Subclass van cls met de aanbevolen transforms en index_order voor obj
+    (zie tune()). Een bestand bewaart zijn eigen 'transform', dus cls.load()
+    leest het gewoon.
+    """
+    tuning = tune(cls, obj, **kwds)
+    logger.debug(f' - {cls.__name__} getuned, andere spec voor: '
+                 f'{", ".join(changed_fields(tuning)) or "-"}.')
+    transforms, index_order = recommended(tuning)
+    return type(cls.__name__, (cls,), {
+        'transforms': transforms,
+        'index_order': index_order,
+    })
+
+
+def format_spec(transforms: JSON, index_order: dict[str, IndexOrder]) -> str:
+    """transforms en index_order als Python, om in de class te plakken."""
+    def entries(specs: JSON, comments: bool) -> list[str]:
+        lines = [
+            (f'    {field!r}: {spec!r},',
+             index_order[field].name if comments and field in index_order else '')
+            for field, spec in specs.items()
+        ]
+        width = max((len(line) for line, _ in lines), default=0) + 2
+        return [
+            f'{line:{width}}# {comment}' if comment else line
+            for line, comment in lines
+        ]
+
+    out = ['transforms = {']
+    if 'group' in transforms:
+        out.append(f"    'group': {transforms['group']!r},")
+    for channel in ('data', 'raw'):
+        if not transforms[channel]:
+            out.append(f'    {channel!r}: {{}},')
+            continue
+        out.append(f'    {channel!r}: {{')
+        out.extend(f'    {line}' for line in entries(transforms[channel], channel == 'data'))
+        out.append('    },')
+    out.append('}')
+    out.append('index_order = {')
+    out.extend(f'    {field!r}: IndexOrder.{order.name},' for field, order in index_order.items())
+    out.append('}')
+    return '\n'.join(out)
+
+
+def report(tuning: JSON, top: int = 3) -> str:
+    """Per veld de huidige en de beste spec, met de top kandidaten, de totalen
+    en de aanbevolen transforms.
+    """
+    def describe(candidate: JSON) -> str:
+        spec = candidate['spec']
+        if candidate['raw']:
+            spec = f"{spec} raw {candidate['raw']}"
+        if candidate['order']:
+            spec = f"{spec} {candidate['order'].name}"
+        return (f"{candidate['bytes']:>9} B  {1000 * candidate['encode']:6.1f} + "
+                f"{1000 * candidate['decode']:6.1f} ms  {spec}")
+
+    cls = tuning['class']
+    lines = [f"{cls.__name__} ({tuning['size']}):"]
+    totals = {'current': [0, 0.0, 0.0], 'best': [0, 0.0, 0.0]}
+    for field, result in tuning['fields'].items():
+        lines.append(f'  {field}')
+        lines.append(f"    nu    {describe(result['current'])}")
+        for candidate in result['candidates'][:top]:
+            lines.append(f'    ->    {describe(candidate)}')
+        for key in totals:
+            totals[key][0] += result[key]['bytes']
+            totals[key][1] += result[key]['encode']
+            totals[key][2] += result[key]['decode']
+
+    lines.append('  totaal')
+    for key, label in (('current', 'nu'), ('best', 'beste')):
+        n_bytes, encode, decode = totals[key]
+        lines.append(f'    {label:5} {n_bytes:>9} B  {1000 * encode:6.1f} + {1000 * decode:6.1f} ms')
+    lines.append('')
+    lines.append(format_spec(*recommended(tuning)))
+    return '\n'.join(lines)
+
+
+def changed_fields(tuning: JSON) -> Sequence[str]:
+    """De velden waarvoor een andere spec dan de huidige aanbevolen wordt."""
+    return [
+        field
+        for field, result in tuning['fields'].items()
+        if result['best'] is not result['current']
+    ]
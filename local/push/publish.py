@@ -0,0 +1,167 @@
+"""
+Publiceert de output bestanden voor de webserver. Per bestand komt er een
+kopie met de hash van de inhoud in de naam, die dus nooit verandert, met
+voorgecomprimeerde varianten op het hoogste niveau: .gz, en .br en .zst als
+brotli of zstandard geïnstalleerd is. Een manifest wijst de huidige versies
+aan, met per bestand de laatste versies (de nieuwste eerst):
+
+{
+    "files": {
+        "containers.min.json": "containers.min.3f2a9c1b7d4e.json",
+        ...
+    },
+    "versions": {
+        "containers.min.json": ["containers.min.3f2a9c1b7d4e.json", ...],
+        ...
+    }
+}
+
+De webserver kan de gehashte bestanden voor altijd laten cachen (Cache-Control:
+immutable) en zelf de gecomprimeerde variant kiezen (zoals nginx gzip_static
+of brotli_static). Alleen het manifest moet steeds opnieuw opgehaald worden.
+
+Een bestand dat niet veranderd is wordt niet opnieuw geschreven of
+gecomprimeerd. Van elk bestand blijven de KEEP_VERSIONS versies uit het
+manifest staan, voor een browser die nog een ouder manifest heeft. Welke dat
+zijn staat in het manifest en niet in de mtime: een bestand dat terug gaat
+naar een eerdere inhoud krijgt die eerdere versie terug. Een bestand dat niet
+meer gepubliceerd wordt gaat uit het manifest, met al zijn versies.
+"""
+import gzip
+import hashlib
+import logging
+import os
+import re
+from collections.abc import Callable, Sequence
+from typing import Any
+
+from local.backup import load, save, save_bytes
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+JSON = dict[str, Any]
+
+MANIFEST = 'manifest.json'
+KEEP_VERSIONS = 3
+
+# Extensie -> compressie. Gzip zonder mtime, zodat dezelfde inhoud dezelfde
+# bytes geeft.
+COMPRESSORS: dict[str, Callable[[bytes], bytes]] = {
+    '.gz': lambda data: gzip.compress(data, compresslevel=9, mtime=0),
+}
+if brotli:
+    COMPRESSORS['.br'] = lambda data: brotli.compress(data, quality=11)
+if zstandard:
+    COMPRESSORS['.zst'] = lambda data: zstandard.ZstdCompressor(level=22).compress(data)
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=6).hexdigest()
+
+
+def hashed_filename(filename: str, digest: str) -> str:
+    """containers.min.json -> containers.min.3f2a9c1b7d4e.json"""
+    name, ext = os.path.splitext(filename)
+    return f'{name}.{digest}{ext}'
+
+
+def versions(filename: str) -> list[str]:
+    """De gehashte versies van filename die er staan."""
+    directory = os.path.dirname(filename) or '.'
+    name, ext = os.path.splitext(os.path.basename(filename))
+    pattern = re.compile(rf'{re.escape(name)}\.[0-9a-f]{{12}}{re.escape(ext)}')
+    found = [
+        os.path.join(directory, f)
+        for f in os.listdir(directory)
+        if pattern.fullmatch(f)
+    ]
+    return sorted(found)
+
+
+def prune(filename: str, keep: Sequence[str] = ()) -> None:
+    """Verwijdert de gehashte versies van filename die niet in keep (namen
+    zonder map) staan, met hun gecomprimeerde varianten.
+    """
+    for old in versions(filename):
+        if os.path.basename(old) not in keep:
+            for ext in ('', '.gz', '.br', '.zst'):
+                try:
+                    os.remove(old + ext)
+                except FileNotFoundError:
+                    pass
+
+
+def publish_file(filename: str) -> str | None:
+    """Schrijft de gehashte versie van filename met de gecomprimeerde
+    varianten, als die er nog niet is. Geeft de naam (zonder map), of None
+    als filename niet bestaat.
+    """
+    try:
+        with open(filename, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+
+    published = hashed_filename(filename, content_hash(data))
+    if os.path.exists(published):
+        logger.debug(f' - {os.path.basename(filename)}: ongewijzigd.')
+    else:
+        # Eerst de varianten: een bestaande gehashte versie is compleet.
+        for ext, compress in COMPRESSORS.items():
+            save_bytes(published + ext, compress(data))
+        save_bytes(published, data)
+        logger.debug(f' - {os.path.basename(published)}: {len(data)} bytes, ' + ', '.join(
+            f'{ext} {os.path.getsize(published + ext)}' for ext in COMPRESSORS))
+
+    return os.path.basename(published)
+
+
+def publish(filenames: Sequence[str], manifest_file: str = None) -> JSON:
+    """Publiceert filenames (zie publish_file) en werkt het manifest bij. Dat
+    staat standaard als MANIFEST in de map van het eerste bestand. Bestanden
+    die niet bestaan worden overgeslagen. Bestanden in het manifest die niet
+    in filenames staan gaan eruit, en hun versies worden verwijderd. Geeft
+    het manifest.
+    """
+    logger.debug('publish...')
+    if manifest_file is None:
+        manifest_file = os.path.join(os.path.dirname(filenames[0]), MANIFEST)
+
+    manifest = load(manifest_file)
+    files = dict(manifest.get('files', {}))
+    # Een manifest van voor 'versions' kent alleen de huidige versie.
+    history = {name: [current] for name, current in files.items()}
+    history.update(manifest.get('versions', {}))
+
+    directory = os.path.dirname(manifest_file)
+    names = {os.path.basename(filename) for filename in filenames}
+    for name in set(files) - names:
+        logger.debug(f' - {name}: niet meer gepubliceerd.')
+        prune(os.path.join(directory, name))
+        del files[name]
+        history.pop(name, None)
+
+    for filename in filenames:
+        name = os.path.basename(filename)
+        published = publish_file(filename)
+        if published:
+            files[name] = published
+            older = [v for v in history.get(name, []) if v != published]
+            history[name] = [published, *older][:KEEP_VERSIONS]
+            prune(filename, history[name])
+
+    if files != manifest.get('files') or history != manifest.get('versions'):
+        manifest = {'files': files, 'versions': history}
+        save(manifest_file, manifest)
+    logger.debug(' - done.')
+    return manifest
@@ -0,0 +1,230 @@
+"""
+Tegels (z/x/y, zoals de ondergrond van de kaart) met de containers, zodat
+de browser alleen ophaalt wat in beeld is. Op DETAIL_ZOOM
+staan de rijen zelf, gecodeerd met de CompressedJSON class van de data.
+Daaronder zijn ze samengevat per fractie (AggregateJSON): vanaf CLUSTER_ZOOM
+per cluster, en daaronder per cel van een raster van GRID bij GRID per tegel,
+met het gemiddelde punt, het aantal rijen en het totaal van één veld.
+
+De tegels staan in een map naast het bestand:
+
+    containers.min.json -> containers/15/16838/10764.min.json
+
+met een index van de tegels die er zijn (tiles_index()), elk met de hash van
+zijn inhoud (zie jsontools.content_digest()):
+
+{
+    "last_change": "2023-01-01T00:00:00",
+    "min_zoom": 11,
+    "max_zoom": 15,
+    "tiles": {"11/1052/672": "3f2a9c1b7d4e", ...}
+}
+
+Zo vraagt de browser geen tegels op waar niets staat, en met de hash in de url
+mag hij een tegel cachen tot die tegel zelf verandert. Een tegel met dezelfde
+inhoud als de vorige keer wordt niet opnieuw geschreven.
+"""
+import logging
+import os
+from functools import cache
+from typing import Any
+
+import numpy as np
+
+from local.backup import load, save
+from .jsontools import (ARGUMENT_METHODS, CompressedJSON, IndexOrder, parse_spec,
+                        save_files, take)
+
+logger = logging.getLogger(__name__)
+
+JSON = dict[str, Any]
+
+MIN_ZOOM = 11
+CLUSTER_ZOOM = 14
+DETAIL_ZOOM = 15
+
+# Cellen per tegel, per as, voor het samenvatten onder CLUSTER_ZOOM. Bij
+# tegels van 256 pixels is een cel 4 pixels.
+GRID = 64
+
+INDEX = 'tiles.json'
+
+
+class AggregateJSON(CompressedJSON):
+    sort_order = ('fractie', 'lon')
+    transforms = {
+        'data': {
+            'fractie': ['i', 'r'],
+            'lon': ['m', 1_000_000, 'd'],
+            'lat': ['m', 1_000_000, 'd'],
+            'aantal': [],
+            'totaal': ['m', 10],
+        },
+        'raw': {},
+    }
+    index_order = {
+        'fractie': IndexOrder.FREQUENCY,
+    }
+
+
+@cache
+def tile_class(cls: type[CompressedJSON]) -> type[CompressedJSON]:
+    """Subclass van cls voor een tegel: de woordenboeken ('w') zijn relatief
+    aan het bestand, en een tegel staat drie mappen dieper (naam/z/x).
+    """
+    def relative(field: str, spec: list) -> list:
+        out = []
+        for method, arg in parse_spec(field, spec):
+            out.append(method)
+            if method == 'w':
+                out.append(f'../../../{arg}')
+            elif method in ARGUMENT_METHODS:
+                out.append(arg)
+        return out
+
+    transforms = {
+        k: v
+        for k, v in cls.transforms.items()
+        if k not in ('data', 'raw')
+    }
+    for channel in ('data', 'raw'):
+        transforms[channel] = {
+            field: relative(field, spec)
+            for field, spec in cls.transforms.get(channel, {}).items()
+        }
+    return type(cls.__name__, (cls,), {'transforms': transforms})
+
+
+def tiles_dirname(file_out: str) -> str:
+    """containers.min.json -> containers"""
+    head, tail = os.path.split(file_out)
+    return os.path.join(head, tail.partition('.')[0])
+
+
+def tiles_index(file_out: str) -> str:
+    """containers.min.json -> containers/tiles.json"""
+    return os.path.join(tiles_dirname(file_out), INDEX)
+
+
+def tile_xy(lon: np.ndarray, lat: np.ndarray, z: int) -> tuple[np.ndarray, np.ndarray]:
+    """Web Mercator: de positie in tegels op zoom z (het gehele deel is de
+    tegel, de rest de plek in de tegel).
+    """
+    n = 1 << z
+    lat = np.radians(np.clip(lat, -85.0511, 85.0511))
+    x = (lon + 180) / 360 * n
+    y = (1 - np.arcsinh(np.tan(lat)) / np.pi) / 2 * n
+    return x, y
+
+
+def split_tiles(columns: JSON, z: int) -> dict[tuple[int, int], JSON]:
+    """De rijen in columns per tegel (x, y) op zoom z."""
+    x, y = tile_xy(np.asarray(columns['lon'], dtype=float),
+                   np.asarray(columns['lat'], dtype=float), z)
+    keys = np.floor(x).astype(np.int64) << z | np.floor(y).astype(np.int64)
+    tiles, inverse = np.unique(keys, return_inverse=True)
+    order = np.argsort(inverse.ravel(), kind='stable')
+    bounds = np.searchsorted(inverse.ravel()[order], np.arange(len(tiles) + 1))
+    mask = (1 << z) - 1
+    return {
+        (int(key >> z), int(key & mask)): {
+            k: take(v, order[start:end])
+            for k, v in columns.items()
+        }
+        for key, start, end in zip(tiles, bounds[:-1], bounds[1:])
+    }
+
+
+def aggregate(columns: JSON, z: int, total: str, cluster: str = None) -> JSON:
+    """Vat de rijen in columns samen per fractie en per cel van het raster op
+    zoom z, of per cluster (rijen zonder cluster per cel). Geeft de kolommen
+    van AggregateJSON: het gemiddelde punt, het aantal rijen en de som van
+    total.
+    """
+    lon = np.asarray(columns['lon'], dtype=float)
+    lat = np.asarray(columns['lat'], dtype=float)
+    x, y = tile_xy(lon, lat, z)
+    size = GRID << z
+    keys = (np.floor(x * GRID).astype(np.int64) * size
+            + np.floor(y * GRID).astype(np.int64))
+    if cluster:
+        values = columns[cluster]
+        _, clusters = np.unique(np.array([str(v) for v in values]), return_inverse=True)
+        known = np.array([v not in (None, '', -1) for v in values], dtype=bool)
+        keys = np.where(known, clusters.ravel(), -1 - keys)
+
+    fracties, fractie = np.unique(np.array(columns['fractie'], dtype=str), return_inverse=True)
+    groups, inverse = np.unique(np.stack([keys, fractie.ravel()], axis=1),
+                                axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    aantal = np.bincount(inverse, minlength=len(groups))
+    totaal = np.bincount(inverse, np.nan_to_num(np.asarray(columns[total], dtype=float)),
+                         minlength=len(groups))
+    return {
+        'fractie': fracties[groups[:, 1]].tolist(),
+        'lon': (np.bincount(inverse, lon, minlength=len(groups)) / aantal).tolist(),
+        'lat': (np.bincount(inverse, lat, minlength=len(groups)) / aantal).tolist(),
+        'aantal': aantal.tolist(),
+        'totaal': totaal.tolist(),
+    }
+
+
+def push_tiles(cls: type[CompressedJSON], file_out: str, obj: JSON, total: str,
+               cluster: str = None, processes: int = None) -> JSON:
+    """Schrijft de tegels van obj (de data van cls.save(file_out, obj)) en de
+    index, en verwijdert de tegels die er niet meer zijn. Alleen tegels
+    waarvan de inhoud veranderd is worden geschreven. total is het veld dat
+    samengevat wordt opgeteld (zie aggregate()), en cluster het veld met het
+    cluster. Rijen zonder positie vallen weg. Geeft de index.
+    """
+    logger.debug(f' - tegels van {os.path.basename(file_out)}...')
+    directory = tiles_dirname(file_out)
+    index_file = tiles_index(file_out)
+    previous = load(index_file).get('tiles', {})
+    if not isinstance(previous, dict):
+        # Een index van voor de hashes: alles opnieuw.
+        previous = dict.fromkeys(previous)
+
+    columns = cls.columns(obj)
+    lon = np.asarray(columns['lon'], dtype=float)
+    lat = np.asarray(columns['lat'], dtype=float)
+    positions = np.flatnonzero(np.isfinite(lon) & np.isfinite(lat))
+    columns = {k: take(v, positions) for k, v in columns.items()}
+
+    levels = [
+        (z, AggregateJSON, aggregate(columns, z, total, cluster if z >= CLUSTER_ZOOM else None))
+        for z in range(MIN_ZOOM, DETAIL_ZOOM)
+    ]
+    levels.append((DETAIL_ZOOM, cls, columns))
+
+    files = []
+    tiles = []
+    for z, json_class, data in levels:
+        for (x, y), part in split_tiles(data, z).items():
+            filename = os.path.join(directory, f'{z}', f'{x}', f'{y}.min.json')
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            files.append((tile_class(json_class), filename, {
+                'last_change': obj['last_change'],
+                'data': part,
+            }))
+            tiles.append(f'{z}/{x}/{y}')
+    digests = save_files(files, processes=processes,
+                         previous=[previous.get(tile) for tile in tiles])
+
+    removed = previous.keys() - set(tiles)
+    for tile in removed:
+        try:
+            os.remove(os.path.join(directory, f'{tile}.min.json'))
+        except FileNotFoundError:
+            pass
+
+    index = {
+        'last_change': obj['last_change'],
+        'min_zoom': MIN_ZOOM,
+        'max_zoom': DETAIL_ZOOM,
+        'tiles': dict(zip(tiles, digests)),
+    }
+    save(index_file, index)
+    changed = sum(previous.get(tile) != digest for tile, digest in index['tiles'].items())
+    logger.debug(f' - {len(tiles)} tegels, {changed} veranderd, {len(removed)} verwijderd.')
+    return index
@@ -32,20 +32,23 @@
 }
 """
 import logging
-from collections.abc import Callable, Iterable, Iterator, Sequence
-from datetime import datetime, timedelta
+import os
+from collections.abc import Callable, Iterable, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from multiprocessing import get_all_start_methods, get_context
 from operator import itemgetter
 from typing import Any
 
 import numpy as np
-from matplotlib.path import Path
-from sklearn.neighbors import BallTree
 
-from local.backup import load
+from local.backup import load, save, save_bytes
 from .containers import ContainersJSON
 from .gebieden import GebiedenJSON
-from .jsontools import CompressedJSON, IndexOrder
-from .tools import group_by
+from .geotools import ContainerIndex, LocatieMemo, Memo, Polylabel
+from .jsontools import SHARED_STRINGS, CompressedJSON, IndexOrder, concatenate, select
+from .publish import content_hash
+from .tools import group_by, last_monday
 
 logger = logging.getLogger(__name__)
 
@@ -56,6 +59,11 @@ JSON = dict[str, Any]
 # toegekend.
 MAX_AFSTAND = 35
 
+# Het aantal deltas in de keten van push_deltas(). Met een update per drie
+# minuten is dat anderhalf uur: een browser die langer weg was haalt alles
+# opnieuw op.
+MAX_DELTAS = 30
+
 
 clusterfractie = itemgetter('cluster_id', 'fractie')
 
@@ -82,34 +90,89 @@ def clusterfractie_info(containers: Iterable[JSON]) -> dict[int, JSON]:
     }
 
 
-def dichtstbijzijnde_container(containers: Sequence[JSON],
-                               wegingen: Sequence[JSON],
-                               ) -> Iterator[tuple[float, JSON]]:
-    """Geeft voor elke weging de afstand en dichtstbijzijnde container.
+def container_buurten(containers: Sequence[JSON], polylabel: Polylabel,
+                      memo: Memo = None) -> list[JSON]:
+    """Geeft voor elke container de buurt waarin hij staat, of een leeg dict.
+
+    memo is optioneel een Memo van (code, lat, lon) naar de positie van de buurt
+    in polylabel.buurten. Alleen nieuwe en verplaatste containers worden dan
+    gelabeld. Containers die niet meer bestaan gaan uit de memo.
     """
-    def lat_lon_rad(items: Sequence[JSON]) -> np.ndarray:
-        return np.deg2rad(np.array(list(map(lat_lon, items)), dtype=float))
-    
-    fractie = itemgetter('fractie')
-    lat_lon = itemgetter('lat', 'lon')
-    has_lat = itemgetter('lat')
-
-    containers_per_fractie = group_by(fractie, list(filter(has_lat, containers)))
-    tree_per_fractie = {f: BallTree(lat_lon_rad(cc), metric='haversine')
-                        for f, cc in containers_per_fractie.items()}
-
-    # The Earth radius at sea level in Amsterdam, in metres.
-    # See: https://rechneronline.de/earth-radius/
-    earth_radius = 6_364_763
-
-    for w, ll in zip(wegingen, lat_lon_rad(wegingen)):
-        try:
-            f = fractie(w)
-            d, ix = tree_per_fractie[f].query(ll.reshape(1, -1), k=1, sort_results=False)
-        except (KeyError, ValueError):
-            yield None, None
-        else:
-            yield d.item() * earth_radius, containers_per_fractie[f][ix.item()]
+    if memo is None:
+        memo = Memo()
+
+    keys = list(map(itemgetter('code', 'lat', 'lon'), containers))
+    todo = [i for i, k in enumerate(keys) if k not in memo]
+
+    if todo:
+        logger.debug(f' - {len(todo)} containers (opnieuw) labelen.')
+        lon_lat = np.array([(containers[i]['lon'], containers[i]['lat']) for i in todo],
+                           dtype=float, ndmin=2).reshape(-1, 2)
+        memo.update(zip((keys[i] for i in todo), polylabel.label(lon_lat).tolist()))
+
+    for k in memo.keys() - set(keys):
+        del memo[k]
+
+    geen = {}
+    return [polylabel.buurten[b] if b >= 0 else geen for b in map(memo.__getitem__, keys)]
+
+
+def koppel_wegingen(fracties: Sequence[str], lat_lon: np.ndarray,
+                    index: ContainerIndex, polylabel: Polylabel,
+                    memo: LocatieMemo = None, max_afstand: float = MAX_AFSTAND,
+                    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Koppelt elke weging aan de dichtstbijzijnde container en aan een buurt.
+
+    fracties is de fractie van elke weging, lat_lon een (n, 2) array met
+    [lat, lon] in graden (NaN als onbekend).
+
+    Geeft drie arrays:
+     - de afstand in meters tot de dichtstbijzijnde container van dezelfde
+       fractie, of NaN als er geen container gevonden kan worden,
+     - de positie van die container, of -1 als de afstand groter is dan
+       max_afstand,
+     - voor wegingen zonder container de positie van de buurt (in
+       polylabel.buurten) waarin de weging zelf ligt, anders -1.
+
+    memo is optioneel een LocatieMemo. Alleen locaties die daar nog niet in
+    staan worden opgezocht en daarna aan de memo toegevoegd. De afstand komt
+    dan van de eerste weging op die (afgeronde) locatie.
+    """
+    n = len(fracties)
+    fracties = np.array(fracties, dtype=object)
+    lat_lon = np.asarray(lat_lon, dtype=float).reshape(n, 2)
+
+    if memo is None:
+        memo = LocatieMemo()
+
+    keys = memo.quantise(fracties, lat_lon)
+    todo = {k: i for i, k in enumerate(keys) if k is not None and k not in memo}
+
+    if todo:
+        rows = np.fromiter(todo.values(), dtype=np.intp, count=len(todo))
+        points = lat_lon[rows]
+        afstand, container = index.query(fracties[rows], np.deg2rad(points))
+        container[~(afstand <= max_afstand)] = -1
+        buurt = np.full(len(rows), -1, dtype=np.intp)
+        kaal = container < 0
+        buurt[kaal] = polylabel.label(points[kaal, ::-1])
+        memo.update(zip(todo, zip(afstand.tolist(), container.tolist(), buurt.tolist())))
+
+    geen = (np.nan, -1, -1)
+    result = [memo[k] if k is not None else geen for k in keys]
+    result = np.array(result, dtype=float).reshape(n, 3)
+    return result[:, 0], result[:, 1].astype(np.intp), result[:, 2].astype(np.intp)
+
+
+# Aantal milliseconden in een minuut en in een dag.
+MINUUT_MS = 60 * 1000
+DAG_MS = 24 * 60 * MINUUT_MS
+
+
+def coordinaten(values: Sequence[str | None]) -> list[float | None]:
+    """ ['52.1', '', None] -> [52.1, None, None] """
+    floats = np.array([v or 'nan' for v in values], dtype=float)
+    return [None if v != v else v for v in floats.tolist()]
 
 
 def datum_format(datum: datetime) -> str:
@@ -120,12 +183,34 @@ def datum_format(datum: datetime) -> str:
 
 def datum_ms(datum: datetime) -> int:
     return int(datum.timestamp() * 1000)
-    
+
+
+def datum_tijd_ms(dates: Sequence[str], times: Sequence[str]) -> np.ndarray:
+    """Zet de Date en Time kolommen (UTC) om naar ms sinds epoch.
+    Elke unieke datum en tijd wordt maar één keer geparsed.
+    """
+    day, day_ix = np.unique(np.asarray(dates, dtype=str), return_inverse=True)
+    tijd, tijd_ix = np.unique(np.asarray(times, dtype=str), return_inverse=True)
+    day_ms = day.astype('datetime64[D]').astype('datetime64[ms]').astype(np.int64)
+    tijd_ms = np.char.add('1970-01-01T', tijd).astype('datetime64[ms]').astype(np.int64)
+    return day_ms[day_ix.ravel()] + tijd_ms[tijd_ix.ravel()]
+
+
+def format_ms(values: np.ndarray, fmt: Callable[[datetime], str]) -> list[str]:
+    """Past fmt toe op elk timestamp (ms), maar één keer per unieke waarde.
+    """
+    unique, inverse = np.unique(values, return_inverse=True)
+    strings = np.array([
+        fmt(datetime.fromtimestamp(v / 1000, tz=timezone.utc))
+        for v in unique.tolist()
+    ], dtype=object)
+    return strings[inverse.ravel()].tolist()
+
 
 def gewicht(w: str | None) -> int | None:
     try:
         return int(w)
-    except ValueError:
+    except (TypeError, ValueError):
         # e.g. weegsysteem 407 op 1 maart 2023. Weging met volgnummer 48451.
         # -> NetWeight = 52.3895. Dit klopt niet. Dat is een GPS coordinaat.
         # Datapunt neemt de waarde wel over (https://api.data.amsterdam.nl/v1/huishoudelijkafval/weging/?datumWeging=2023-03-01&volgnummer=48451)
@@ -133,88 +218,199 @@ def gewicht(w: str | None) -> int | None:
         return None
 
 
+def gewichten(values: Sequence[str | None]) -> list[int | None]:
+    """Zoals gewicht(), maar één keer per unieke waarde.
+    """
+    memo = {w: gewicht(w) for w in set(values)}
+    return list(map(memo.__getitem__, values))
+
+
 def tijd_format(datum: datetime) -> str:
     return f'{datum.hour}:{datum.minute:02d}'
 
 
-def tijd_ms(datum: datetime) -> int:
-    return datum_ms(datum) % (24 * 60 * 60 * 1000)
+def weekdag_ma1(ms: np.ndarray) -> list[str]:
+    """Geeft de weekdag met maandag = '1' en zondag = '0'.
+    """
+    # str is nodig voor de UIX.
+    # 1 januari 1970 was een donderdag ('4').
+    weekdagen = np.array(['4', '5', '6', '0', '1', '2', '3'], dtype=object)
+    return weekdagen[(ms // DAG_MS) % 7].tolist()
 
 
-def weekdag_ma1(datum: datetime) -> str:
-    # str is nodig voor de UIX.
-    return str((datum.weekday() + 1) % 7)
+# Het verrijken wordt over processen verdeeld vanaf dit aantal wegingen.
+SHARD_MIN = 20_000
 
+# De context voor de worker processen. Wordt gezet vlak voor de fork, zodat de
+# workers de container index en polygonen delen zonder ze te pickelen.
+_shard_context: tuple['Verrijker', Sequence[JSON]] = None
 
-def weging_datum(weging: JSON) -> datetime:
-    return datetime.fromisoformat(f'{weging["Date"]}T{weging["Time"]}Z')
 
+class Verrijker:
+    """Maakt van ruwe Welvaarts wegingen verrijkte kolommen voor de output.
 
-class Polylabel:
-    @classmethod
-    def _group(cls, gebieden: Sequence[JSON], points: np.ndarray, indices: np.ndarray,
-               callback: Callable[[JSON, np.ndarray], Any]) -> None:
-        """Roept `callback(gebied, indices)` aan voor elke polygoon zonder kinderen.
-        De indices zijn van de punten die in het polygoon liggen.
+    kenteken geeft per SystemId het kenteken van de wagen.
+    containers zijn de containers met '_buurt' en '_cf' velden, in dezelfde
+        volgorde als waarmee container_index gebouwd is.
+    Alleen wegingen vanaf after worden meegenomen.
+    """
+    def __init__(self, kenteken: dict[int, str], containers: Sequence[JSON],
+                 container_index: ContainerIndex, polylabel: Polylabel,
+                 memo: LocatieMemo = None, after: datetime = None) -> None:
+        self.kenteken = kenteken
+        self.containers = containers
+        self.container_index = container_index
+        self.polylabel = polylabel
+        self.memo = memo if memo is not None else LocatieMemo()
+        self.after = after
+        self.container_velden = self.tabel(containers, {
+            'containers': lambda c: c['_cf']['containers'],
+            'containervolume': lambda c: c['_cf']['containervolume'],
+            'afvalvolume': lambda c: c['_cf']['afvalvolume'],
+            'cluster': lambda c: c['_cf']['cluster'],
+            'adres': lambda c: c['_cf']['adres'],
+            'buurt': lambda c: c['_buurt'].get('naam', ''),
+            'wijk': lambda c: c['_buurt'].get('ligt_in', ''),
+            'stadsdeel': lambda c: c['_buurt'].get('ligt_in_stadsdeel', ''),
+        }, [[], None, None, '', '', '', '', ''])
+        self.buurt_velden = self.tabel(polylabel.buurten, {
+            'buurt': itemgetter('naam'),
+            'wijk': itemgetter('ligt_in'),
+            'stadsdeel': itemgetter('ligt_in_stadsdeel'),
+        }, ['', '', ''])
 
-        `gebieden` is een lijst met dicts. Elk dict heeft een sleutel 'poly' met
-        coordinaten van een polygoon. Het dict mag ook een sleutel '_children'
-        hebben, welke dan een lijst met nieuwe van zulke objecten geeft.
-        Zodoende kan gebieden een boomstructuur geven, maar het kan dus ook een
-        platte lijst zijn alnaargelang wat de toepassing vergt.
+    @staticmethod
+    def tabel(items: Sequence[JSON], velden: dict[str, Callable],
+              geen: Sequence) -> dict[str, np.ndarray]:
+        """Geeft per veld een object array met de waarde voor elk item, met
+        als laatste element de waarde in geen. Positie -1 geeft dus geen.
         """
-        for gebied in gebieden:
-            poly = Path(list(zip(gebied['lon'], gebied['lat'])))
-            contained = poly.contains_points(points)
-            contained_indices = indices[contained]
+        tabel = {}
+        for (veld, f), default in zip(velden.items(), geen):
+            values = np.empty(len(items) + 1, dtype=object)
+            values[:-1] = list(map(f, items))
+            values[-1] = default
+            tabel[veld] = values
+        return tabel
+
+    def __call__(self, wegingen: Sequence[JSON]) -> JSON:
+        columns = self.columns(wegingen)
+        self.enrich(columns)
+        return columns
+
+    def recent(self, wegingen: Sequence[JSON]) -> tuple[Sequence[JSON], np.ndarray]:
+        """Geeft de wegingen vanaf after, met hun datum in ms."""
+        ms = datum_tijd_ms([w['Date'] for w in wegingen], [w['Time'] for w in wegingen])
+        recent = np.flatnonzero(ms >= datum_ms(self.after)) if self.after else None
+        if recent is not None and len(recent) < len(wegingen):
+            wegingen = [wegingen[i] for i in recent.tolist()]
+            ms = ms[recent]
+        return wegingen, ms
+
+    def columns(self, wegingen: Sequence[JSON]) -> JSON:
+        """Zet de ruwe wegingen om naar kolommen. Elke kolom wordt in één keer
+        omgezet, niet per weging.
+        """
+        def column(name: str) -> list:
+            return list(map(itemgetter(name), wegingen))
+
+        wegingen, ms = self.recent(wegingen)
+        systeem_id = column('SystemId')
+        kenteken = self.kenteken
+        tijd_ms = ms % DAG_MS
+
+        return {
+            'systeem_id': systeem_id,
+            'volgnummer': list(map(int, column('Seq'))),
+            'kenteken': [kenteken.get(s, '') for s in systeem_id],
+            'datum_str': format_ms(ms - ms % DAG_MS, datum_format),
+            'datum_ms': ms,
+            'tijd_str': format_ms(tijd_ms - tijd_ms % MINUUT_MS, tijd_format),
+            'tijd_ms': tijd_ms,
+            'weekdag_ma1': weekdag_ma1(ms),
+            'fractie': column('FractionId'),
+            'eerste_weging': gewichten(column('FirstWeight')),
+            'tweede_weging': gewichten(column('SecondWeight')),
+            'netto_gewicht': gewichten(column('NetWeight')),
+            'lon': coordinaten(column('Longitude')),
+            'lat': coordinaten(column('Latitude')),
+        }
 
-            if '_children' in gebied and len(gebied['_children']):
-                cls._group(gebied['_children'], points[contained],
-                           contained_indices, callback)
-            else:
-                callback(gebied, contained_indices)
+    def koppel(self, wegingen: Sequence[JSON]) -> None:
+        """Zet de koppeling van elke nieuwe locatie in wegingen in de memo,
+        zoals __call__() dat zou doen: met de eerste weging (vanaf after) op
+        die locatie.
+        """
+        wegingen, _ = self.recent(wegingen)
+        lat_lon = np.array([coordinaten([w['Latitude'] for w in wegingen]),
+                            coordinaten([w['Longitude'] for w in wegingen])], dtype=float).T
+        koppel_wegingen([w['FractionId'] for w in wegingen], lat_lon,
+                        self.container_index, self.polylabel, memo=self.memo)
 
-            points = points[~contained]
-            indices = indices[~contained]
+    def enrich(self, columns: JSON) -> None:
+        """Voegt de kolommen van de gekoppelde container en buurt toe.
 
-    @staticmethod
-    def gebieden_topo(gebieden: JSON) -> list[JSON]:
-        stadsdelen = gebieden['stadsdelen']
-        wijken = gebieden['wijken']
-        buurten = gebieden['buurten']
-
-        for w in wijken:
-            w['_children'] = [b for b in buurten if b['ligt_in'] == w['naam']]
-        for s in stadsdelen:
-            s['_children'] = [w for w in wijken if w['ligt_in'] == s['naam']]
-            for w in s['_children']:
-                for b in w['_children']:
-                    b['ligt_in_stadsdeel'] = s['naam']
-
-        return stadsdelen
-
-    @classmethod
-    def label_containers(cls, topo: Sequence[JSON], containers: Sequence[JSON]) -> list[JSON]:
-        """Geeft voor elke container het kleinste omsluitende gebied (buurt).
+        Wegingen zonder container krijgen de buurt waarin ze zelf liggen.
         """
-        def label(buurt: JSON, indices: np.array) -> None:
-            for ix in indices:
-                labels[ix] = buurt
+        lat_lon = np.array([columns['lat'], columns['lon']], dtype=float).T
+        afstanden, matches, buurten = koppel_wegingen(
+            columns['fractie'], lat_lon, self.container_index, self.polylabel,
+            memo=self.memo)
+
+        columns['afstand'] = [None if d != d else d for d in afstanden.tolist()]
+        for veld, values in self.container_velden.items():
+            columns[veld] = values[matches]
+        kaal = matches < 0
+        for veld, values in self.buurt_velden.items():
+            columns[veld][kaal] = values[buurten[kaal]]
+
+
+def _verrijk_shard(start: int, stop: int) -> JSON:
+    verrijker, wegingen = _shard_context
+    return verrijker(wegingen[start:stop])
+
+
+def verrijk(verrijker: Verrijker, wegingen: Sequence[JSON],
+            processes: int = None) -> JSON:
+    """Verrijkt de wegingen, eventueel verdeeld over meerdere processen.
+    Geeft kolommen (zie Verrijker.columns en Verrijker.enrich).
+
+    De wegingen gaan in opeenvolgende stukken naar een process pool en de
+    resultaten worden in dezelfde volgorde weer samengevoegd. Eerst worden
+    alle nieuwe locaties in dit proces gekoppeld (Verrijker.koppel), met de
+    eerste weging op elke locatie. De workers vinden dan alles in de memo en
+    de rijen hangen niet meer van elkaar af: elk stuk geeft hetzelfde als in
+    één keer, dus de grenzen van de stukken doen er niet toe.
+
+    Dit werkt alleen met fork (dus niet op Windows). Anders, of met processes
+    gelijk aan 1, gebeurt alles in dit proces.
+    """
+    global _shard_context
 
-        n = len(containers)
-        labels = [{} for _ in range(n)]
+    n = len(wegingen)
+    if processes is None:
+        processes = os.cpu_count() if n >= SHARD_MIN else 1
 
-        if n > 0:
-            lon_lat = list(map(itemgetter('lon', 'lat'), containers))
-            lon_lat = np.array(lon_lat, dtype=float, ndmin=2)
-            indices = np.flatnonzero(~np.isnan(lon_lat[:, 0]))
-            cls._group(topo, lon_lat[indices], indices, label)
+    if processes <= 1 or 'fork' not in get_all_start_methods():
+        return verrijker(wegingen)
 
-        return labels
+    logger.debug(f' - verrijk {n} wegingen met {processes} processen.')
+    verrijker.koppel(wegingen)
+    bounds = np.linspace(0, n, 4 * processes + 1).astype(int).tolist()
+
+    _shard_context = verrijker, wegingen
+    try:
+        with ProcessPoolExecutor(processes, mp_context=get_context('fork')) as pool:
+            shards = list(pool.map(_verrijk_shard, bounds[:-1], bounds[1:]))
+    finally:
+        _shard_context = None
+
+    return concatenate(shards)
 
 
 class WegingenJSON(CompressedJSON):
     sort_order = ('systeem_id', 'datum_ms')
+    block_range = 'datum_ms'
     transforms = {
         'data': {
             'systeem_id': ['i', 'r'],               # UNSORTED
@@ -248,11 +444,11 @@ class WegingenJSON(CompressedJSON):
             'tijd_str': ['j', '@'],
             # 'weekdag_ma1': ['j', '@'],
             'containers': ['j', '@'],
-            'cluster': ['j', '@'],
-            'adres': ['j', '@'],
-            'buurt': ['j', '@'],
-            'wijk': ['j', '@'],
-            'stadsdeel': ['j', '@'],
+            'cluster': ['w', SHARED_STRINGS, 'd'],
+            'adres': ['w', SHARED_STRINGS, 'd'],
+            'buurt': ['w', SHARED_STRINGS, 'd'],
+            'wijk': ['w', SHARED_STRINGS, 'd'],
+            'stadsdeel': ['w', SHARED_STRINGS, 'd'],
         },
     }
     index_order = {
@@ -276,24 +472,251 @@ class WegingenJSON(CompressedJSON):
     }
 
 
+def iso_week(datum: datetime) -> str:
+    """ datetime(2023, 5, 10) -> '2023-W19' """
+    year, week, _ = datum.isocalendar()
+    return f'{year}-W{week:02d}'
+
+
+def iso_weeks(ms: np.ndarray) -> np.ndarray:
+    """De ISO week (UTC) van elke datum_ms, zoals iso_week()."""
+    days = np.asarray(ms, dtype=np.int64) // 86_400_000
+    # 1970-01-01 was een donderdag.
+    mondays, inverse = np.unique(days - (days + 3) % 7, return_inverse=True)
+    epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+    labels = [iso_week(epoch + timedelta(days=int(d))) for d in mondays]
+    return np.array(labels, dtype=str)[inverse.ravel()]
+
+
+def week_filename(file_out: str, week: str) -> str:
+    """wegingen.min.json, '2023-W19' -> wegingen.2023-W19.min.json"""
+    head, tail = os.path.split(file_out)
+    name, _, ext = tail.partition('.')
+    return os.path.join(head, f'{name}.{week}.{ext}')
+
+
+def weeks_filename(file_out: str) -> str:
+    """wegingen.min.json -> wegingen.weken.json"""
+    head, tail = os.path.split(file_out)
+    return os.path.join(head, f'{tail.partition(".")[0]}.weken.json')
+
+
+def load_weeks(file_out: str, fields: Sequence[str], after: datetime = None) -> JSON:
+    """De kolommen fields van de weken (zie push_weeks) vanaf de week van
+    after, achter elkaar. last_change is die van het manifest.
+    """
+    manifest = load(weeks_filename(file_out))
+    first = iso_week(after) if after else ''
+    columns = []
+    for week in manifest.get('weken', []):
+        if week['week'] >= first:
+            data = WegingenJSON.load(week_filename(file_out, week['week']))['data']
+            columns.append({f: data[f] for f in fields if f in data})
+    return {
+        'last_change': manifest['last_change'],
+        'data': concatenate(columns) if columns else {},
+    }
+
+
+def push_weeks(file_out: str, obj: JSON, after: datetime = None) -> JSON:
+    """Voegt de wegingen in obj (kolommen) toe aan het bestand van hun ISO
+    week, week_filename(file_out, week), en werkt het manifest bij:
+
+    {
+        "last_change": "2023-01-01T00:00:00",
+        "weken": [
+            {
+                "week": "2023-W19",
+                "file": "wegingen.2023-W19.min.json",
+                "url": "wegingen.2023-W19.min.json?v=3f2a9c1b7d4e",
+                "last_change": "2023-05-14T23:58:00",
+                "size": 12345,
+                "closed": true
+            },
+            ...
+        ]
+    }
+
+    Alleen weken met nieuwe wegingen worden geschreven, normaal alleen de
+    huidige. Een afgesloten week (closed, vóór last_monday()) verandert dus
+    alleen nog als er late wegingen voor binnenkomen. url heeft de hash van
+    de inhoud (zie publish.content_hash), dus dan verandert ook de url: een
+    browser mag een week onder zijn url voor altijd cachen. De weken staan
+    op volgorde. Weken vóór de week van after gaan uit het manifest en hun
+    bestanden worden verwijderd. Geeft het manifest.
+    """
+    manifest_file = weeks_filename(file_out)
+    weeks = {w['week']: w for w in load(manifest_file).get('weken', [])}
+
+    columns = obj['data']
+    n = len(columns.get('datum_ms', ()))
+    labels = iso_weeks(columns['datum_ms']) if n else np.array([], dtype=str)
+    for week in sorted(set(labels.tolist())):
+        mask = labels == week
+        filename = week_filename(file_out, week)
+        WegingenJSON.append(filename, {
+            'last_change': obj['last_change'],
+            'data': select(columns, mask),
+        })
+        with open(filename, 'rb') as f:
+            digest = content_hash(f.read())
+        weeks[week] = {
+            'week': week,
+            'file': os.path.basename(filename),
+            'url': f'{os.path.basename(filename)}?v={digest}',
+            'last_change': obj['last_change'],
+            'size': weeks.get(week, {}).get('size', 0) + int(mask.sum()),
+        }
+        logger.debug(f' - week {week}: {int(mask.sum())} nieuwe wegingen.')
+
+    first = iso_week(after) if after else ''
+    for week in [k for k in weeks if k < first]:
+        try:
+            os.remove(week_filename(file_out, week))
+        except FileNotFoundError:
+            pass
+        del weeks[week]
+        logger.debug(f' - week {week} verwijderd.')
+
+    current = iso_week(last_monday())
+    manifest = {
+        'last_change': obj['last_change'],
+        'weken': [dict(weeks[k], closed=k < current) for k in sorted(weeks)],
+    }
+    save(manifest_file, manifest)
+    return manifest
+
+
+def delta_filename(delta_file_out: str, version: int) -> str:
+    """wegingen.3min.json, 42 -> wegingen.3min.42.json"""
+    name, ext = os.path.splitext(delta_file_out)
+    return f'{name}.{version}{ext}'
+
+
+def deltas_filename(delta_file_out: str) -> str:
+    """wegingen.3min.json -> wegingen.3min.index.json"""
+    return delta_filename(delta_file_out, 'index')
+
+
+def push_deltas(delta_file_out: str, obj: JSON, last_delta: str | None,
+                max_deltas: int = MAX_DELTAS) -> JSON:
+    """Schrijft de nieuwe wegingen in obj als delta met het volgende
+    volgnummer, delta_filename(delta_file_out, version), en werkt de index van
+    de keten bij:
+
+    {
+        "last_change": "2023-05-14T23:58:00",
+        "head": 42,
+        "deltas": [
+            {
+                "version": 13,
+                "file": "wegingen.3min.13.json",
+                "last_change": "2023-05-14T22:31:00",
+                "last_delta": "2023-05-14T22:28:00",
+                "size": 12
+            },
+            ...
+        ]
+    }
+
+    Elke delta heeft de last_change van de vorige als last_delta: een browser
+    met versie N haalt de deltas N+1..head op en kan controleren dat ze op
+    elkaar aansluiten. De keten houdt de laatste max_deltas deltas. De output
+    met alle wegingen wordt bij elke delta al bijgewerkt, dus de oudste
+    deltas kunnen gewoon weg: wie van vóór de keten is haalt de output
+    opnieuw op. delta_file_out zelf blijft de laatste delta. De index wordt als
+    laatste geschreven, na de delta zelf.
+    """
+    index_file = deltas_filename(delta_file_out)
+    index = load(index_file)
+    n = len(obj['data'].get('datum_ms', ()))
+    deltas = index.get('deltas', [])
+    version = index.get('head', 0) + 1
+
+    filename = delta_filename(delta_file_out, version)
+    WegingenJSON.save(filename, obj, last_delta=last_delta, version=version)
+    # Dezelfde bytes, voor browsers die alleen de laatste delta kennen.
+    with open(filename, 'rb') as f:
+        save_bytes(delta_file_out, f.read())
+
+    deltas.append({
+        'version': version,
+        'file': os.path.basename(filename),
+        'last_change': obj['last_change'],
+        'last_delta': last_delta,
+        'size': n,
+    })
+    for old in deltas[:-max_deltas]:
+        try:
+            os.remove(os.path.join(os.path.dirname(delta_file_out), old['file']))
+        except FileNotFoundError:
+            pass
+    index = {
+        'last_change': obj['last_change'],
+        'head': version,
+        'deltas': deltas[-max_deltas:],
+    }
+    save(index_file, index)
+    logger.debug(f' - delta {version}: {n} nieuwe wegingen.')
+    return index
+
+
 def push(file_out: str, delta_file_out: str, data_files: dict[str, str],
-         web_files: dict[str, str], after: datetime = None) -> None:
+         web_files: dict[str, str], after: datetime = None,
+         cache_files: dict[str, str] = None, processes: int = None,
+         containers: JSON = None, gebieden: JSON = None, weekly: bool = False) -> None:
+    """Werkt de wegingen output bij met de nieuwe wegingen uit data_files.
+
+    processes is het aantal processen voor het verrijken van de wegingen. Bij
+    None wordt dat bepaald aan de hand van het aantal nieuwe wegingen.
+    containers en gebieden zijn optioneel de resultaten van push_containers en
+    push_gebieden. Zonder worden ze uit web_files gelezen.
+
+    Met weekly komen de wegingen niet in file_out maar in een bestand per ISO
+    week, met een manifest (zie push_weeks). Dan wordt alleen de week met de
+    nieuwe wegingen geschreven, en weken vóór de week van after verdwijnen.
+
+    De nieuwe wegingen komen ook als delta in delta_file_out, en in een keten
+    van deltas met volgnummers (zie push_deltas).
+    """
     logger.debug('wegingen...')
+    cache_files = cache_files or {}
 
     # SystemId, VehicleReg, LatestWeighDate
     # Seq, Date, Time, FractionId, FirstWeight, SecondWeight, NetWeight, Latitude, Longitude, SystemId
     input_wagens = load(data_files['wagens'])
     input_wegingen = load(data_files['wegingen'])
-    output_wegingen = WegingenJSON.load(file_out)
-
-    if input_wegingen['last_change'] == output_wegingen['last_change']:
+    # Van de vorige output zijn alleen systeem_id en volgnummer nodig. Die
+    # worden pas hieronder (en alleen die) gedecodeerd.
+    if weekly:
+        output_wegingen = load_weeks(file_out, ('systeem_id', 'volgnummer'), after)
+    else:
+        output_wegingen = WegingenJSON.load(file_out)
+
+    # De index van de deltas wordt na de output geschreven (zie onder). Is die
+    # achter, dan stopte de vorige keer tussendoor: dan komt er een lege delta
+    # met de last_delta van de output, en halen browsers de output opnieuw op.
+    last_change = input_wegingen['last_change']
+    if (last_change == output_wegingen['last_change'] and
+            last_change == load(deltas_filename(delta_file_out)).get('last_change')):
         logger.debug(' - skip. Geen veranderingen sinds laatste keer.')
         return
 
-    containers = ContainersJSON.load(web_files['containers'])['data']
-    gebieden = GebiedenJSON.load(web_files['gebieden'])
-    topo = Polylabel.gebieden_topo(gebieden)
-    container_buurt = Polylabel.label_containers(topo, containers)
+    if containers is None:
+        containers = ContainersJSON.load_cached(web_files['containers'],
+                                                cache_files.get('containers'))
+    container_index = ContainerIndex.cached(cache_files.get('containers-index'),
+                                            containers['last_change'], containers['data'])
+    containers = containers['data']
+    if gebieden is None:
+        gebieden = GebiedenJSON.load_cached(web_files['gebieden'],
+                                            cache_files.get('gebieden'))
+    polylabel = Polylabel.cached(cache_files.get('polylabel'), gebieden)
+    locatie_memo = LocatieMemo.cached(cache_files.get('locaties'),
+                                      (container_index.key, gebieden['last_change']))
+    buurt_memo = Memo.cached(cache_files.get('container-buurten'), gebieden['last_change'])
+    container_buurt = container_buurten(containers, polylabel, buurt_memo)
+    buurt_memo.save(cache_files.get('container-buurten'))
     cf_info = clusterfractie_info(containers)
 
     for c, b in zip(containers, container_buurt):
@@ -312,94 +735,29 @@ def push(file_out: str, delta_file_out: str, data_files: dict[str, str],
 
     def input_weging_key(w: JSON) -> tuple[int, int]:
         return w['SystemId'], int(w['Seq'])
-    
-    def is_recent() -> Callable[[datetime], bool]:
-        if after:
-            def is_after(v: datetime) -> bool:
-                return v >= after
-            return is_after
-        else:
-            def just_true(_: datetime) -> bool:
-                return True
-            return just_true
 
     # input_weging_key = itemgetter('SystemId', 'Seq')
-    output_weging_key = itemgetter('systeem_id', 'volgnummer')
-    bekend = set(map(output_weging_key, output_wegingen['data']))
-    recent = is_recent()
-    nieuwe_wegingen = [
-        {
-            'systeem_id': w['SystemId'],
-            'volgnummer': int(w['Seq']),
-            'kenteken': kenteken.get(w['SystemId'], ''),
-            'datum_str': datum_format(dt),
-            'datum_ms': datum_ms(dt),
-            'tijd_str': tijd_format(dt),
-            'tijd_ms': tijd_ms(dt),
-            'weekdag_ma1': weekdag_ma1(dt),
-            'fractie': w['FractionId'],
-            'eerste_weging': gewicht(w['FirstWeight']),
-            'tweede_weging': gewicht(w['SecondWeight']),
-            'netto_gewicht': gewicht(w['NetWeight']),
-            'lon': float(w['Longitude']) if w['Longitude'] else None,
-            'lat': float(w['Latitude']) if w['Latitude'] else None,
-        }
-        for dt, w in (
-            (weging_datum(w), w)
-            for w in input_wegingen['data']
-            if input_weging_key(w) not in bekend
-        )
-        if recent(dt)
-    ]
-
-    matching_containers = dichtstbijzijnde_container(containers, nieuwe_wegingen)
-
-    for w, (d, c) in zip(nieuwe_wegingen, matching_containers):
-        w.update({
-            'afstand': d,
-            'containers': [],   # c['_cf']['containers'] if c else [],
-            'containervolume': None,
-            'afvalvolume': None,
-            'cluster': '',
-            'adres': '',
-            'buurt': '',
-            'wijk': '',
-            'stadsdeel': '',
-        } if d is None or d > MAX_AFSTAND else {
-            'afstand': d,
-            'containers': c['_cf']['containers'],
-            'containervolume': c['_cf']['containervolume'],
-            'afvalvolume': c['_cf']['afvalvolume'],
-            'cluster': c['_cf']['cluster'],
-            'adres': c['_cf']['adres'],
-            'buurt': c['_buurt']['naam'],
-            'wijk': c['_buurt']['ligt_in'],
-            'stadsdeel': c['_buurt']['ligt_in_stadsdeel'],
-        })
-    
-    kale_wegingen = [w for w in nieuwe_wegingen if w['stadsdeel'] == '']
-    weging_buurt = Polylabel.label_containers(topo, kale_wegingen)
+    output = output_wegingen['data']
+    bekend = set(zip(output.get('systeem_id', ()), output.get('volgnummer', ())))
+    onbekend = [w for w in input_wegingen['data'] if input_weging_key(w) not in bekend]
 
-    for w, b in zip(kale_wegingen, weging_buurt):
-        if b:
-            w['buurt'] = b['naam']
-            w['wijk'] = b['ligt_in']
-            w['stadsdeel'] = b['ligt_in_stadsdeel']
+    verrijker = Verrijker(kenteken, containers, container_index, polylabel,
+                          locatie_memo, after=after)
+    nieuwe_wegingen = verrijk(verrijker, onbekend, processes=processes)
+    locatie_memo.save(cache_files.get('locaties'))
 
-    WegingenJSON.save(delta_file_out, {
+    nieuw = {
         'last_change': input_wegingen['last_change'],
         'data': nieuwe_wegingen,
-    }, last_delta=output_wegingen['last_change'])
-
-    output_wegingen['data'].extend(nieuwe_wegingen)
-    output_wegingen['last_change'] = input_wegingen['last_change']
-
-    if after:
-        theta = datum_ms(after)
-        output_wegingen['data'] = [w for w in output_wegingen['data']
-                                   if w['datum_ms'] > theta]
-
-    WegingenJSON.save(file_out, output_wegingen)
+    }
+    # Eerst de output met alle wegingen, dan pas de delta en als laatste de
+    # index: een browser die de nieuwe head ziet vindt de wegingen ook in de
+    # output, ook als het proces hier tussendoor stopt.
+    if weekly:
+        push_weeks(file_out, nieuw, after=after)
+    else:
+        WegingenJSON.append(file_out, nieuw, after=datum_ms(after) if after else None)
+    push_deltas(delta_file_out, nieuw, last_delta=output_wegingen['last_change'])
     logger.debug(' - done.')
 
 
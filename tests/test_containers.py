@@ -0,0 +1,60 @@
+from local.backup import save
+from local.push.containers import ContainersJSON, push
+
+T0 = '2023-05-01T00:00:00'
+T1 = '2023-05-02T00:00:00'
+
+
+def bronnen(container_fractie: int, putten_change: str) -> dict:
+    fracties = [{'id': 1, 'name': 'Rest'}, {'id': 2, 'name': 'Glas'}]
+    container_types = [{'id': 1, 'name': 'Pers', 'compressionContainer': True,
+                        'containerType': 'UNDER_GROUND', 'volume': 5.0, 'modifiedAt': T0}]
+    putten = [
+        {'id': i, 'location': {'geometry': {'coordinates': [4.9 + i / 1000, 52.37]}},
+         'modifiedAt': T0}
+        for i in range(3)
+    ]
+    # Een put die later verandert, zodat de push niet overgeslagen wordt.
+    putten.append({'id': 3, 'location': {'geometry': {'coordinates': [4.95, 52.38]}},
+                   'modifiedAt': putten_change})
+    clusters = [{'id': 10, 'name': 'cl10', 'wells': [f'/wells/{i}' for i in range(4)],
+                 'location': {'address': 'Damrak 1'}, 'modifiedAt': T0}]
+    containers = [
+        {'id': i, 'idNumber': f'C{i}', 'fraction': '/fractions/1',
+         'containerType': '/container_types/1', 'well': f'/wells/{i}', 'active': 1,
+         'modifiedAt': T0}
+        for i in range(4)
+    ]
+    # Bijgewerkt in een latere sync, met modifiedAt gelijk aan de last_change
+    # van de vorige keer (tracked_update haalt vanaf last_change op).
+    containers[0]['fraction'] = f'/fractions/{container_fractie}'
+    return {
+        'fracties': {'last_change': None, 'data': fracties},
+        'container_types': {'last_change': T0, 'data': container_types},
+        'putten': {'last_change': putten_change, 'data': putten},
+        'clusters': {'last_change': T0, 'data': clusters},
+        'containers': {'last_change': T0, 'data': containers},
+    }
+
+
+def write(tmp_path, sources: dict) -> dict:
+    filenames = {}
+    for name, items in sources.items():
+        filenames[name] = str(tmp_path / f'{name}.json')
+        save(filenames[name], {**items, 'last_sync': None})
+    return filenames
+
+
+def test_incremental_equals_full_rebuild_with_equal_timestamps(tmp_path):
+    cache_file = str(tmp_path / 'rijen.pickle')
+    incremental = str(tmp_path / 'containers.min.json')
+    push(incremental, write(tmp_path, bronnen(1, T0)), cache_file=cache_file)
+    push(incremental, write(tmp_path, bronnen(2, T1)), cache_file=cache_file)
+
+    full = str(tmp_path / 'full' / 'containers.min.json')
+    (tmp_path / 'full').mkdir()
+    push(full, write(tmp_path, bronnen(2, T1)))
+
+    rows = list(ContainersJSON.load(incremental)['data'].rows())
+    assert rows == list(ContainersJSON.load(full)['data'].rows())
+    assert {r['code']: r['fractie'] for r in rows}['C0'] == 'Glas'
@@ -0,0 +1,274 @@
+from multiprocessing import get_all_start_methods
+from operator import itemgetter
+
+import numpy as np
+import pytest
+from orjson import OPT_SERIALIZE_NUMPY, dumps
+
+from local.backup import load, save
+from local.push import jsontools
+from local.push.jsontools import (JSON, NUMPY_MIN, SHARED_STRINGS, CompressedJSON, IndexOrder,
+                                  LazyColumns, StringDictionary, crossindex, cumulative, delta,
+                                  divide, index, lookup, multiply, objects, pack, repeat, transpose,
+                                  unpack, unrepeat, untranspose)
+from local.push.wegingen import WegingenJSON
+
+DAG_MS = 24 * 3600 * 1000
+
+
+def wegingen(n: int, start: int = 0) -> list[dict]:
+    """n wegingen met alle velden van WegingenJSON, vanaf volgnummer start."""
+    return [
+        {
+            'systeem_id': 100 + i % 7,
+            'kenteken': f'AB-{i % 5:02d}-CD',
+            'fractie': ['Rest', 'Glas', 'Papier'][i % 3],
+            'volgnummer': i,
+            'lat': 52.37 + i / 10_000,
+            'lon': 4.89 - i / 20_000,
+            'datum_ms': 1_683_000_000_000 + i * DAG_MS // 10,
+            'tijd_ms': i * 61_000 % DAG_MS,
+            'datum_str': f'2023-05-{1 + i // 10:02d}',
+            'tijd_str': f'{i % 24:02d}:{i % 60:02d}',
+            'weekdag_ma1': str(1 + i % 7),
+            'eerste_weging': 15_000 + i % 11,
+            'tweede_weging': 14_000 + i % 13,
+            'netto_gewicht': 1_000 - i % 11 + i % 13,
+            'afstand': None if i % 9 == 0 else i % 40 / 2,
+            'containers': [f'C{i % 6}', f'C{i % 4}'] if i % 5 else [],
+            'containervolume': 5.0 if i % 5 else None,
+            'afvalvolume': 12.5 if i % 5 else None,
+            'cluster': '' if i % 4 == 0 else f'cl{i % 8}',
+            'adres': f'Damrak {i % 9}',
+            'buurt': f'B{i % 3}',
+            'wijk': f'W{i % 2}',
+            'stadsdeel': 'C',
+        }
+        for i in range(start, start + n)
+    ]
+
+
+def test_load_appended_without_rows(tmp_path):
+    filename = str(tmp_path / 'wegingen.min.json')
+    WegingenJSON.append(filename, {'last_change': 'x', 'data': {}})
+
+    obj = WegingenJSON.load(filename)
+    assert obj['last_change'] == 'x'
+    assert isinstance(obj['data'], LazyColumns)
+    assert list(obj['data']) == []
+    assert obj['data'].rows() == []
+
+    # De volgende push kan er gewoon rijen aan toevoegen.
+    rows = wegingen(3)
+    WegingenJSON.append(filename, {'last_change': 'y', 'data': transpose(rows)})
+    assert WegingenJSON.load(filename)['data'].rows() == WegingenJSON.normalise(
+        {'last_change': 'y', 'data': rows})['data']
+
+
+# Invoer vanaf NUMPY_MIN waarden, zodat de codecs hun NumPy versie proberen.
+GEMENGD = {
+    'int_str': [1, '1'] * 600,
+    'int_float': [1, 2.5, None, 3] * 300,
+    'bool_int': [True, 1, 0, False] * 300,
+    'int_none': [3, None, 5, 5, None, -2] * 200,
+    'float_none': [0.25, None, 1.5, 1.5] * 300,
+    'str_none': ['a', None, 'b', 'b'] * 300,
+    'ints': list(range(-600, 600)),
+}
+
+
+def gelijk(fun, *args):
+    """fun en fun.python geven byte-identieke JSON, of dezelfde fout."""
+    def run(f):
+        try:
+            return dumps(f(*args))
+        except Exception as err:
+            return type(err)
+    assert run(fun) == run(fun.python), (fun.__name__, args[1:])
+
+
+@pytest.mark.parametrize('name', GEMENGD)
+def test_numpy_codecs_equal_python(name):
+    values = GEMENGD[name]
+    assert len(values) >= NUMPY_MIN
+
+    gelijk(delta, values)
+    gelijk(pack, values)
+    for factor in (10, 0.001):
+        gelijk(multiply, values, factor)
+        gelijk(divide, values, factor)
+    for order in IndexOrder:
+        gelijk(index, objects(values), order)
+    gelijk(unrepeat, objects(values))
+    gelijk(repeat, (values, [1, 2, 0] * (len(values) // 3) + [1] * (len(values) % 3)))
+    gelijk(lookup, np.arange(len(values))[::-1], values)
+    if name in ('int_str', 'ints', 'bool_int'):
+        gelijk(crossindex, objects(values), values[::-1])
+
+    encoded = delta.python(values) if name in ('int_none', 'ints') else None
+    if encoded:
+        gelijk(cumulative, encoded)
+    if name == 'ints':
+        gelijk(unpack, pack.python(values))
+
+
+def test_save_skips_unchanged_content(tmp_path):
+    filename = str(tmp_path / 'wegingen.min.json')
+    rows = wegingen(20)
+    digest = WegingenJSON.save(filename, {'last_change': 'a', 'data': rows})
+
+    # Alleen last_change anders: zelfde hash, en het bestand blijft staan.
+    assert WegingenJSON.save(filename, {'last_change': 'b', 'data': rows},
+                             previous=digest) == digest
+    assert WegingenJSON.load(filename)['last_change'] == 'a'
+
+    changed = WegingenJSON.save(filename, {'last_change': 'c', 'data': rows[1:]},
+                                previous=digest)
+    assert changed != digest
+    assert WegingenJSON.load(filename)['last_change'] == 'c'
+
+
+@pytest.mark.parametrize('values', [
+    [],
+    [0],
+    [0, -1, 1, -2, 2, 3],
+    list(range(-3000, 3000, 7)),
+    [2 ** 52 - 1, -2 ** 52, 0, 5],
+    [10 ** 12 + i * 997 for i in range(2000)],
+])
+def test_pack_roundtrip(values):
+    packed = pack(values)
+    assert unpack(packed) == values
+    assert unpack.python(packed) == values
+    assert pack.python(values) == packed
+
+
+def test_pack_width():
+    # Kleine getallen met een vaste breedte, een grote uitschieter als varints.
+    assert pack([0, 1, 2, 3] * 300).split(':')[0] == '3'
+    assert pack([1] * 1200 + [2 ** 40]).split(':')[0] == 'v'
+    with pytest.raises(ValueError):
+        pack([2 ** 53])
+    with pytest.raises(TypeError):
+        pack([1.5])
+
+
+# 'b' staat niet meer in de standaard specs, maar werkt nog in een eigen spec.
+class Getallen(CompressedJSON):
+    sort_order = ('n',)
+    transforms = {
+        'data': {
+            'n': ['d', 'b'],
+            'naam': ['i', 'b'],
+        },
+        'raw': {
+            'naam': ['w', SHARED_STRINGS, 'd', 'b'],
+        },
+    }
+    index_order = {
+        'naam': IndexOrder.UNSORTED,
+    }
+
+
+def test_shared_strings_across_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(StringDictionary, 'opened', {})
+    a = {'last_change': 'a', 'data': untranspose({'n': [3, 1, 2], 'naam': ['x', 'y', 'x']})}
+    b = {'last_change': 'b', 'data': untranspose({'n': [5, 4], 'naam': ['z', 'y']})}
+    Getallen.save(str(tmp_path / 'a.min.json'), a)
+    Getallen.save(str(tmp_path / 'b.min.json'), b)
+
+    strings = load(str(tmp_path / SHARED_STRINGS))
+    # Gesorteerd op n komt 'y' eerst; 'y' houdt in b zijn id.
+    assert strings == {'version': 2, 'strings': ['y', 'x', 'z']}
+    assert load(str(tmp_path / 'a.min.json'))['dictionaries'] == {SHARED_STRINGS: 1}
+    assert load(str(tmp_path / 'b.min.json'))['dictionaries'] == {SHARED_STRINGS: 2}
+
+    # Een nieuw proces leest alleen de bestanden.
+    monkeypatch.setattr(StringDictionary, 'opened', {})
+    for name, obj in (('a', a), ('b', b)):
+        loaded = Getallen.load(str(tmp_path / f'{name}.min.json'))
+        assert loaded['data'].rows() == Getallen.normalise(obj)['data']
+
+    # Een bestand dat een nieuwere versie nodig heeft dan er staat.
+    save(str(tmp_path / SHARED_STRINGS), {'version': 1, 'strings': ['x', 'y']})
+    monkeypatch.setattr(StringDictionary, 'opened', {})
+    with pytest.raises(ValueError):
+        Getallen.load(str(tmp_path / 'b.min.json'))['data'].rows()
+
+
+def rijen(obj: JSON) -> list[JSON]:
+    return sorted(obj['data'], key=itemgetter('systeem_id', 'volgnummer'))
+
+
+def test_append_trim_merge(tmp_path):
+    filename = str(tmp_path / 'wegingen.min.json')
+    rows = wegingen(40)
+    for k, (start, end) in enumerate([(0, 20), (20, 30), (30, 40)]):
+        WegingenJSON.append(filename, {'last_change': str(k), 'data': transpose(rows[start:end])})
+    # 20, 10 blijft staan; met nog 10 erbij wordt het 20, 20 en dan 40.
+    assert [b['size'] for b in load(filename)['blocks']] == [40]
+    loaded = WegingenJSON.load(filename)
+    assert loaded['last_change'] == '2'
+    assert rijen({'data': loaded['data'].rows()}) == rijen(
+        WegingenJSON.normalise({'last_change': '2', 'data': rows}))
+
+    # after valt midden in een blok: alleen dat wordt opnieuw gecodeerd.
+    more = wegingen(10, start=40)
+    after = rows[24]['datum_ms']
+    WegingenJSON.append(filename, {'last_change': '3', 'data': transpose(more)}, after=after)
+    blocks = load(filename)['blocks']
+    assert [b['size'] for b in blocks] == [15, 10]
+    assert blocks[0]['range'][0] > after
+    kept = [r for r in rows + more if r['datum_ms'] > after]
+    assert rijen({'data': WegingenJSON.load(filename)['data'].rows()}) == rijen(
+        WegingenJSON.normalise({'last_change': '3', 'data': kept}))
+
+    # Alles vóór after: geen blokken meer.
+    WegingenJSON.append(filename, {'last_change': '4', 'data': {}}, after=more[-1]['datum_ms'])
+    assert load(filename)['blocks'] == []
+    assert WegingenJSON.load(filename)['data'].rows() == []
+
+
+def test_lazy_columns(tmp_path):
+    filename = str(tmp_path / 'wegingen.min.json')
+    rows = wegingen(30)
+    WegingenJSON.save(filename, {'last_change': 'a', 'data': rows})
+    expected = transpose(WegingenJSON.normalise({'last_change': 'a', 'data': rows})['data'])
+
+    data = WegingenJSON.load(filename)['data']
+    assert list(data) == list(WegingenJSON.transforms['data'])
+    assert repr(data).endswith('(gedecodeerd: -)>')
+    assert data['volgnummer'] == expected['volgnummer']
+    assert data['adres'] == expected['adres']
+    assert repr(data).endswith('(gedecodeerd: volgnummer, adres)>')
+    with pytest.raises(KeyError):
+        data['onbekend']
+    assert data.decode_all() == expected
+    assert data.rows() == untranspose(expected)
+
+    asked = []
+
+    def decode(fields):
+        asked.append(list(fields))
+        return {f: [f] for f in fields}
+
+    lazy = LazyColumns(decode, ['a', 'b', 'c'])
+    assert lazy['b'] == ['b']
+    assert lazy['b'] == ['b']
+    assert lazy.rows() == [{'a': 'a', 'b': 'b', 'c': 'c'}]
+    assert asked == [['b'], ['a', 'c']]
+
+
+@pytest.mark.skipif('fork' not in get_all_start_methods(), reason='run_plans heeft fork nodig')
+def test_parallel_plans_equal_serial(tmp_path, monkeypatch):
+    # Kleine stukken, zodat 'containers' ('j>') ook in stukken gaat.
+    monkeypatch.setattr(jsontools, 'PARALLEL_CHUNK', 16)
+    obj = {'last_change': 'a', 'data': wegingen(100)}
+    with StringDictionary.beside(str(tmp_path / 'wegingen.min.json')):
+        serial = WegingenJSON.transform(obj, processes=1)
+        parallel = WegingenJSON.transform(obj, processes=2)
+        assert dumps(parallel, option=OPT_SERIALIZE_NUMPY) == dumps(serial, option=OPT_SERIALIZE_NUMPY)
+
+        expected = WegingenJSON.untransform(serial, processes=1)
+        assert WegingenJSON.untransform(serial, processes=2) == expected
+    assert expected == WegingenJSON.normalise(obj)
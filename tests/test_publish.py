@@ -0,0 +1,55 @@
+import os
+
+from local.backup import load
+from local.push.publish import KEEP_VERSIONS, content_hash, hashed_filename, publish
+
+
+def schrijf(filename: str, data: bytes) -> str:
+    with open(filename, 'wb') as f:
+        f.write(data)
+    return os.path.basename(hashed_filename(filename, content_hash(data)))
+
+
+def test_keeps_manifest_versions(tmp_path):
+    filename = str(tmp_path / 'containers.min.json')
+    inhoud = [b'{"a": %d}' % i for i in range(KEEP_VERSIONS + 1)]
+    names = []
+    for data in inhoud:
+        names.append(schrijf(filename, data))
+        publish([filename])
+    assert load(str(tmp_path / 'manifest.json'))['versions']['containers.min.json'] == \
+        names[:0:-1]
+    assert not os.path.exists(tmp_path / names[0])
+    assert not os.path.exists(tmp_path / (names[0] + '.gz'))
+
+    # Terug naar een eerdere inhoud: die versie is weer de nieuwste, ook al is
+    # zijn kopie het oudste bestand.
+    schrijf(filename, inhoud[1])
+    manifest = publish([filename])
+    assert manifest['files']['containers.min.json'] == names[1]
+    assert manifest['versions']['containers.min.json'] == [names[1], names[3], names[2]]
+    for name in names[1:]:
+        assert os.path.exists(tmp_path / name)
+        assert os.path.exists(tmp_path / (name + '.gz'))
+
+    schrijf(filename, inhoud[0])
+    manifest = publish([filename])
+    assert manifest['versions']['containers.min.json'] == [names[0], names[1], names[3]]
+    assert not os.path.exists(tmp_path / names[2])
+
+
+def test_prunes_unpublished_files(tmp_path):
+    containers = str(tmp_path / 'containers.min.json')
+    wegingen = str(tmp_path / 'wegingen.min.json')
+    schrijf(containers, b'{}')
+    for data in (b'[1]', b'[2]'):
+        schrijf(wegingen, data)
+        publish([containers, wegingen])
+
+    manifest = publish([containers])
+    assert 'wegingen.min.json' not in manifest['files']
+    assert 'wegingen.min.json' not in manifest['versions']
+    assert [f for f in os.listdir(tmp_path) if f.startswith('wegingen')] == ['wegingen.min.json']
+    published = manifest['files']['containers.min.json']
+    assert os.path.exists(tmp_path / published)
+    assert os.path.exists(tmp_path / (published + '.gz'))